@@ -5,21 +5,67 @@ las siguientes columnas:
 
 rms_value, rms_avg, rms_std, is_day, weather_type, sound_category
 
+También puede partir de una grabación WAV (INMP441.record_wav o el audio
+reensamblado por raspberry_pi/src/audio_stream.py con AUDIO_RECORD_DIR):
+cada intervalo de --interval-ms se convierte en una fila con su rms_value y,
+con --spectral, las características espectrales de audio_stream.
+
+  python dataset_generator.py --wav esp32.wav --is-day día \
+      --weather soleado --category "Ambiente tranquilo" --spectral
+
+La entrada se procesa por trozos de --chunksize filas (memoria acotada sea
+cual sea el tamaño del archivo); el estado de la ventana móvil pasa de un
+trozo al siguiente, así que el resultado es el mismo que con el archivo
+entero en memoria. Si la entrada tiene columna de dispositivo
+(--device-column, por defecto "device") cada dispositivo lleva su propia
+ventana. Con varios archivos de entrada se procesan en paralelo (cada
+archivo es independiente) y -o es el directorio de salida.
+
+  python dataset_generator.py semana1.csv semana2.csv -o salida/ --format parquet
+
+Formatos de salida (--format):
+  csv      igual que siempre
+  parquet  necesita pyarrow
+  npy      directorio con un .npy por columna; las columnas de texto se
+           guardan como códigos int32 y sus categorías en meta.json
 """
+import argparse
+import json
+import os
+import sys
+import wave
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
 import pandas as pd
 
+HERE = Path(__file__).resolve().parent
+
+# Ventana móvil compartida con el runtime de la Raspberry (raspberry_pi/src/rolling.py).
+# Se añade al final del path para no tapar módulos estándar (p.ej. secrets).
+sys.path.append(str(HERE.parent.parent / "raspberry_pi" / "src"))
+from rolling import KeyedRollingStats, rolling_mean_std  # noqa: E402
+from audio_stream import SPECTRAL_FEATURE_NAMES, interval_features  # noqa: E402
+
 
 def rolling_features(rms_series, window):
-    avg = rms_series.rolling(window=window, min_periods=1).mean()
-    std = rms_series.rolling(window=window, min_periods=1).std().fillna(0.0)
-    return avg, std
+    """
+    Media y desviación estándar móviles (ddof=1, min_periods=1, std inicial 0).
+    Usa el mismo cálculo incremental que ml.update_rms_and_get_stats, idéntico
+    a rms_series.rolling(window, min_periods=1).mean()/.std().fillna(0.0).
+    """
+    avg, std = rolling_mean_std(rms_series.tolist(), window)
+    return (pd.Series(avg, index=rms_series.index, dtype=float),
+            pd.Series(std, index=rms_series.index, dtype=float))
 
 
-HERE = Path(__file__).resolve().parent
 INPUT_FILENAME = HERE / "data.csv"
 OUTPUT_FILENAME = HERE / "dataset.csv"
 WINDOW = 10
+CHUNK_ROWS = 100_000
+DEVICE_COLUMN = "device"
+TEXT_COLUMNS = ("is_day", "weather_type", "sound_category")
+OUTPUT_FORMATS = {"csv": ".csv", "parquet": ".parquet", "npy": ""}
 
 
 def ensure_columns(df: pd.DataFrame):
@@ -43,13 +89,61 @@ def ensure_columns(df: pd.DataFrame):
     return df
 
 
-def main():
-    # Leer input
-    if not INPUT_FILENAME.exists():
-        raise SystemExit(f"ERROR: no se encontró {INPUT_FILENAME}")
+def iter_wav(path, block_samples):
+    """Bloques de muestras int16 (primer canal) de block_samples como máximo."""
+    with wave.open(str(path), "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise SystemExit(f"ERROR: {path} no es PCM de 16 bits")
+        rate = wav.getframerate()
+        channels = wav.getnchannels()
+        remaining = wav.getnframes()
+        block_samples = block_samples or remaining
+        while remaining > 0:
+            n = min(block_samples, remaining)
+            samples = np.frombuffer(wav.readframes(n), dtype="<i2")
+            remaining -= n
+            yield samples[::channels], rate
+
+
+def wav_chunks(path, interval_ms, is_day, weather_type, sound_category, spectral,
+               chunk_rows=CHUNK_ROWS):
+    """
+    Filas con el esquema de data.csv, de chunk_rows en chunk_rows. Los bloques
+    leídos son múltiplos exactos del intervalo, así que cada intervalo (y sus
+    ventanas espectrales) queda entero dentro de un bloque.
+    """
+    with wave.open(str(path), "rb") as wav:
+        rate = wav.getframerate()
+    step = int(rate * interval_ms / 1000)
+    for samples, rate in iter_wav(path, step * chunk_rows):
+        rms, features = interval_features(samples, rate, interval_ms)
+        if not len(rms):
+            continue
+        # El ESP32 envía el RMS truncado a entero
+        df = pd.DataFrame({"rms_value": np.floor(rms).astype(int)})
+        df["is_day"] = is_day
+        df["weather_type"] = weather_type
+        df["sound_category"] = sound_category
+        if spectral:
+            for i, name in enumerate(SPECTRAL_FEATURE_NAMES):
+                df[name] = features[:, i]
+        yield df
+
+
+def frame_from_wav(path, interval_ms, is_day, weather_type, sound_category, spectral):
+    """Una fila por intervalo de la grabación, con el esquema de data.csv."""
+    chunks = list(wav_chunks(path, interval_ms, is_day, weather_type, sound_category, spectral))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame({"rms_value": []})
 
-    df = pd.read_csv(INPUT_FILENAME)
 
+def csv_chunks(path, chunk_rows=CHUNK_ROWS, device_column=DEVICE_COLUMN):
+    # El dispositivo se lee siempre como texto: un trozo con ids numéricos
+    # no debe dar una clave distinta que otro con ids mixtos
+    return pd.read_csv(path, chunksize=chunk_rows, dtype={device_column: str})
+
+
+def prepare_chunk(df, device_column=DEVICE_COLUMN):
+    """Normaliza un trozo de entrada (rms_value numérico, columnas por defecto)."""
     if "rms_value" not in df.columns:
         raise SystemExit("ERROR: el CSV debe contener la columna 'rms_value'.")
 
@@ -58,19 +152,269 @@ def main():
 
     # Asegurar columnas adicionales
     df = ensure_columns(df)
+    for col in TEXT_COLUMNS + (device_column,):
+        if col in df.columns:
+            df[col] = df[col].astype(str)
+    return df
 
-    # Calcular características móviles
-    df["rms_avg"], df["rms_std"] = rolling_features(df["rms_value"], WINDOW)
 
-    # Seleccionar y ordenar columnas de salida según lo pedido
-    out_cols = ["rms_value", "rms_avg", "rms_std", "is_day", "weather_type", "sound_category"]
+def add_rolling_features(df, stats, device_column=DEVICE_COLUMN):
+    """
+    Añade rms_avg y rms_std continuando las ventanas de `stats`
+    (KeyedRollingStats, una ventana por dispositivo) desde el trozo anterior.
+    """
+    values = df["rms_value"].to_numpy(dtype=float)
+    avg = np.empty(len(df))
+    std = np.empty(len(df))
+    if device_column in df.columns:
+        groups = df.groupby(device_column, sort=False, dropna=False).indices.items()
+    else:
+        groups = [(None, slice(None))]
+    for device, rows in groups:
+        means, stds = rolling_mean_std(values[rows], stats.window, stats=stats.get(device))
+        avg[rows] = means
+        std[rows] = stds
+    df["rms_avg"] = avg
+    df["rms_std"] = std
+    return df
 
+
+def output_columns(df, device_column=DEVICE_COLUMN):
     # Si existieran columnas extra en el CSV original, se ignoran en la salida
-    out_df = df.reindex(columns=out_cols)
+    out_cols = ["rms_value", "rms_avg", "rms_std", "is_day", "weather_type", "sound_category"]
+    out_cols += [c for c in SPECTRAL_FEATURE_NAMES if c in df.columns]
+    if device_column in df.columns:
+        out_cols.insert(0, device_column)
+    return out_cols
+
+
+def _numeric_as_float(df):
+    """Columnas numéricas a float64 para que todos los trozos tengan el mismo tipo."""
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    return df.astype({c: np.float64 for c in numeric})
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self.rows = 0
+
+    def write(self, df):
+        df.to_csv(self._file, header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """Un row group por trozo (pyarrow se importa solo si se pide este formato)."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("ERROR: --format parquet necesita pyarrow (pip install pyarrow)")
+        self._pa = pa
+        self._pq = pq
+        self.path = path
+        self._writer = None
+        self.rows = 0
+
+    def write(self, df):
+        table = self._pa.Table.from_pandas(_numeric_as_float(df), preserve_index=False)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(str(self.path), table.schema)
+        else:
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class NpyWriter:
+    """
+    Directorio con un <columna>.npy por columna. Cada trozo se añade a un
+    archivo binario sin cabecera y al cerrar se copia, por bloques, a un .npy
+    ya con su número de filas (np.load(..., mmap_mode="r") para leerlo).
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._files = {}
+        self._dtypes = {}
+        self._categories = {}
+        self.rows = 0
+
+    def _open(self, df):
+        for col in df.columns:
+            if pd.api.types.is_numeric_dtype(df[col]):
+                self._dtypes[col] = np.dtype(np.float64)
+            else:
+                self._dtypes[col] = np.dtype(np.int32)
+                self._categories[col] = {}
+            self._files[col] = open(self.path / f"{col}.bin", "wb")
+
+    def _codes(self, col, values):
+        categories = self._categories[col]
+        local, uniques = pd.factorize(values.astype(str))
+        mapping = np.array([categories.setdefault(u, len(categories)) for u in uniques], dtype=np.int32)
+        return mapping[local]
+
+    def write(self, df):
+        if not self._files:
+            self._open(df)
+        for col, f in self._files.items():
+            if col in self._categories:
+                values = self._codes(col, df[col])
+            else:
+                values = df[col].to_numpy(dtype=np.float64)
+            f.write(np.ascontiguousarray(values, dtype=self._dtypes[col]).tobytes())
+        self.rows += len(df)
+
+    def close(self):
+        for col, f in self._files.items():
+            f.close()
+            raw = self.path / f"{col}.bin"
+            dtype = self._dtypes[col]
+            out = np.lib.format.open_memmap(self.path / f"{col}.npy", mode="w+", dtype=dtype,
+                                            shape=(self.rows,))
+            if self.rows:
+                src = np.memmap(raw, dtype=dtype, mode="r", shape=(self.rows,))
+                for start in range(0, self.rows, CHUNK_ROWS):
+                    out[start:start + CHUNK_ROWS] = src[start:start + CHUNK_ROWS]
+                del src
+            out.flush()
+            del out
+            raw.unlink()
+        meta = {
+            "rows": self.rows,
+            "columns": list(self._files),
+            "categories": {col: list(cats) for col, cats in self._categories.items()},
+        }
+        with open(self.path / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+WRITERS = {"csv": CsvWriter, "parquet": ParquetWriter, "npy": NpyWriter}
+
+
+def input_chunks(path, chunk_rows, device_column, wav_options):
+    if Path(path).suffix.lower() == ".wav":
+        return wav_chunks(path, chunk_rows=chunk_rows, **wav_options)
+    if not Path(path).exists():
+        raise SystemExit(f"ERROR: no se encontró {path}")
+    return csv_chunks(path, chunk_rows, device_column)
+
+
+def generate(input_path, output_path, fmt="csv", chunk_rows=CHUNK_ROWS, device_column=DEVICE_COLUMN,
+             wav_options=None):
+    """Procesa un archivo por trozos y devuelve (columnas, filas escritas)."""
+    stats = KeyedRollingStats(WINDOW)
+    writer = WRITERS[fmt](output_path)
+    out_cols = None
+    try:
+        for df in input_chunks(input_path, chunk_rows, device_column, wav_options or {}):
+            df = prepare_chunk(df, device_column)
+            df = add_rolling_features(df, stats, device_column)
+            if out_cols is None:
+                out_cols = output_columns(df, device_column)
+            writer.write(df.reindex(columns=out_cols))
+    finally:
+        writer.close()
+    return out_cols or [], writer.rows
+
+
+def _generate_job(job):
+    return generate(*job)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Genera dataset.csv con características móviles")
+    parser.add_argument("inputs", nargs="*", type=Path,
+                        help="CSV (esquema de data.csv) o WAV de entrada; por defecto data.csv")
+    parser.add_argument("--wav", type=Path, help="Grabación WAV a usar en lugar de data.csv")
+    parser.add_argument("--interval-ms", type=int, default=200,
+                        help="Duración de cada lectura al partir de un WAV")
+    parser.add_argument("--is-day", default="día")
+    parser.add_argument("--weather", default="unknown")
+    parser.add_argument("--category", default="unknown")
+    parser.add_argument("--spectral", action="store_true",
+                        help="Añadir las características espectrales de audio_stream")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="csv")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS,
+                        help="Filas por trozo (acota la memoria)")
+    parser.add_argument("--device-column", default=DEVICE_COLUMN)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Procesos para varios archivos de entrada")
+    parser.add_argument("-o", "--output", type=Path,
+                        help="Archivo de salida (con varias entradas, directorio)")
+    return parser.parse_args(argv)
+
+
+def output_paths(inputs, output, fmt):
+    """
+    Una salida por entrada. Con varias entradas los nombres salen de
+    <stem>_dataset; si dos entradas comparten stem se les antepone su
+    directorio (y, si aún coinciden, un índice), para que dos procesos nunca
+    escriban el mismo archivo. Una misma entrada repetida es un error.
+    """
+    suffix = OUTPUT_FORMATS[fmt]
+    if len(inputs) == 1:
+        return [output or OUTPUT_FILENAME.with_suffix(suffix)]
+    resolved = [Path(path).resolve() for path in inputs]
+    repeated = sorted({str(p) for p in resolved if resolved.count(p) > 1})
+    if repeated:
+        raise SystemExit(f"ERROR: entradas repetidas: {', '.join(repeated)}")
+    out_dir = output or HERE
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    stems = [path.stem for path in resolved]
+    names = [f"{path.parent.name}_{path.stem}" if stems.count(path.stem) > 1 else path.stem
+             for path in resolved]
+    seen = {}
+    paths = []
+    for name in names:
+        seen[name] = seen.get(name, 0) + 1
+        if names.count(name) > 1:
+            name = f"{name}_{seen[name]}"
+        paths.append(out_dir / f"{name}_dataset{suffix}")
+    if len(set(paths)) != len(paths):
+        raise SystemExit("ERROR: varias entradas tendrían la misma salida; renombra alguna")
+    return paths
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Leer input
+    inputs = list(args.inputs)
+    if args.wav is not None:
+        inputs.append(args.wav)
+    if not inputs:
+        inputs = [INPUT_FILENAME]
+    wav_options = {
+        "interval_ms": args.interval_ms, "is_day": args.is_day, "weather_type": args.weather,
+        "sound_category": args.category, "spectral": args.spectral,
+    }
+    jobs = [(path, out, args.format, args.chunksize, args.device_column, wav_options)
+            for path, out in zip(inputs, output_paths(inputs, args.output, args.format))]
+
+    if len(jobs) == 1:
+        results = [_generate_job(jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as pool:
+            results = list(pool.map(_generate_job, jobs))
 
-    out_df.to_csv(OUTPUT_FILENAME, index=False)
-    print(f"Dataset escrito en: {OUTPUT_FILENAME}")
-    print("Columnas de salida:", ", ".join(out_df.columns))
+    for job, (out_cols, rows) in zip(jobs, results):
+        print(f"Dataset escrito en: {job[1]} ({rows} filas)")
+    print("Columnas de salida:", ", ".join(results[0][0]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,273 @@
+"""
+batch_score.py
+Puntúa offline una grabación completa (CSV con el formato de data.csv o de
+dataset.csv) con el modelo entrenado, sin pasar fila a fila por
+test_model.predict_from_list:
+
+  - lee el CSV por trozos de --chunksize filas (memoria acotada);
+  - si faltan rms_avg/rms_std los calcula vectorizados
+    (rolling.window_mean_std), continuando la ventana de cada dispositivo
+    de un trozo al siguiente como dataset_generator.py;
+  - evalúa cada trozo entero de una vez: forward pass NumPy del .npz o,
+    con --model x.tflite, el intérprete TFLite por lotes (export_tflite.py,
+    también para los modelos cuantizados);
+  - escribe la entrada con rms_avg/rms_std, la clase predicha y una
+    columna prob_<clase> por clase (--format csv, parquet o npy);
+  - si la entrada trae sound_category, matriz de confusión y precisión /
+    recall por clase (--report la guarda en JSON).
+
+  python batch_score.py ../datasets/data.csv -o data_scored.csv
+  python batch_score.py semana.csv --model sound_classifier_int8.tflite --format npy
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from model_metadata import raw_matrix, read_metadata, scale_offset
+
+HERE = Path(__file__).resolve().parent
+
+# Lectura por trozos, escritores y ventana móvil compartidos con el generador de datasets
+sys.path.append(str(HERE.parent / "datasets"))
+import dataset_generator  # noqa: E402
+from rolling import window_mean_std  # noqa: E402
+
+DEFAULT_MODEL = HERE / "sound_classifier.npz"
+CHUNK_ROWS = 200_000
+UNLABELED = ("unknown", "nan", "")
+
+
+class NumpyModel:
+    """Forward pass float32 del .npz (igual que el backend NumPy de la Raspberry)."""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            activations = [str(a) for a in data['activations']]
+            self.layers = [(data[f"W{i}"].astype(np.float32), data[f"b{i}"].astype(np.float32),
+                            activations[i]) for i in range(len(activations))]
+
+    def predict_probs(self, x):
+        h = x
+        for kernel, bias, activation in self.layers:
+            h = h @ kernel
+            h += bias
+            if activation == 'relu':
+                np.maximum(h, 0.0, out=h)
+            elif activation == 'softmax':
+                h -= h.max(axis=1, keepdims=True)
+                np.exp(h, out=h)
+                h /= h.sum(axis=1, keepdims=True)
+        return h
+
+
+class TFLiteModel:
+    """Intérprete TFLite por lotes (TensorFlow se importa solo si se pide un .tflite)."""
+
+    def __init__(self, path, batch):
+        import export_tflite
+
+        self._predict = export_tflite.predict
+        with open(path, "rb") as f:
+            self.content = f.read()
+        self.batch = batch
+
+    def predict_probs(self, x):
+        return self._predict(self.content, x, self.batch)
+
+
+class Scorer:
+    """Modelo + metadatos: de vectores crudos a probabilidades."""
+
+    def __init__(self, model_path, batch=1024):
+        self.metadata = read_metadata(model_path)
+        self.feature_names = self.metadata['feature_names']
+        self.class_names = list(self.metadata['class_names'])
+        if str(model_path).endswith(".tflite"):
+            self.model = TFLiteModel(model_path, batch)
+        else:
+            self.model = NumpyModel(model_path)
+        # Con el escalado dentro del grafo el modelo recibe los valores crudos
+        if self.metadata['normalized_in_graph']:
+            self.scale = self.offset = None
+        else:
+            scale, offset = scale_offset(self.metadata['feature_min'], self.metadata['feature_max'])
+            self.scale, self.offset = scale.astype(np.float32), offset.astype(np.float32)
+
+    def predict_probs(self, raw):
+        x = np.asarray(raw, dtype=np.float32)
+        if self.scale is not None:
+            x = x * self.scale + self.offset
+        return self.model.predict_probs(x)
+
+
+def add_rolling_columns(df, histories, window, device_column):
+    """rms_avg/rms_std vectorizados, una ventana por dispositivo (histories: dispositivo -> cola)."""
+    values = df["rms_value"].to_numpy(dtype=float)
+    avg = np.empty(len(df))
+    std = np.empty(len(df))
+    if device_column in df.columns:
+        groups = df.groupby(device_column, sort=False, dropna=False).indices.items()
+    else:
+        groups = [(None, slice(None))]
+    for device, rows in groups:
+        avg[rows], std[rows], histories[device] = window_mean_std(
+            values[rows], window, history=histories.get(device))
+    df["rms_avg"] = avg
+    df["rms_std"] = std
+    return df
+
+
+class ConfusionMatrix:
+    """Matriz de confusión acumulada por trozos (filas: real, columnas: predicha)."""
+
+    def __init__(self, class_names):
+        self.class_names = class_names
+        self.matrix = np.zeros((len(class_names), len(class_names)), dtype=np.int64)
+        self.unlabeled = 0
+        self.unknown_labels = {}
+
+    def update(self, labels, preds):
+        k = len(self.class_names)
+        labels = labels.astype(str)
+        true = pd.Categorical(labels, categories=self.class_names).codes.astype(np.int64)
+        known = true >= 0
+        for label, n in labels[~known].value_counts().items():
+            if label in UNLABELED:
+                self.unlabeled += int(n)
+            else:
+                self.unknown_labels[label] = self.unknown_labels.get(label, 0) + int(n)
+        self.matrix += np.bincount(true[known] * k + preds[known], minlength=k * k).reshape(k, k)
+
+    def summary(self):
+        m = self.matrix
+        total = int(m.sum())
+        tp = np.diag(m)
+        predicted = m.sum(axis=0)
+        actual = m.sum(axis=1)
+        per_class = {
+            name: {
+                "support": int(actual[i]),
+                "precision": float(tp[i] / predicted[i]) if predicted[i] else None,
+                "recall": float(tp[i] / actual[i]) if actual[i] else None,
+            }
+            for i, name in enumerate(self.class_names)
+        }
+        return {
+            "labeled_rows": total,
+            "accuracy": float(tp.sum() / total) if total else None,
+            "classes": self.class_names,
+            "confusion_matrix": m.tolist(),
+            "per_class": per_class,
+            "unlabeled_rows": self.unlabeled,
+            "unknown_labels": self.unknown_labels,
+        }
+
+    def print(self):
+        s = self.summary()
+        if not s["labeled_rows"]:
+            print("Sin filas etiquetadas con clases del modelo.")
+            return
+        width = max(len(n) for n in self.class_names)
+        print(f"\nMatriz de confusión (filas: real, columnas: predicha) - "
+              f"precisión global {s['accuracy']:.4f} sobre {s['labeled_rows']} filas")
+        print(" " * (width + 2) + " ".join(f"{i:>9}" for i in range(len(self.class_names))))
+        for i, (name, row) in enumerate(zip(self.class_names, self.matrix)):
+            stats = s["per_class"][name]
+            recall = "-" if stats["recall"] is None else f"{stats['recall']:.3f}"
+            precision = "-" if stats["precision"] is None else f"{stats['precision']:.3f}"
+            print(f"{name:<{width}} {i}" + " ".join(f"{v:>9}" for v in row)
+                  + f"   precision {precision}  recall {recall}")
+        if s["unknown_labels"]:
+            print(f"Etiquetas que el modelo no conoce: {s['unknown_labels']}")
+
+
+def score(input_path, output_path, model_path=DEFAULT_MODEL, fmt="csv", chunk_rows=CHUNK_ROWS,
+          device_column=dataset_generator.DEVICE_COLUMN, batch=1024):
+    """
+    Puntúa input_path por trozos y escribe output_path. Devuelve
+    (filas, segundos, ConfusionMatrix o None si la entrada no tiene etiquetas).
+    Avisa de los climas que no tienen columna en el modelo (no activan ningún flag).
+    """
+    start = time.perf_counter()
+    scorer = Scorer(model_path, batch)
+    prob_columns = [f"prob_{name}" for name in scorer.class_names]
+    class_names = np.array(scorer.class_names, dtype=object)
+    writer = dataset_generator.WRITERS[fmt](output_path)
+    weathers = {name[len('weather_'):] for name in scorer.feature_names[4:]}
+    unknown_weather = {}
+    histories = {}
+    confusion = None
+    rows = 0
+    try:
+        for df in dataset_generator.csv_chunks(input_path, chunk_rows, device_column):
+            if rows == 0 and "sound_category" in df.columns:
+                confusion = ConfusionMatrix(scorer.class_names)
+            has_rolling = "rms_avg" in df.columns and "rms_std" in df.columns
+            df = dataset_generator.prepare_chunk(df, device_column)
+            if not has_rolling:
+                df = add_rolling_columns(df, histories, dataset_generator.WINDOW, device_column)
+
+            counts = df.loc[~df["weather_type"].isin(weathers), "weather_type"].value_counts()
+            for name, n in counts.items():
+                unknown_weather[name] = unknown_weather.get(name, 0) + int(n)
+
+            probs = scorer.predict_probs(raw_matrix(df, scorer.feature_names))
+            preds = probs.argmax(axis=1)
+            if confusion is not None:
+                confusion.update(df["sound_category"], preds)
+
+            df["predicted_category"] = class_names[preds]
+            for j, col in enumerate(prob_columns):
+                df[col] = probs[:, j]
+            writer.write(df)
+            rows += len(df)
+    finally:
+        writer.close()
+    if unknown_weather:
+        print(f"⚠️ Climas sin columna en el modelo (filas): {unknown_weather}")
+    return rows, time.perf_counter() - start, confusion
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Puntuación por lotes de grabaciones CSV")
+    parser.add_argument("input", help="CSV con el formato de data.csv o dataset.csv")
+    parser.add_argument("-o", "--output", help="Salida (por defecto <entrada>_scored.<formato>)")
+    parser.add_argument("--model", default=str(DEFAULT_MODEL),
+                        help="Modelo .npz (NumPy) o .tflite, con su .json de metadatos")
+    parser.add_argument("--format", choices=sorted(dataset_generator.WRITERS), default="csv")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS, help="Filas por trozo")
+    parser.add_argument("--device-column", default=dataset_generator.DEVICE_COLUMN)
+    parser.add_argument("--batch", type=int, default=1024, help="Tamaño de lote del intérprete TFLite")
+    parser.add_argument("--report", help="Guardar la matriz de confusión y métricas en este JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.input):
+        raise SystemExit(f"ERROR: no se encontró {args.input}")
+    output = args.output or (os.path.splitext(args.input)[0] + "_scored"
+                             + dataset_generator.OUTPUT_FORMATS[args.format])
+
+    rows, elapsed, confusion = score(args.input, output, args.model, args.format,
+                                     args.chunksize, args.device_column, args.batch)
+    print(f"✅ {rows} filas puntuadas en {elapsed:.2f} s "
+          f"({rows / elapsed if elapsed else 0:,.0f} filas/s) -> {output}")
+
+    if confusion is not None:
+        confusion.print()
+        if args.report:
+            report = dict(confusion.summary(), input=os.path.abspath(args.input),
+                          model=os.path.abspath(args.model), rows=rows, seconds=elapsed)
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"📝 Informe guardado en: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+
+"""
+export_esp32.py
+Cuantiza el MLP (sound_classifier.npz) a punto fijo para inferencia en el
+ESP32 (esp32/src/tinyml.py) y lo guarda en sound_classifier.mlpq.
+
+Esquema (simétrico, sin zero-point):
+  - Entrada: valores crudos -> (x - min) * k  -> int16   (k = 1 / (rango * s_in))
+  - Pesos: int8 por capa (s_w = max|W| / 127); bias int32 en la escala
+    del acumulador (s_a * s_w).
+  - Capas ocultas: acumulador int32 -> ReLU -> ((acc >> pre) * mult) >> post
+    -> int16. pre/mult/post se eligen con los máximos observados en el
+    dataset de calibración para que nada desborde 32 bits.
+  - Última capa: se devuelve el argmax del acumulador (softmax no cambia
+    el orden, el ESP32 no lo necesita).
+
+El orden de las características y el escalado min/max se leen de los
+metadatos del modelo (sound_classifier.json, model_metadata.py); si el
+escalado va plegado en la primera capa se despliega antes de cuantizar,
+porque la entrada del ESP32 se cuantiza ya normalizada.
+
+Formato del archivo (little-endian):
+  cabecera  "MLPQ", u8 versión, u8 n_features, u8 n_capas, u8 reservado
+  entrada   f32 min[n_features], f32 k[n_features]
+  por capa  u16 n_in, u16 n_out, u8 relu, u8 pre, u8 post, u8 reservado,
+            i32 mult, i8 pesos[n_out * n_in] (fila por neurona), i32 bias[n_out]
+
+Uso:
+  python export_esp32.py [modelo.npz] [dataset.csv] [salida.mlpq]
+"""
+
+import math
+import os
+import struct
+import sys
+import numpy as np
+import pandas as pd
+from model_metadata import raw_matrix, read_metadata, unfold_normalization
+
+FORMAT_VERSION = 1
+MAGIC = b"MLPQ"
+
+INT16_MAX = 32767
+HEADROOM = 2.0          # margen sobre los máximos de calibración
+ACC_PRE_LIMIT = 65535   # (acc >> pre) se satura aquí antes de multiplicar
+
+
+def load_float_layers(npz_path):
+    with np.load(npz_path) as data:
+        activations = [str(a) for a in data['activations']]
+        return [(data[f"W{i}"].astype(np.float64), data[f"b{i}"].astype(np.float64), activations[i])
+                for i in range(len(activations))]
+
+
+def load_model(npz_path):
+    """Capas (que reciben entradas normalizadas) y metadatos del modelo."""
+    layers = load_float_layers(npz_path)
+    meta = read_metadata(npz_path)
+    if meta["normalized_in_graph"]:
+        kernel, bias, activation = layers[0]
+        kernel, bias = unfold_normalization(kernel, bias, meta["feature_min"], meta["feature_max"])
+        layers[0] = (kernel, bias, activation)
+    return layers, meta
+
+
+def calibration_features(csv_path, feature_names):
+    """Vectores crudos (N, 11) a partir de un dataset.csv (mismo encoding que el entrenamiento)."""
+    return raw_matrix(pd.read_csv(csv_path), feature_names)
+
+
+def _requant_params(max_acc, ratio):
+    """(pre, mult, post) tales que ((acc >> pre) * mult) >> post ~= acc * ratio sin desbordar."""
+    pre = max(0, math.ceil(math.log2(max(max_acc, 1))) - 16)
+    scaled = ratio * (1 << pre)
+    post = 0
+    while scaled * (1 << (post + 1)) < INT16_MAX and post < 40:
+        post += 1
+    mult = int(round(scaled * (1 << post)))
+    if mult < 1:
+        raise ValueError("Escala de recuantización demasiado pequeña")
+    return pre, mult, post
+
+
+def quantize(layers, raw_calib, feature_min, feature_max):
+    mins = np.asarray(feature_min, dtype=np.float64)
+    ranges = np.asarray(feature_max, dtype=np.float64) - mins
+    ranges[ranges == 0] = 1.0
+
+    x_norm = (raw_calib - mins) / ranges
+    s_in = max(float(np.abs(x_norm).max()), 1.0) * HEADROOM / INT16_MAX
+    k = 1.0 / (ranges * s_in)
+
+    # Activaciones en flotante para calibrar los rangos
+    acts = [x_norm]
+    h = x_norm
+    for kernel, bias, activation in layers:
+        h = h @ kernel + bias
+        if activation == 'relu':
+            h = np.maximum(h, 0.0)
+        acts.append(h)
+
+    qlayers = []
+    s_a = s_in
+    for i, (kernel, bias, activation) in enumerate(layers):
+        s_w = float(np.abs(kernel).max()) / 127.0 or 1.0
+        w_q = np.clip(np.round(kernel / s_w), -127, 127).astype(np.int8)
+        s_acc = s_a * s_w
+        b_q = np.round(bias / s_acc).astype(np.int32)
+        relu = activation == 'relu'
+        if relu:
+            pre_act = acts[i] @ kernel + bias
+            max_acc = float(np.abs(pre_act).max()) / s_acc * HEADROOM
+            s_out = max(float(acts[i + 1].max()), 1e-6) * HEADROOM / INT16_MAX
+            pre, mult, post = _requant_params(max_acc, s_acc / s_out)
+            s_a = s_out
+        else:
+            if i != len(layers) - 1:
+                raise ValueError("Solo la última capa puede no ser ReLU")
+            pre, mult, post = 0, 1, 0
+        # Fila por neurona de salida: el ESP32 recorre los pesos en orden
+        qlayers.append({
+            "weights": np.ascontiguousarray(w_q.T),
+            "bias": b_q,
+            "relu": relu, "pre": pre, "mult": mult, "post": post,
+        })
+    return {"min": mins.astype(np.float32), "k": k.astype(np.float32), "layers": qlayers}
+
+
+def simulate(qmodel, raw):
+    """Inferencia entera idéntica a tinyml.py; devuelve el índice de clase por fila."""
+    x = np.clip(np.trunc((raw.astype(np.float32) - qmodel["min"]) * qmodel["k"]),
+                -INT16_MAX, INT16_MAX).astype(np.int64)
+    for layer in qmodel["layers"]:
+        acc = x @ layer["weights"].T.astype(np.int64) + layer["bias"].astype(np.int64)
+        if layer["relu"]:
+            v = np.minimum(np.maximum(acc, 0) >> layer["pre"], ACC_PRE_LIMIT)
+            x = np.minimum((v * layer["mult"]) >> layer["post"], INT16_MAX)
+        else:
+            x = acc
+    return np.argmax(x, axis=1)
+
+
+def save(qmodel, out_path):
+    layers = qmodel["layers"]
+    n_features = len(qmodel["min"])
+    with open(out_path, "wb") as f:
+        f.write(struct.pack("<4sBBBB", MAGIC, FORMAT_VERSION, n_features, len(layers), 0))
+        f.write(qmodel["min"].astype("<f4").tobytes())
+        f.write(qmodel["k"].astype("<f4").tobytes())
+        for layer in layers:
+            n_out, n_in = layer["weights"].shape
+            f.write(struct.pack("<HHBBBBi", n_in, n_out, int(layer["relu"]),
+                                layer["pre"], layer["post"], 0, layer["mult"]))
+            f.write(layer["weights"].astype(np.int8).tobytes())
+            f.write(layer["bias"].astype("<i4").tobytes())
+    size = os.path.getsize(out_path)
+    print(f"💾 Modelo ESP32 guardado en: {out_path} ({size} bytes)")
+    return out_path
+
+
+def export(npz_path, csv_path, out_path):
+    """Cuantiza, compara con el modelo flotante sobre el dataset y guarda el archivo."""
+    layers, meta = load_model(npz_path)
+    feature_min, feature_max = meta["feature_min"], meta["feature_max"]
+    raw = calibration_features(csv_path, meta["feature_names"])
+    qmodel = quantize(layers, raw, feature_min, feature_max)
+
+    mins = np.asarray(feature_min, dtype=np.float64)
+    ranges = np.asarray(feature_max, dtype=np.float64) - mins
+    ranges[ranges == 0] = 1.0
+    h = (raw - mins) / ranges
+    for kernel, bias, activation in layers:
+        h = h @ kernel + bias
+        if activation == 'relu':
+            h = np.maximum(h, 0.0)
+    agreement = float(np.mean(simulate(qmodel, raw) == np.argmax(h, axis=1)) * 100)
+    print(f"Concordancia punto fijo vs flotante: {agreement:.2f}% ({len(raw)} filas)")
+
+    save(qmodel, out_path)
+    return qmodel, agreement
+
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    npz_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(script_dir, "sound_classifier.npz")
+    csv_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(script_dir, "..", "datasets", "dataset.csv")
+    out_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(script_dir, "sound_classifier.mlpq")
+    export(npz_path, csv_path, out_path)
@@ -0,0 +1,83 @@
+
+"""
+export_numpy.py
+Extrae los pesos de las capas Dense de sound_classifier.h5 a un artefacto
+NumPy compacto (sound_classifier.npz) para el backend de inferencia sin
+TensorFlow de raspberry_pi/src/ml.py.
+
+Contenido del .npz:
+  - W0, b0, W1, b1, ...: kernel y bias de cada capa Dense, en orden.
+  - activations: activación de cada capa ('relu', 'softmax', 'linear').
+
+Uso:
+  python export_numpy.py [modelo.h5] [salida.npz]
+"""
+
+import json
+import os
+import sys
+import numpy as np
+
+SUPPORTED_ACTIVATIONS = ('relu', 'softmax', 'linear')
+
+# Capas sin efecto en inferencia
+_INFERENCE_NOOPS = ('InputLayer', 'Dropout')
+
+
+def _save(layers, out_path):
+    arrays = {}
+    activations = []
+    for i, (kernel, bias, activation) in enumerate(layers):
+        if activation not in SUPPORTED_ACTIVATIONS:
+            raise ValueError(f"Activación no soportada en la capa {i}: {activation}")
+        arrays[f"W{i}"] = np.asarray(kernel, dtype=np.float32)
+        arrays[f"b{i}"] = np.asarray(bias, dtype=np.float32)
+        activations.append(activation)
+    np.savez(out_path, activations=np.array(activations), **arrays)
+    print(f"💾 Artefacto NumPy guardado en: {out_path} ({len(layers)} capas Dense)")
+    return out_path
+
+
+def export_from_keras_model(model, out_path):
+    """Exporta un modelo Keras ya cargado (p.ej. recién entrenado)."""
+    layers = []
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in _INFERENCE_NOOPS:
+            continue
+        if kind != 'Dense':
+            raise ValueError(f"Capa no soportada por el backend NumPy: {kind}")
+        kernel, bias = layer.get_weights()
+        layers.append((kernel, bias, layer.get_config()['activation']))
+    return _save(layers, out_path)
+
+
+def export_from_h5(h5_path, out_path):
+    """Lee el .h5 con h5py (sin importar TensorFlow) y exporta las capas Dense."""
+    import h5py
+
+    layers = []
+    with h5py.File(h5_path, 'r') as f:
+        config = json.loads(f.attrs['model_config'])
+        weights = f['model_weights']
+        for layer in config['config']['layers']:
+            kind = layer['class_name']
+            if kind in _INFERENCE_NOOPS:
+                continue
+            if kind != 'Dense':
+                raise ValueError(f"Capa no soportada por el backend NumPy: {kind}")
+            name = layer['config']['name']
+            group = weights[name]
+            names = [n.decode() if isinstance(n, bytes) else str(n)
+                     for n in group.attrs['weight_names']]
+            kernel = next(group[n][()] for n in names if n.endswith('kernel') or n.endswith('kernel:0'))
+            bias = next(group[n][()] for n in names if n.endswith('bias') or n.endswith('bias:0'))
+            layers.append((kernel, bias, layer['config']['activation']))
+    return _save(layers, out_path)
+
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    h5_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(script_dir, "sound_classifier.h5")
+    out_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(script_dir, "sound_classifier.npz")
+    export_from_h5(h5_path, out_path)
@@ -0,0 +1,223 @@
+"""
+export_tflite.py
+Conversión del modelo Keras a TensorFlow Lite con cuantización
+post-entrenamiento y un informe que compara cada modo con float32:
+
+  - float32  sin optimizar (sound_classifier.tflite, lo de siempre)
+  - dynamic  pesos int8, activaciones en float (rango dinámico)
+  - int8     entero completo: entrada/salida int8 calibradas con un
+             dataset representativo sacado del CSV de entrenamiento
+  - float16  pesos en float16
+
+Informe por modo: precisión de validación, tamaño del archivo, latencia de
+una inferencia de una fila y de un lote (intérprete de un hilo, en esta CPU).
+raspberry_pi/src/ml.py aplica la escala y el zero-point de entrada/salida
+de los modelos int8, así que basta con apuntar SOUND_MODEL_PATH al archivo
+sound_classifier_<modo>.tflite (cada uno lleva su .json de metadatos).
+
+Los modelos float llevan el escalado min/max plegado en la primera capa
+(fold_model) y reciben las características crudas. El int8 no: su entrada
+se cuantiza con una sola escala para todo el tensor y con valores crudos
+(rms hasta miles junto a flags 0/1) los flags se perderían, así que recibe
+entradas ya normalizadas y la Raspberry las normaliza antes de invocarlo.
+"""
+
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from model_metadata import fold_normalization, scale_offset, write_metadata
+
+MODES = ("float32", "dynamic", "int8", "float16")
+NORMALIZED_INPUT_MODES = ("int8",)
+REPRESENTATIVE_ROWS = 500
+LATENCY_RUNS = 500
+BATCH_SIZE = 128
+
+
+def fold_model(model, feature_min, feature_max):
+    """Copia del modelo con el escalado min/max plegado en la primera capa Dense."""
+    folded = tf.keras.models.clone_model(model)
+    folded.set_weights(model.get_weights())
+    first = next(layer for layer in folded.layers if type(layer).__name__ == 'Dense')
+    kernel, bias = first.get_weights()
+    kernel, bias = fold_normalization(kernel, bias, feature_min, feature_max)
+    first.set_weights([kernel.astype(np.float32), bias.astype(np.float32)])
+    return folded
+
+
+def convert(model, mode="float32", representative=None):
+    """Bytes del modelo TFLite en el modo pedido (representative: filas ya normalizadas)."""
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if mode == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif mode == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        if representative is None:
+            raise ValueError("La cuantización int8 necesita un dataset representativo")
+        rows = np.asarray(representative, dtype=np.float32)
+
+        def representative_dataset():
+            for row in rows:
+                yield [row[None, :]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    elif mode != "float32":
+        raise ValueError(f"Modo de cuantización desconocido: {mode}")
+    return converter.convert()
+
+
+def representative_rows(X_train, n=REPRESENTATIVE_ROWS, seed=0):
+    """Muestra aleatoria del conjunto de entrenamiento (ya escalado)."""
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(X_train), size=min(n, len(X_train)), replace=False)
+    return np.asarray(X_train, dtype=np.float32)[idx]
+
+
+def quantize_input(x, details):
+    """Float -> tipo de la entrada del intérprete (sin cambios si es float)."""
+    dtype = details['dtype']
+    if not np.issubdtype(dtype, np.integer):
+        return np.asarray(x, dtype=dtype)
+    scale, zero_point = details['quantization']
+    info = np.iinfo(dtype)
+    q = np.round(np.asarray(x, dtype=np.float32) / scale) + zero_point
+    return np.clip(q, info.min, info.max).astype(dtype)
+
+
+def dequantize_output(y, details):
+    """Salida del intérprete -> float32."""
+    if not np.issubdtype(details['dtype'], np.integer):
+        return y
+    scale, zero_point = details['quantization']
+    return (y.astype(np.float32) - zero_point) * scale
+
+
+class _Runner:
+    """Intérprete de un hilo redimensionado a un tamaño de lote fijo."""
+
+    def __init__(self, tflite_model, batch):
+        self.interpreter = tf.lite.Interpreter(model_content=tflite_model, num_threads=1)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        n_features = int(self.input['shape'][-1])
+        self.interpreter.resize_tensor_input(self.input['index'], [batch, n_features])
+        self.interpreter.allocate_tensors()
+        self.batch = batch
+
+    def run(self, x):
+        self.interpreter.set_tensor(self.input['index'], quantize_input(x, self.input))
+        self.interpreter.invoke()
+        return dequantize_output(self.interpreter.get_tensor(self.output['index']), self.output)
+
+
+def predict(tflite_model, X, batch=BATCH_SIZE):
+    """Probabilidades de todas las filas de X (relleno con ceros el último lote)."""
+    runner = _Runner(tflite_model, batch)
+    X = np.asarray(X, dtype=np.float32)
+    out = []
+    for start in range(0, len(X), batch):
+        chunk = X[start:start + batch]
+        buf = np.zeros((batch, X.shape[1]), dtype=np.float32)
+        buf[:len(chunk)] = chunk
+        out.append(runner.run(buf)[:len(chunk)])
+    return np.concatenate(out) if out else np.zeros((0, 0), dtype=np.float32)
+
+
+def latency_us(tflite_model, X, batch=1, runs=LATENCY_RUNS):
+    """Mediana del tiempo de invoke() (µs por llamada) con lotes de `batch` filas."""
+    runner = _Runner(tflite_model, batch)
+    X = np.asarray(X, dtype=np.float32)
+    # Unos cuantos lotes distintos ya cuantizados (se repiten filas si X es corto)
+    inputs = [quantize_input(np.resize(X[i * batch:(i + 1) * batch], (batch, X.shape[1])), runner.input)
+              for i in range(max(1, min(8, len(X) // batch)))]
+    it, index = runner.interpreter, runner.input['index']
+    times = np.empty(runs)
+    for i in range(runs):
+        it.set_tensor(index, inputs[i % len(inputs)])
+        t0 = time.perf_counter()
+        it.invoke()
+        times[i] = time.perf_counter() - t0
+    return float(np.median(times) * 1e6)
+
+
+def compare(model, X_train, X_val, y_val, feature_min, feature_max, modes=MODES):
+    """
+    Convierte el modelo (entrenado con entradas normalizadas) en cada modo y
+    lo mide; cada modo recibe las entradas que recibirá en la Raspberry.
+    Devuelve ({modo: bytes del modelo}, [fila del informe por modo]).
+    """
+    representative = representative_rows(X_train)
+    folded = fold_model(model, feature_min, feature_max)
+    scale, offset = scale_offset(feature_min, feature_max)
+    X_raw = (np.asarray(X_val, dtype=np.float64) - offset) / scale
+    models = {}
+    rows = []
+    baseline = None
+    for mode in ("float32",) + tuple(m for m in modes if m != "float32"):
+        if mode in NORMALIZED_INPUT_MODES:
+            graph, X = model, X_val
+        else:
+            graph, X = folded, X_raw
+        tflite_model = convert(graph, mode, representative)
+        models[mode] = tflite_model
+        probs = predict(tflite_model, X)
+        preds = probs.argmax(axis=1)
+        row = {
+            'mode': mode,
+            'normalized_in_graph': mode not in NORMALIZED_INPUT_MODES,
+            'accuracy': float(np.mean(preds == np.asarray(y_val))),
+            'size_bytes': len(tflite_model),
+            'single_us': latency_us(tflite_model, X, 1),
+            'batch_us': latency_us(tflite_model, X, BATCH_SIZE),
+        }
+        row['batch_row_us'] = row['batch_us'] / BATCH_SIZE
+        if baseline is None:
+            baseline = (row, preds, probs)
+        else:
+            base, base_preds, base_probs = baseline
+            row['accuracy_delta'] = row['accuracy'] - base['accuracy']
+            row['size_ratio'] = row['size_bytes'] / base['size_bytes']
+            row['single_speedup'] = base['single_us'] / row['single_us']
+            row['batch_speedup'] = base['batch_us'] / row['batch_us']
+            row['agreement'] = float(np.mean(preds == base_preds))
+            row['max_prob_diff'] = float(np.abs(probs - base_probs).max())
+        rows.append(row)
+    return models, rows
+
+
+def print_report(rows):
+    print(f"\n{'modo':<8} {'acc':>7} {'tamaño':>9} {'1 fila µs':>10} "
+          f"{f'lote {BATCH_SIZE} µs':>12} {'µs/fila':>8} {'coincide':>9}")
+    for r in rows:
+        agreement = f"{r['agreement'] * 100:.2f}%" if 'agreement' in r else "-"
+        print(f"{r['mode']:<8} {r['accuracy']:>7.4f} {r['size_bytes']:>9} {r['single_us']:>10.1f} "
+              f"{r['batch_us']:>12.1f} {r['batch_row_us']:>8.2f} {agreement:>9}")
+
+
+def export_quantized(model, modes, X_train, X_val, y_val, feature_names, class_names,
+                     feature_min, feature_max, prefix="sound_classifier",
+                     report_path="quantization_report.json"):
+    """Guarda <prefix>_<modo>.tflite (y sus metadatos) de cada modo pedido y el informe comparativo."""
+    models, rows = compare(model, X_train, X_val, y_val, feature_min, feature_max, modes)
+    for mode in modes:
+        if mode == "float32":
+            continue
+        path = f"{prefix}_{mode}.tflite"
+        with open(path, "wb") as f:
+            f.write(models[mode])
+        print(f"💾 Modelo TFLite {mode} guardado en: {path}")
+        write_metadata(path, feature_names, class_names, feature_min, feature_max,
+                       mode not in NORMALIZED_INPUT_MODES)
+    print_report(rows)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump({'batch_size': BATCH_SIZE, 'validation_rows': int(len(y_val)), 'modes': rows},
+                  f, ensure_ascii=False, indent=2)
+    print(f"📝 Informe de cuantización en: {report_path}")
+    return rows
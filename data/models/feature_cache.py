@@ -0,0 +1,160 @@
+"""
+feature_cache.py
+Caché en disco de las matrices de entrenamiento ya codificadas, para no
+volver a parsear el CSV ni rehacer el one-hot / imputación / LabelEncoder
+en cada ejecución de model_trainer.py.
+
+Cada entrada es un directorio con un .npy por matriz (se cargan con
+mmap_mode="r") y un meta.json (orden de columnas, clases, min/max del
+escalado, ...). La clave es un SHA-256 de:
+  - el contenido del CSV,
+  - el código fuente de las funciones de codificación,
+  - las versiones de las librerías que intervienen,
+así que cualquier cambio en el dataset o en la lógica de codificación
+invalida la caché sin tener que borrarla a mano.
+
+Para no leer un CSV grande entero en cada carga, el hash del contenido se
+guarda en stamps.json junto con el tamaño y la fecha de modificación del
+archivo; si no han cambiado se reutiliza.
+
+SOUND_FEATURE_CACHE elige el directorio (vacío la desactiva).
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+CACHE_DIR = os.environ.get(
+    "SOUND_FEATURE_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".feature_cache"),
+)
+CACHE_KEEP = 4              # entradas que se conservan (las más recientes)
+STAMPS_FILE = "stamps.json"
+META_FILE = "meta.json"
+_HASH_BLOCK = 1 << 20
+
+
+def file_digest(path, cache_dir=CACHE_DIR):
+    """SHA-256 del contenido de path (reutilizado si tamaño y mtime no cambian)."""
+    st = os.stat(path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    stamps_path = os.path.join(cache_dir, STAMPS_FILE) if cache_dir else None
+    stamps = {}
+    if stamps_path and os.path.exists(stamps_path):
+        try:
+            with open(stamps_path, "r", encoding="utf-8") as f:
+                stamps = json.load(f)
+        except (OSError, ValueError):
+            stamps = {}
+    key = os.path.abspath(path)
+    entry = stamps.get(key)
+    if entry is not None and entry["stamp"] == stamp:
+        return entry["sha256"]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    if stamps_path:
+        stamps[key] = {"stamp": stamp, "sha256": digest}
+        _write_json(stamps_path, stamps)
+    return digest
+
+
+def cache_key(csv_path, code=(), extra=(), cache_dir=CACHE_DIR):
+    """Clave de la entrada: contenido del CSV + fuente de `code` + `extra`."""
+    h = hashlib.sha256()
+    h.update(f"v{CACHE_VERSION}".encode())
+    h.update(file_digest(csv_path, cache_dir).encode())
+    for fn in code:
+        h.update(_code_fingerprint(fn))
+    for value in (np.__version__, pd.__version__) + tuple(extra):
+        h.update(str(value).encode())
+    return h.hexdigest()
+
+
+def _code_fingerprint(fn):
+    try:
+        return inspect.getsource(fn).encode()
+    except (OSError, TypeError):
+        # Sin fuente disponible (p.ej. solo .pyc): bytecode y constantes
+        code = fn.__code__
+        return code.co_code + repr(code.co_consts).encode()
+
+
+def _write_json(path, data):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _load_entry(path):
+    with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+              for name in meta["arrays"]}
+    return arrays, meta
+
+
+def _save_entry(path, arrays, meta):
+    # Se escribe en un directorio temporal y se renombra: nunca queda una
+    # entrada a medias aunque el proceso se corte
+    tmp = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(arr))
+    meta = dict(meta, arrays=list(arrays))
+    _write_json(os.path.join(tmp, META_FILE), meta)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # Otro proceso guardó la misma entrada a la vez
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _prune(cache_dir, keep=CACHE_KEEP):
+    entries = [e for e in os.scandir(cache_dir)
+               if e.is_dir() and os.path.exists(os.path.join(e.path, META_FILE))]
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def load_or_build(csv_path, build, code=(), extra=(), cache_dir=CACHE_DIR):
+    """
+    Devuelve (arrays, meta) para csv_path. `build(df)` hace la codificación
+    y devuelve (dict nombre -> ndarray, dict serializable en JSON); solo se
+    llama si no hay una entrada válida. `code` son las funciones cuya fuente
+    forma parte de la clave (build se incluye siempre).
+    """
+    start = time.perf_counter()
+    if not cache_dir:
+        arrays, meta = build(pd.read_csv(csv_path))
+        return arrays, meta
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = cache_key(csv_path, (build,) + tuple(code), extra, cache_dir)
+    path = os.path.join(cache_dir, key)
+    if os.path.exists(os.path.join(path, META_FILE)):
+        arrays, meta = _load_entry(path)
+        if meta.get("key") == key:
+            os.utime(path)
+            print(f"Características desde caché ({(time.perf_counter() - start) * 1000:.1f} ms): {path}")
+            return arrays, meta
+
+    arrays, meta = build(pd.read_csv(csv_path))
+    meta = dict(meta, key=key, source=os.path.abspath(csv_path))
+    _save_entry(path, arrays, meta)
+    _prune(cache_dir)
+    print(f"Características calculadas y guardadas en caché "
+          f"({(time.perf_counter() - start) * 1000:.1f} ms): {path}")
+    return _load_entry(path)
@@ -0,0 +1,92 @@
+"""
+model_metadata.py
+Metadatos que acompañan a cada modelo exportado, en un JSON con el mismo
+nombre (sound_classifier.tflite / .h5 / .npz -> sound_classifier.json):
+
+  feature_names        orden de las entradas
+  class_names          clase de cada salida (índice -> etiqueta)
+  feature_min/max      escalado min/max del entrenamiento (por característica)
+  normalized_in_graph  True si el escalado ya está dentro del modelo (la
+                       primera capa Dense recibe las características crudas)
+
+Es la única copia de estos valores: raspberry_pi/src/ml.py, test_model.py y
+export_esp32.py los leen de aquí en vez de tenerlos copiados a mano.
+
+El escalado x_norm = x * scale + offset se pliega en la primera capa Dense:
+  W' = diag(scale) W      b' = b + offset W
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+def metadata_path(model_path):
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+def scale_offset(feature_min, feature_max):
+    """(scale, offset) del escalado min/max (rango 0 -> 1, como MinMaxScaler)."""
+    mins = np.asarray(feature_min, dtype=np.float64)
+    ranges = np.asarray(feature_max, dtype=np.float64) - mins
+    ranges[ranges == 0] = 1.0
+    return 1.0 / ranges, -mins / ranges
+
+
+def fold_normalization(kernel, bias, feature_min, feature_max):
+    """Pesos de la primera capa que reciben las características crudas."""
+    scale, offset = scale_offset(feature_min, feature_max)
+    kernel = np.asarray(kernel, dtype=np.float64)
+    return kernel * scale[:, None], np.asarray(bias, dtype=np.float64) + offset @ kernel
+
+
+def unfold_normalization(kernel, bias, feature_min, feature_max):
+    """Inversa de fold_normalization: pesos que reciben entradas ya normalizadas."""
+    scale, offset = scale_offset(feature_min, feature_max)
+    kernel = np.asarray(kernel, dtype=np.float64) / scale[:, None]
+    return kernel, np.asarray(bias, dtype=np.float64) - offset @ kernel
+
+
+def raw_matrix(df, feature_names):
+    """
+    Vectores crudos (N, len(feature_names)) de un DataFrame con las columnas
+    de dataset.csv (rms_value, rms_avg, rms_std, is_day, weather_type), con
+    el mismo encoding que el entrenamiento: is_day 'día' -> 1 y un flag por
+    clima (weather_<tipo>; un clima desconocido no activa ninguno).
+    """
+    x = np.zeros((len(df), len(feature_names)), dtype=np.float64)
+    for j, col in enumerate(('rms_value', 'rms_avg', 'rms_std')):
+        x[:, j] = pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+    x[:, 3] = df['is_day'].astype(str).str.lower().isin(['día', 'dia'])
+    weather = df['weather_type'].astype(str).to_numpy()
+    for j, name in enumerate(feature_names[4:], start=4):
+        x[:, j] = weather == name[len('weather_'):]
+    return x
+
+
+def write_metadata(model_path, feature_names, class_names, feature_min, feature_max,
+                   normalized_in_graph):
+    path = metadata_path(model_path)
+    meta = {
+        "feature_names": list(feature_names),
+        "class_names": [str(c) for c in class_names],
+        "feature_min": [float(v) for v in feature_min],
+        "feature_max": [float(v) for v in feature_max],
+        "normalized_in_graph": bool(normalized_in_graph),
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    print(f"💾 Metadatos del modelo guardados en: {path}")
+    return path
+
+
+def read_metadata(model_path):
+    path = metadata_path(model_path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No se encontraron los metadatos del modelo en: {path} "
+            "(se generan al entrenar con model_trainer.py)"
+        )
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
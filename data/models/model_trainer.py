@@ -14,16 +14,51 @@ Salida:
   - sound_category: categoría del ambiente sonoro
     ('Ambiente tranquilo', 'Actividad moderada', 'Ruido elevado', 'Pico inesperado').
 
+Modo barrido (--sweep): entrena en paralelo (un proceso por núcleo, cada
+uno limitado a un hilo) combinaciones de anchos de capa, dropout y tamaño
+de lote; mide de cada candidato la precisión de validación y la latencia
+por inferencia y el tamaño del modelo TFLite, y exporta el modelo más
+pequeño del frente de Pareto que alcanza la precisión objetivo.
+
+  python model_trainer.py dataset.csv --sweep --random 12 --min-accuracy 0.95
+
+Con --quantize dynamic int8 float16 se exportan además versiones
+cuantizadas del modelo (export_tflite.py) y un informe frente a float32.
+
+Los sound_classifier.* del repositorio son anteriores a export_model: no
+llevan el escalado plegado ("normalized_in_graph": false) y la Raspberry
+los normaliza antes de invocarlos. Para migrarlos hay que volver a
+entrenar con TensorFlow desde esta carpeta, que es donde se escriben:
+
+  python model_trainer.py ../datasets/dataset.csv
+
 """
 
+import argparse
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
+import sklearn
 from sklearn.model_selection import train_test_split
 from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import MinMaxScaler, LabelEncoder
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
+from export_numpy import export_from_keras_model
+import export_esp32
+import export_tflite
+import feature_cache
+from model_metadata import write_metadata
 
 
 def prepare_inputs(df: pd.DataFrame):
@@ -51,29 +86,12 @@ def prepare_inputs(df: pd.DataFrame):
     return X
 
 
-def build_model(input_dim, num_classes):
-    """Crea una red neuronal totalmente conectada."""
-    model = keras.Sequential([
-        layers.Input(shape=(input_dim,)),
-        layers.Dense(64, activation='relu'),
-        layers.Dropout(0.3),
-        layers.Dense(32, activation='relu'),
-        layers.Dropout(0.3),
-        layers.Dense(num_classes, activation='softmax')
-    ])
-    model.compile(
-        optimizer='adam',
-        loss='sparse_categorical_crossentropy',
-        metrics=['accuracy']
-    )
-    return model
-
-
-def train_model(csv_path: str):
-    """Carga el dataset, entrena el modelo y exporta los archivos."""
-    print(f"\n📂 Cargando dataset desde: {csv_path}")
-    df = pd.read_csv(csv_path)
-
+def encode_dataset(df: pd.DataFrame):
+    """
+    Codifica el dataset completo: lo que guarda feature_cache.
+    Devuelve las matrices (X imputada sin escalar, y, índices de
+    entrenamiento/validación) y los metadatos (columnas, clases, min/max).
+    """
     if 'sound_category' not in df.columns:
         raise ValueError("El dataset debe contener la columna 'sound_category'.")
 
@@ -83,69 +101,348 @@ def train_model(csv_path: str):
 
     # Imputar valores faltantes (media)
     imputer = SimpleImputer(strategy='mean')
-    X_imp = pd.DataFrame(imputer.fit_transform(X_df), columns=X_df.columns)
+    X_imp = imputer.fit_transform(X_df)
 
     # Codificar etiquetas
     le = LabelEncoder()
     y = le.fit_transform(y_raw)
-    class_map = {cls: int(idx) for idx, cls in enumerate(le.classes_)}
 
     # Dividir en entrenamiento y validación (80/20)
-    X_train, X_val, y_train, y_val = train_test_split(
-        X_imp.values, y, test_size=0.2, random_state=42, stratify=y
+    train_idx, val_idx = train_test_split(
+        np.arange(len(y)), test_size=0.2, random_state=42, stratify=y
+    )
+
+    # Escalado entre 0 y 1 ajustado con el conjunto de entrenamiento
+    scaler = MinMaxScaler().fit(X_imp[train_idx])
+
+    arrays = {'X': X_imp, 'y': y, 'train_idx': train_idx, 'val_idx': val_idx}
+    meta = {
+        'columns': list(X_df.columns),
+        'classes': le.classes_.tolist(),
+        'feature_min': scaler.data_min_.tolist(),
+        'feature_max': scaler.data_max_.tolist(),
+    }
+    return arrays, meta
+
+
+def load_dataset(csv_path: str):
+    """
+    Matrices de entrenamiento desde feature_cache (se recalculan solo si
+    cambian el CSV o el código de codificación). Devuelve
+    (X_train, X_val, y_train, y_val, columnas, LabelEncoder, MinMaxScaler).
+    """
+    arrays, meta = feature_cache.load_or_build(
+        csv_path, encode_dataset, code=(prepare_inputs,), extra=(sklearn.__version__,)
+    )
+    X, y = arrays['X'], arrays['y']
+    train_idx, val_idx = arrays['train_idx'], arrays['val_idx']
+
+    le = LabelEncoder()
+    le.classes_ = np.array(meta['classes'], dtype=object)
+
+    # Ajustar con las dos filas min/max reproduce exactamente el escalado original
+    scaler = MinMaxScaler().fit(np.array([meta['feature_min'], meta['feature_max']]))
+    X_train = scaler.transform(X[train_idx])
+    X_val = scaler.transform(X[val_idx])
+    return X_train, X_val, y[train_idx], y[val_idx], meta['columns'], le, scaler
+
+
+DEFAULT_CSV = "C:/Users/Miguel/Desktop/U/Semestre 2025-2/PROFU I/PROJECT_S/data/datasets/dataset.csv"
+
+# Espacio del barrido (el modelo por defecto es hidden=(64, 32), dropout=0.3, batch_size=64)
+SWEEP_GRID = {
+    'hidden': [(8,), (16,), (32,), (16, 8), (32, 16), (64, 32)],
+    'dropout': [0.0, 0.1, 0.3],
+    'batch_size': [32, 64, 128],
+}
+ACCURACY_TOLERANCE = 0.01   # sin --min-accuracy: hasta 1 punto por debajo del mejor
+
+
+def build_model(input_dim, num_classes, hidden=(64, 32), dropout=0.3):
+    """Crea una red neuronal totalmente conectada."""
+    model = keras.Sequential([layers.Input(shape=(input_dim,))])
+    for units in hidden:
+        model.add(layers.Dense(units, activation='relu'))
+        if dropout:
+            model.add(layers.Dropout(dropout))
+    model.add(layers.Dense(num_classes, activation='softmax'))
+    model.compile(
+        optimizer='adam',
+        loss='sparse_categorical_crossentropy',
+        metrics=['accuracy']
     )
+    return model
 
-    # Escalar entre 0 y 1
-    scaler = MinMaxScaler()
-    X_train = scaler.fit_transform(X_train)
-    X_val = scaler.transform(X_val)
 
-    # Crear modelo
-    model = build_model(X_train.shape[1], len(le.classes_))
+def fit_model(X_train, y_train, X_val, y_val, num_classes, hidden=(64, 32), dropout=0.3,
+              batch_size=64, verbose=2):
+    """Entrena una configuración con early stopping; devuelve (modelo, loss, acc)."""
+    model = build_model(X_train.shape[1], num_classes, hidden, dropout)
 
     # Entrenamiento con early stopping
     es = keras.callbacks.EarlyStopping(
         patience=10, restore_best_weights=True, monitor='val_loss'
     )
 
-    print("\n🚀 Entrenando modelo...\n")
-    history = model.fit(
+    model.fit(
         X_train, y_train,
         validation_data=(X_val, y_val),
         epochs=300,
-        batch_size=64,
+        batch_size=batch_size,
         callbacks=[es],
-        verbose=2
+        verbose=verbose
     )
 
     # Evaluar
     loss, acc = model.evaluate(X_val, y_val, verbose=0)
-    print(f"\n✅ Entrenamiento completo: loss={loss:.4f}, acc={acc:.4f}")
+    return model, loss, acc
+
+
+def esp32_bytes(model):
+    """Tamaño del .mlpq que generaría export_esp32 (cabecera + capas int8)."""
+    dense = [layer for layer in model.layers if type(layer).__name__ == 'Dense']
+    n_features = dense[0].get_weights()[0].shape[0]
+    size = 8 + 8 * n_features
+    for layer in dense:
+        n_in, n_out = layer.get_weights()[0].shape
+        size += 12 + n_in * n_out + 4 * n_out
+    return size
+
+
+def export_model(model, csv_path, columns, le, scaler):
+    """
+    Guarda el modelo en todos los formatos que consumen la Raspberry y el ESP32.
+    El escalado min/max del entrenamiento se pliega en la primera capa, así que
+    los modelos exportados reciben las características crudas; los valores
+    quedan además en sound_classifier.json (model_metadata.py).
+    """
+    class_map = {cls: int(idx) for idx, cls in enumerate(le.classes_)}
+    deploy = export_tflite.fold_model(model, scaler.data_min_, scaler.data_max_)
 
     # Guardar modelo .h5
     keras_path = "sound_classifier.h5"
-    model.save(keras_path)
+    deploy.save(keras_path)
     print(f"💾 Modelo Keras guardado en: {keras_path}")
 
     # Convertir a TFLite
-    converter = tf.lite.TFLiteConverter.from_keras_model(model)
-    tflite_model = converter.convert()
+    tflite_model = export_tflite.convert(deploy)
     tflite_path = "sound_classifier.tflite"
     with open(tflite_path, "wb") as f:
         f.write(tflite_model)
     print(f"💾 Modelo TFLite guardado en: {tflite_path}")
 
+    # Pesos para el backend NumPy (inferencia sin TensorFlow en la Raspberry)
+    export_from_keras_model(deploy, "sound_classifier.npz")
+
+    # Orden de columnas, clases y escalado para la Raspberry, test_model.py y el ESP32
+    write_metadata(tflite_path, columns, le.classes_, scaler.data_min_, scaler.data_max_,
+                   normalized_in_graph=True)
+
     # Mostrar información útil para inferencia
     print("\n--- Información para inferencia ---")
-    mins = dict(zip(X_df.columns, scaler.data_min_.tolist()))
-    maxs = dict(zip(X_df.columns, scaler.data_max_.tolist()))
-    print("Feature min (train):", mins)
-    print("Feature max (train):", maxs)
+    print("Feature min (train):", dict(zip(columns, scaler.data_min_.tolist())))
+    print("Feature max (train):", dict(zip(columns, scaler.data_max_.tolist())))
     print("Class mapping (label -> index):", class_map)
-    print("\nUsa los valores min/max para normalizar las entradas antes de predecir en un dispositivo embebido.")
 
+    # Modelo en punto fijo para la inferencia local del ESP32 (esp32/src/tinyml.py)
+    export_esp32.export("sound_classifier.npz", csv_path, "sound_classifier.mlpq")
+
+
+def train_model(csv_path: str, quantize=()):
+    """
+    Carga el dataset, entrena el modelo y exporta los archivos. `quantize`:
+    modos de export_tflite ('dynamic', 'int8', 'float16') a exportar además
+    del float32, con su informe comparativo.
+    """
+    print(f"\n📂 Cargando dataset desde: {csv_path}")
+    X_train, X_val, y_train, y_val, columns, le, scaler = load_dataset(csv_path)
+
+    print("\n🚀 Entrenando modelo...\n")
+    model, loss, acc = fit_model(X_train, y_train, X_val, y_val, len(le.classes_))
+    print(f"\n✅ Entrenamiento completo: loss={loss:.4f}, acc={acc:.4f}")
+
+    export_model(model, csv_path, columns, le, scaler)
+    if quantize:
+        export_tflite.export_quantized(model, quantize, X_train, X_val, y_val, columns, le.classes_,
+                                       scaler.data_min_, scaler.data_max_)
     return model, le, scaler
 
 
+# --- Barrido de hiperparámetros ---
+
+def sweep_configs(n_random=None, seed=0):
+    """Todas las combinaciones de SWEEP_GRID, o n_random de ellas al azar."""
+    keys = list(SWEEP_GRID)
+    configs = [dict(zip(keys, values)) for values in itertools.product(*SWEEP_GRID.values())]
+    if n_random is not None and n_random < len(configs):
+        configs = random.Random(seed).sample(configs, n_random)
+    return configs
+
+
+# Un hilo por proceso: los candidatos corren en paralelo sin pelearse por
+# los núcleos y la latencia medida es la de un solo hilo. NumPy/BLAS y
+# TensorFlow leen estas variables al importarse, así que tienen que estar en
+# el entorno del padre antes de lanzar los procesos (spawn las hereda).
+WORKER_THREAD_ENV = {
+    'OMP_NUM_THREADS': '1',
+    'MKL_NUM_THREADS': '1',
+    'OPENBLAS_NUM_THREADS': '1',
+    'TF_NUM_INTRAOP_THREADS': '1',
+    'TF_NUM_INTEROP_THREADS': '1',
+}
+
+
+@contextlib.contextmanager
+def _worker_thread_env():
+    """Pone WORKER_THREAD_ENV en os.environ mientras se crean los procesos y lo restaura después."""
+    previous = {name: os.environ.get(name) for name in WORKER_THREAD_ENV}
+    os.environ.update(WORKER_THREAD_ENV)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _init_worker():
+    # Por si el runtime de TensorFlow aún no leyó las variables de entorno
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def _train_candidate(job):
+    csv_path, config, seed, out_dir, index = job
+    keras.utils.set_random_seed(seed)
+    X_train, X_val, y_train, y_val, columns, le, scaler = load_dataset(csv_path)
+    t0 = time.perf_counter()
+    model, loss, acc = fit_model(X_train, y_train, X_val, y_val, len(le.classes_),
+                                 config['hidden'], config['dropout'], config['batch_size'], verbose=0)
+    train_s = time.perf_counter() - t0
+    tflite_model = export_tflite.convert(model)
+    path = os.path.join(out_dir, f"candidate_{index:03d}")
+    model.save(path + ".h5")
+    return {
+        'index': index,
+        'hidden': list(config['hidden']),
+        'dropout': config['dropout'],
+        'batch_size': config['batch_size'],
+        'accuracy': float(acc),
+        'loss': float(loss),
+        'train_s': train_s,
+        'latency_us': export_tflite.latency_us(tflite_model, X_val),
+        'tflite_bytes': len(tflite_model),
+        'esp32_bytes': esp32_bytes(model),
+        'params': int(model.count_params()),
+        'path': path,
+    }
+
+
+def pareto_front(results):
+    """Candidatos no dominados en (precisión ↑, latencia ↓, tamaño ↓)."""
+    def dominates(a, b):
+        no_worse = (a['accuracy'] >= b['accuracy'] and a['latency_us'] <= b['latency_us']
+                    and a['tflite_bytes'] <= b['tflite_bytes'])
+        better = (a['accuracy'] > b['accuracy'] or a['latency_us'] < b['latency_us']
+                  or a['tflite_bytes'] < b['tflite_bytes'])
+        return no_worse and better
+    return [r for r in results if not any(dominates(o, r) for o in results if o is not r)]
+
+
+def select_model(front, min_accuracy=None):
+    """
+    El candidato del frente más pequeño (y luego más rápido) que alcanza
+    min_accuracy; sin objetivo, hasta ACCURACY_TOLERANCE por debajo del mejor.
+    Si ninguno llega, el más preciso.
+    """
+    best = max(front, key=lambda r: r['accuracy'])
+    if min_accuracy is None:
+        min_accuracy = best['accuracy'] - ACCURACY_TOLERANCE
+    eligible = [r for r in front if r['accuracy'] >= min_accuracy]
+    if not eligible:
+        return best
+    return min(eligible, key=lambda r: (r['tflite_bytes'], r['latency_us'], -r['accuracy']))
+
+
+def sweep(csv_path, n_random=None, workers=None, min_accuracy=None, seed=0,
+          report_path="sweep_report.json", quantize=()):
+    """Entrena los candidatos en paralelo, elige uno del frente de Pareto y lo exporta."""
+    print(f"\n📂 Cargando dataset desde: {csv_path}")
+    # Calienta la caché de características antes de lanzar los procesos
+    X_train, X_val, y_train, y_val, columns, le, scaler = load_dataset(csv_path)
+
+    configs = sweep_configs(n_random, seed)
+    workers = min(workers or os.cpu_count() or 1, len(configs))
+    out_dir = tempfile.mkdtemp(prefix="sweep_", dir=".")
+    jobs = [(csv_path, config, seed + i, out_dir, i) for i, config in enumerate(configs)]
+    print(f"\n🚀 Barrido: {len(configs)} candidatos en {workers} procesos...\n")
+
+    results = []
+    # spawn: cada proceso arranca TensorFlow desde cero y con un hilo
+    context = multiprocessing.get_context('spawn')
+    t0 = time.perf_counter()
+    with _worker_thread_env(), \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        for result in pool.map(_train_candidate, jobs):
+            results.append(result)
+            print(f"  [{result['index']:3d}] hidden={result['hidden']} dropout={result['dropout']} "
+                  f"batch={result['batch_size']}: acc={result['accuracy']:.4f} "
+                  f"lat={result['latency_us']:.1f}us tflite={result['tflite_bytes']}B")
+    elapsed = time.perf_counter() - t0
+
+    front = pareto_front(results)
+    chosen = select_model(front, min_accuracy)
+    front_ids = {r['index'] for r in front}
+    for r in results:
+        r['pareto'] = r['index'] in front_ids
+
+    print(f"\n✅ Barrido completo en {elapsed:.1f} s. Frente de Pareto:")
+    for r in sorted(front, key=lambda r: r['tflite_bytes']):
+        mark = "👉" if r is chosen else "  "
+        print(f"{mark} hidden={r['hidden']} dropout={r['dropout']} batch={r['batch_size']}: "
+              f"acc={r['accuracy']:.4f} lat={r['latency_us']:.1f}us tflite={r['tflite_bytes']}B "
+              f"esp32={r['esp32_bytes']}B")
+
+    model = keras.models.load_model(chosen['path'] + ".h5")
+    export_model(model, csv_path, columns, le, scaler)
+    if quantize:
+        export_tflite.export_quantized(model, quantize, X_train, X_val, y_val, columns, le.classes_,
+                                       scaler.data_min_, scaler.data_max_)
+    shutil.rmtree(out_dir, ignore_errors=True)
+
+    report = {
+        'csv': csv_path,
+        'workers': workers,
+        'elapsed_s': elapsed,
+        'min_accuracy': min_accuracy,
+        'chosen': chosen['index'],
+        'candidates': [{k: v for k, v in r.items() if k != 'path'} for r in results],
+    }
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📝 Informe del barrido en: {report_path}")
+    return chosen, results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Entrena el clasificador de ambientes sonoros")
+    parser.add_argument("csv", nargs="?", default=DEFAULT_CSV)
+    parser.add_argument("--sweep", action="store_true", help="Barrido de hiperparámetros en paralelo")
+    parser.add_argument("--random", type=int, help="Probar solo N combinaciones al azar de la rejilla")
+    parser.add_argument("--workers", type=int, help="Procesos del barrido (por defecto, uno por núcleo)")
+    parser.add_argument("--min-accuracy", type=float, help="Precisión de validación objetivo")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quantize", nargs="+", default=[],
+                        choices=[m for m in export_tflite.MODES if m != "float32"],
+                        help="Exportar también versiones cuantizadas (con informe frente a float32)")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    train_model("C:/Users/Miguel/Desktop/U/Semestre 2025-2/PROFU I/PROJECT_S/data/datasets/dataset.csv")
+    args = parse_args()
+    if args.sweep:
+        sweep(args.csv, args.random, args.workers, args.min_accuracy, args.seed, quantize=args.quantize)
+    else:
+        train_model(args.csv, args.quantize)
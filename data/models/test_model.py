@@ -7,44 +7,26 @@ Ejemplo de uso de tflite_runtime.Interpreter para tu modelo sound_classifier.tfl
 import os
 import numpy as np
 import tensorflow as tf
+from model_metadata import read_metadata
 tflite = tf.lite
 
 
 MODEL_FILENAME = "sound_classifier.tflite"
 
-# Orden de features (exactamente igual al entrenamiento)
-feature_names = [
-    'rms_value', 'rms_avg', 'rms_std', 'is_day',
-    'weather_con llovizna', 'weather_con niebla', 'weather_con tormentas',
-    'weather_lloviendo', 'weather_llovizna',
-    'weather_parcialmente nublado', 'weather_soleado'
-]
-
-# Min / Max del entrenamiento (para normalizar)
-feature_min = {
-    'rms_value': 1.0, 'rms_avg': 1.7, 'rms_std': 0.0, 'is_day': 0.0,
-    'weather_con llovizna': 0.0, 'weather_con niebla': 0.0, 'weather_con tormentas': 0.0,
-    'weather_lloviendo': 0.0, 'weather_llovizna': 0.0,
-    'weather_parcialmente nublado': 0.0, 'weather_soleado': 0.0
-}
-feature_max = {
-    'rms_value': 8572.0, 'rms_avg': 5529.1, 'rms_std': 2428.442090907025, 'is_day': 1.0,
-    'weather_con llovizna': 1.0, 'weather_con niebla': 1.0, 'weather_con tormentas': 1.0,
-    'weather_lloviendo': 1.0, 'weather_llovizna': 1.0,
-    'weather_parcialmente nublado': 1.0, 'weather_soleado': 1.0
-}
-
-# Mapping índice -> etiqueta
-class_map = {
-    0: "Actividad moderada",
-    1: "Ambiente tranquilo",
-    2: "Pico inesperado",
-    3: "Ruido elevado"
-}
-
 script_dir = os.path.dirname(os.path.abspath(__file__))
 model_path = os.path.join(script_dir, MODEL_FILENAME)
 
+# Orden de features, min/max del entrenamiento y clases: metadatos del modelo
+metadata = read_metadata(model_path)
+feature_names = metadata['feature_names']
+feature_min = dict(zip(feature_names, metadata['feature_min']))
+feature_max = dict(zip(feature_names, metadata['feature_max']))
+# Con el escalado dentro del grafo el modelo recibe los valores crudos
+normalized_in_graph = metadata['normalized_in_graph']
+
+# Mapping índice -> etiqueta
+class_map = dict(enumerate(metadata['class_names']))
+
 if not os.path.exists(model_path):
     raise FileNotFoundError(f"No se encontró el modelo TFLite en: {model_path}")
 
@@ -56,6 +38,8 @@ output_details = interpreter.get_output_details()
 
 def normalize_value(name, value):
     """Normaliza escalar entre 0 y 1 usando min/max conocidos."""
+    if normalized_in_graph:
+        return value
     mn = feature_min[name]
     mx = feature_max[name]
     denom = (mx - mn) if (mx - mn) != 0 else 1.0
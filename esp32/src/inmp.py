@@ -1,8 +1,136 @@
 from machine import Pin, I2S
-import struct, time, math
+from array import array
+import micropython
+import time
+import uasyncio as asyncio
+
+# Índices de INMP441.features
+RMS = 0         # RMS entero del intervalo
+DB_CENTI = 1    # nivel en centésimas de dB (0 = silencio)
+PEAK = 2        # |muestra| máxima
+ZCR = 3         # cruces por cero por cada 1000 muestras
+SAMPLES = 4     # muestras analizadas
+PEAKS = 5       # muestras con |valor| >= peak_threshold
+OVERRUNS = 6    # buffers perdidos en el intervalo (solo captura continua)
+
+# Estado del acumulador (_accumulate): suma de cuadrados en 64 bits (lo, hi),
+# pico, cruces por cero, nº de muestras, signo de la última muestra (-1 = ninguna),
+# muestras sobre el umbral y el umbral
+_LO, _HI, _PEAK, _CROSS, _COUNT, _LAST, _PEAKS, _THRESH = range(8)
+
+# log2(1 + i/16) en Q16 para calcular dB sin coma flotante
+_LOG2_TABLE = array("i", [0, 5732, 11136, 16248, 21098, 25711, 30109, 34312, 38336,
+                          42196, 45904, 49472, 52911, 56229, 59434, 62534, 65536])
+
+
+@micropython.viper
+def _accumulate(buf, n: int, state):
+    """Una pasada sobre n muestras int16 de buf: cuadrados, pico, picos y cruces por cero."""
+    p = ptr16(buf)
+    st = ptr32(state)
+    lo = uint(st[0])
+    hi = st[1]
+    peak = st[2]
+    crossings = st[3]
+    last = st[5]
+    peaks = st[6]
+    thresh = st[7]
+    for i in range(n):
+        s = p[i]
+        if s > 32767:
+            s -= 65536
+        neg = 0
+        a = s
+        if s < 0:
+            neg = 1
+            a = -s
+        if a > peak:
+            peak = a
+        if a >= thresh:
+            peaks += 1
+        new_lo = lo + uint(a * a)
+        if new_lo < lo:
+            hi += 1
+        lo = new_lo
+        if last >= 0 and neg != last:
+            crossings += 1
+        last = neg
+    st[0] = int(lo)
+    st[1] = hi
+    st[2] = peak
+    st[3] = crossings
+    st[4] = st[4] + n
+    st[5] = last
+    st[6] = peaks
+
+
+@micropython.viper
+def _finish(state, out, table):
+    """RMS (raíz entera de la media de cuadrados), centésimas de dB y pico."""
+    st = ptr32(state)
+    po = ptr32(out)
+    t = ptr32(table)
+    po[2] = st[2]
+    count = st[4]
+    if count <= 0:
+        po[0] = 0
+        po[1] = 0
+        return
+    lo = uint(st[0])
+    hi = uint(st[1])
+    n = uint(count)
+
+    # Media de cuadrados: división larga 64/32 bits (el resultado cabe en 31 bits)
+    q = uint(0)
+    rem = uint(0)
+    for bit in range(63, -1, -1):
+        if bit >= 32:
+            b = (hi >> uint(bit - 32)) & 1
+        else:
+            b = (lo >> uint(bit)) & 1
+        rem = (rem << 1) | b
+        if rem >= n:
+            rem -= n
+            if bit < 32:
+                q |= uint(1) << uint(bit)
+
+    # Raíz cuadrada entera
+    x = q
+    r = uint(0)
+    bitv = uint(1) << 30
+    while bitv > x:
+        bitv >>= 2
+    while bitv != 0:
+        if x >= r + bitv:
+            x -= r + bitv
+            r = (r >> 1) + bitv
+        else:
+            r >>= 1
+        bitv >>= 2
+    po[0] = int(r)
+
+    # dB = 10*log10(media de cuadrados) = 3.0103 * log2(...): centésimas con log2 en Q16
+    if q == 0:
+        po[1] = 0
+        return
+    msb = 0
+    v = q
+    while v > 1:
+        v >>= 1
+        msb += 1
+    if msb >= 16:
+        f = int((q >> uint(msb - 16)) & 0xFFFF)
+    else:
+        f = int((q << uint(16 - msb)) & 0xFFFF)
+    idx = f >> 12
+    frac = f & 0xFFF
+    log2_q16 = (msb << 16) + t[idx] + (((t[idx + 1] - t[idx]) * frac) >> 12)
+    po[1] = (log2_q16 * 301) >> 16
+
 
 class INMP441:
-    def __init__(self, pin_bck, pin_ws, pin_sd, i2s_id=0, sample_rate=16000, bits=16, format=I2S.MONO, ibuf=1024):
+    def __init__(self, pin_bck, pin_ws, pin_sd, i2s_id=0, sample_rate=16000, bits=16, format=I2S.MONO, ibuf=1024,
+                 peak_threshold=16384):
         # Guardar parámetros
         self.sample_rate = sample_rate
         self.bits = bits
@@ -29,28 +157,170 @@ class INMP441:
         # El buffer debe ser múltiplo de 2 (para 16 bits mono)
         self.buf = bytearray(512)
 
+        # Buffers del analizador, reservados una sola vez
+        self._state = array("i", [0, 0, 0, 0, 0, -1, 0, peak_threshold])
+        self.features = array("i", [0, 0, 0, 0, 0, 0, 0])
+        self._reader = None   # StreamReader de uasyncio (se crea al usarlo)
+
+        # Captura continua por IRQ (start_capture)
+        self._bufs = None
+        self._filled = None
+        self._fill_idx = 0
+        self._read_idx = 0
+        self._buffer_ms = 0
+        self._irq_handler = self._on_buffer   # método ligado creado una sola vez
+        self.overruns = 0
+
+        # Destino opcional de los buffers crudos (p.ej. telemetry.AudioStreamer):
+        # objeto con push(buf) y skip(muestras)
+        self.audio_sink = None
+        self._sink_overruns = 0
+
+    def _reset(self):
+        state = self._state
+        for i in range(_LAST):
+            state[i] = 0
+        state[_LAST] = -1
+        state[_PEAKS] = 0
+
+    def _capture(self):
+        """Lee un bloque de I2S y lo acumula; devuelve los bytes leídos."""
+        n = self.audio.readinto(self.buf)
+        if n:
+            _accumulate(self.buf, n >> 1, self._state)
+        return n
+
+    def _finish(self):
+        state = self._state
+        features = self.features
+        _finish(state, features, _LOG2_TABLE)
+        count = state[_COUNT]
+        features[ZCR] = state[_CROSS] * 1000 // count if count else 0
+        features[SAMPLES] = count
+        features[PEAKS] = state[_PEAKS]
+        features[OVERRUNS] = 0
+        return features
+
+    def analyze_frame(self):
+        """
+        Analiza un bloque (self.buf) en una sola pasada sin reservar memoria:
+        devuelve self.features (array reutilizado) con RMS, DB_CENTI, PEAK,
+        ZCR y SAMPLES.
+        """
+        self._reset()
+        self._capture()
+        return self._finish()
+
+    def analyze_interval(self, duration_ms):
+        """
+        Lee bloques seguidos durante duration_ms (todas las muestras a la
+        frecuencia de muestreo, sin huecos entre bloques) y devuelve los
+        agregados del intervalo en self.features.
+        """
+        self._reset()
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), start) < duration_ms:
+            self._capture()
+        return self._finish()
+
+    async def analyze_interval_async(self, duration_ms):
+        """
+        Como analyze_interval, pero con la I2S en modo uasyncio: mientras
+        el DMA llena el siguiente bloque, las demás tareas siguen corriendo.
+        """
+        if self._reader is None:
+            self._reader = asyncio.StreamReader(self.audio)
+        self._reset()
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), start) < duration_ms:
+            n = await self._reader.readinto(self.buf)
+            if n:
+                _accumulate(self.buf, n >> 1, self._state)
+        return self._finish()
+
+    # -------- Captura continua sin huecos (I2S no bloqueante + IRQ) -------- #
+
+    def start_capture(self, n_buffers=4, buffer_bytes=1024):
+        """
+        Pone la I2S en modo no bloqueante con n_buffers buffers rotativos:
+        el callback de la IRQ marca el buffer lleno y lanza la lectura del
+        siguiente mientras el programa analiza los ya completos. Si el
+        siguiente buffer todavía no se analizó, se descarta el más antiguo y
+        se cuenta un overrun.
+        """
+        if n_buffers < 2:
+            raise ValueError("Hacen falta al menos 2 buffers")
+        self._bufs = [bytearray(buffer_bytes) for _ in range(n_buffers)]
+        self._filled = array("b", bytes(n_buffers))
+        self._fill_idx = 0
+        self._read_idx = 0
+        self._buffer_ms = buffer_bytes // 2 * 1000 // self.sample_rate
+        self.overruns = 0
+        self.audio.irq(self._irq_handler)
+        self.audio.readinto(self._bufs[0])
+
+    def stop_capture(self):
+        self.audio.irq(None)
+        self._bufs = None
+
+    def _on_buffer(self, audio):
+        n = len(self._bufs)
+        i = self._fill_idx
+        self._filled[i] = 1
+        nxt = i + 1
+        if nxt == n:
+            nxt = 0
+        if self._filled[nxt]:
+            # El analizador va atrasado: se pierde el buffer más antiguo
+            self.overruns += 1
+            self._filled[nxt] = 0
+            if self._read_idx == nxt:
+                self._read_idx = nxt + 1 if nxt + 1 < n else 0
+        self._fill_idx = nxt
+        self.audio.readinto(self._bufs[nxt])
+
+    def _drain(self):
+        """Acumula todos los buffers completos pendientes, en orden."""
+        bufs = self._bufs
+        filled = self._filled
+        while filled[self._read_idx]:
+            i = self._read_idx
+            buf = bufs[i]
+            _accumulate(buf, len(buf) >> 1, self._state)
+            sink = self.audio_sink
+            if sink is not None:
+                lost = self.overruns - self._sink_overruns
+                if lost:
+                    sink.skip(lost * (len(buf) >> 1))
+                    self._sink_overruns = self.overruns
+                sink.push(buf)
+            filled[i] = 0
+            self._read_idx = i + 1 if i + 1 < len(bufs) else 0
+
+    async def capture_interval(self, duration_ms):
+        """
+        Agregados de todas las muestras capturadas durante duration_ms en el
+        modo continuo (start_capture): RMS, DB_CENTI, PEAK (máximo), PEAKS
+        (nº de muestras sobre el umbral), ZCR, SAMPLES y OVERRUNS.
+        """
+        self._reset()
+        overruns = self.overruns
+        start = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), start) < duration_ms:
+            self._drain()
+            await asyncio.sleep_ms(self._buffer_ms // 2)
+        self._drain()
+        features = self._finish()
+        features[OVERRUNS] = self.overruns - overruns
+        return features
+
     def read_sample(self):
         """Lee un bloque de muestras y devuelve un único valor RMS (para plotter)."""
-        n = self.audio.readinto(self.buf)
-        if n and n % 2 == 0:
-            samples = struct.unpack("<" + "h"*(n//2), self.buf[:n])
-            # Calcular RMS del bloque
-            rms = math.sqrt(sum([s**2 for s in samples]) / len(samples))
-            return int(rms)   # valor único para graficar
-        return 0
+        return self.analyze_frame()[RMS]
 
     def dbs(self):
         """Devuelve el nivel en decibelios positivos (0 = silencio)."""
-        n = self.audio.readinto(self.buf)
-        if n and n % 2 == 0:
-            samples = struct.unpack("<" + "h"*(n//2), self.buf[:n])
-            rms = math.sqrt(sum([s**2 for s in samples]) / len(samples))
-            if rms > 0:
-                # Normalizar a rango positivo: 0 dB = silencio, ~90 dB = muy fuerte
-                return 20 * math.log10(rms)
-            else:
-                return 0
-        return 0
+        return self.analyze_frame()[DB_CENTI] / 100
 
     def record_wav(self, filename, duration_sec):
         """Graba audio en formato WAV PCM16 escribiendo por bloques."""
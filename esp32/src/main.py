@@ -1,12 +1,24 @@
 """
 Archivo principal ESP32 - Sistema de Agente IA
 Maneja micrófono, LEDs y comunicación MQTT
+
+Runtime con uasyncio: tareas independientes que se comunican por colas
+pequeñas, de modo que la red o un efecto de LED no frenan el muestreo:
+  capture_task   -> I2S por IRQ (buffers rotativos) + inferencia local -> telemetry_q, led_q
+  telemetry_task -> tramas binarias -> MQTT
+  command_task   -> check_msg(): contexto y comandos de la Raspberry -> led_q
+  led_task       -> colores fijos y efectos (cancelables) en RGBLed
+  audio_task     -> (STREAM_AUDIO) trozos PCM16 en bruto -> MQTT
 """
 
 from rgb import RGBLed
-from inmp import INMP441
+from inmp import INMP441, RMS, PEAK, PEAKS, OVERRUNS
+from queues import Queue
 import mqtt
+import tinyml
+import telemetry
 import time
+import uasyncio as asyncio
 
 # Pines
 R = 4
@@ -16,44 +28,161 @@ SCK = 14
 WS  = 15
 SD  = 32
 
+MODEL_PATH = "sound_classifier.mlpq"   # generado por data/models/export_esp32.py
+INTERVAL_MS = 200       # cada lectura agrega todas las muestras de este intervalo
+FRAME_READINGS = 5      # lecturas por trama binaria publicada
+COMMAND_POLL_MS = 20    # cada cuánto se revisan los mensajes MQTT entrantes
+I2S_IBUF = 8192         # buffer DMA (~250 ms a 16 kHz) para absorber pausas de red
+CAPTURE_BUFFERS = 4     # buffers rotativos de la captura continua por IRQ
+CAPTURE_BUFFER_BYTES = 1024   # 32 ms de audio por buffer
+STREAM_AUDIO = False    # enviar también el audio en bruto (32 kB/s) a la Raspberry
+AUDIO_CHUNKS = 8        # trozos PCM16 en vuelo como máximo
+AUDIO_POLL_MS = 10
+
 # Instancias
 leds = RGBLed(R,G,B)
-mic = INMP441(SCK, WS, SD)
+mic = INMP441(SCK, WS, SD, ibuf=I2S_IBUF)
+rolling = tinyml.RollingRMS(10)
+frame = telemetry.TelemetryFrame(FRAME_READINGS)
+streamer = telemetry.AudioStreamer(CAPTURE_BUFFER_BYTES, AUDIO_CHUNKS) if STREAM_AUDIO else None
+mic.audio_sink = streamer
 
-def main():
+telemetry_q = Queue(FRAME_READINGS * 2)
+led_q = Queue(4)
 
-    mqtt.wifi_connect()
-    client = mqtt.mqtt_connect()
-    mqtt.mqtt_subscribe(client)
+try:
+    model = tinyml.QuantizedMLP(MODEL_PATH)
+except (OSError, ValueError) as e:
+    print("Sin modelo local, se usan los comandos de la Raspberry:", e)
+    model = None
 
-    try:
-        while True:
-            rms = mic.read_sample()
+# La inferencia local se activa al recibir el contexto de clima
+local_ready = False
+
+COLORS = {
+    "0": leds.yellow,
+    "1": leds.green,
+    "2": leds.blue,
+    "3": leds.red,
+}
+
+# Efectos que se pueden pedir por comando (corren como tarea aparte)
+EFFECTS = {
+    "red_blink": lambda: leds.blink_async(leds.red, 500, 0),
+    "blue_blink": lambda: leds.blink_async(leds.blue, 500, 0),
+    "purple_fade": lambda: leds.purple_fade_async("on"),
+}
+
+def apply_command(response):
+    COLORS.get(response, leds.off)()
+
+
+async def capture_task():
+    mic.start_capture(CAPTURE_BUFFERS, CAPTURE_BUFFER_BYTES)
+    while True:
+        # Todas las muestras del intervalo: la IRQ llena un buffer mientras se analiza otro
+        features = await mic.capture_interval(INTERVAL_MS)
+        rms = features[RMS]
+        rms_avg, rms_std = rolling.update(rms)
+        telemetry_q.put_nowait((rms, time.ticks_ms(), features[PEAK], features[PEAKS], features[OVERRUNS]))
+        if local_ready:
+            led_q.put_nowait(str(model.predict(rms, rms_avg, rms_std)))
+
+
+async def telemetry_task(client):
+    # Se sigue publicando (en tramas de FRAME_READINGS lecturas):
+    # la Raspberry audita y sirve de respaldo
+    while True:
+        reading = await telemetry_q.get()
+        if frame.add(*reading):
+            try:
+                mqtt.mqtt_publish_frame(client, frame.payload())
+            except OSError as e:
+                print("Error publicando trama:", e)
+            frame.reset()
 
-            mqtt.mqtt_publish(client, str(rms))
 
-            mqtt.check_messages(client)
-            if mqtt.latest_message is not None:
-                response = mqtt.latest_message
+async def audio_task(client):
+    while True:
+        i = streamer.next_ready()
+        if i is None:
+            await asyncio.sleep_ms(AUDIO_POLL_MS)
+            continue
+        try:
+            mqtt.mqtt_publish_audio(client, streamer.payload(i))
+        except OSError as e:
+            print("Error publicando audio:", e)
+        streamer.release(i)
+        await asyncio.sleep_ms(0)
 
-                if response == "0":
-                    leds.yellow()
-                elif response == "1":
-                    leds.green()
-                elif response == "2":
-                    leds.blue()
-                elif response == "3":
-                    leds.red()
-                else:
-                    leds.off()
 
-                mqtt.latest_message = None
+async def command_task(client):
+    global local_ready
+    while True:
+        mqtt.check_messages(client)
+        if mqtt.latest_context is not None:
+            context = tinyml.parse_context(mqtt.latest_context)
+            if model is not None and context is not None:
+                model.set_context(*context)
+                local_ready = True
+            mqtt.latest_context = None
 
-            time.sleep(0.2)
+        if mqtt.latest_message is not None:
+            # Con inferencia local los comandos de color de la Raspberry son solo
+            # respaldo; los efectos se aplican siempre
+            if not local_ready or mqtt.latest_message in EFFECTS:
+                led_q.put_nowait(mqtt.latest_message)
+            mqtt.latest_message = None
+
+        await asyncio.sleep_ms(COMMAND_POLL_MS)
+
+
+async def led_task():
+    current = None
+    effect = None
+    while True:
+        command = await led_q.get()
+        if command == current:
+            continue
+        current = command
+        # Un comando nuevo interrumpe el efecto en curso al instante
+        if effect is not None:
+            effect.cancel()
+            effect = None
+        start_effect = EFFECTS.get(command)
+        if start_effect is not None:
+            effect = asyncio.create_task(start_effect())
+        else:
+            apply_command(command)
+
+
+async def run(client):
+    tasks = [
+        asyncio.create_task(capture_task()),
+        asyncio.create_task(telemetry_task(client)),
+        asyncio.create_task(command_task(client)),
+        asyncio.create_task(led_task()),
+    ]
+    if streamer is not None:
+        tasks.append(asyncio.create_task(audio_task(client)))
+    # Si una tarea falla se detiene todo (y main() desconecta)
+    await asyncio.gather(*tasks)
+
+
+def main():
+
+    mqtt.wifi_connect()
+    client = mqtt.mqtt_connect()
+    mqtt.mqtt_subscribe(client)
+
+    try:
+        asyncio.run(run(client))
 
     except Exception as e:
         print("Error:", e)
     finally:
+        leds.off()
+        mic.stop_capture()
         client.disconnect()
         print("MQTT desconectado.")
 
@@ -61,4 +190,4 @@ def main():
 
 # Ejecutar main
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
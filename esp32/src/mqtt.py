@@ -4,12 +4,21 @@ import time
 from umqtt.simple import MQTTClient
 import secrets
 
+# Tópicos propios del dispositivo (la Raspberry responde en LED/<CLIENT_ID>)
+TOPIC_TELEMETRY = secrets.TOPIC_MIC + b"/" + secrets.CLIENT_ID
+TOPIC_LED_DEVICE = secrets.TOPIC_LED + b"/" + secrets.CLIENT_ID
+TOPIC_AUDIO_DEVICE = secrets.TOPIC_AUDIO + b"/" + secrets.CLIENT_ID
+
 latest_message = None
+latest_context = None   # "is_day,columna" retenido por la Raspberry
 
 def on_message(topic, msg):
-    global latest_message
+    global latest_message, latest_context
     print(f" Mensaje recibido en {topic.decode()}: {msg.decode()}")
-    latest_message = msg.decode()
+    if topic == secrets.TOPIC_CONTEXT:
+        latest_context = msg.decode()
+    else:
+        latest_message = msg.decode()
 
 def wifi_connect():
     sta = network.WLAN(network.STA_IF)
@@ -35,10 +44,20 @@ def mqtt_publish(client, message):
     client.publish(secrets.TOPIC_MIC, message)
     print(f"Publicado en {secrets.TOPIC_MIC.decode()}: {message}")
 
+def mqtt_publish_frame(client, payload):
+    """Publica una trama binaria de telemetry.TelemetryFrame en el tópico del dispositivo."""
+    client.publish(TOPIC_TELEMETRY, payload)
+
+def mqtt_publish_audio(client, payload):
+    """Publica un trozo PCM16 de telemetry.AudioStreamer (modo streaming)."""
+    client.publish(TOPIC_AUDIO_DEVICE, payload)
+
 
 
 def mqtt_subscribe(client):
     client.subscribe(secrets.TOPIC_LED)
+    client.subscribe(TOPIC_LED_DEVICE)
+    client.subscribe(secrets.TOPIC_CONTEXT)
 
 def check_messages(client):
     client.check_msg()
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""
+Cola acotada para uasyncio (MicroPython no trae asyncio.Queue).
+Si se llena descarta el elemento más antiguo: para telemetría y LEDs
+importa el dato más reciente, y put_nowait() nunca bloquea al productor.
+"""
+
+import uasyncio as asyncio
+
+
+class Queue:
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._items = []
+        self._event = asyncio.Event()
+        self.dropped = 0
+
+    def put_nowait(self, item):
+        if len(self._items) >= self.maxsize:
+            self._items.pop(0)
+            self.dropped += 1
+        self._items.append(item)
+        self._event.set()
+
+    async def get(self):
+        while not self._items:
+            self._event.clear()
+            await self._event.wait()
+        return self._items.pop(0)
+
+    def __len__(self):
+        return len(self._items)
@@ -1,5 +1,6 @@
 from machine import Pin, PWM
 import time
+import uasyncio as asyncio
 
 class RGBLed:
     def __init__(self, pin_r, pin_g, pin_b, freq=1000):
@@ -76,4 +77,28 @@ class RGBLed:
             for i in range(steps, -1, -1):
                 value = int(self.MAX * i / steps)
                 self.set_color(value, 0, value)
-                time.sleep(delay)
\ No newline at end of file
+                time.sleep(delay)
+
+    # -------- Efectos no bloqueantes (uasyncio) -------- #
+    # Ceden el control entre pasos y se pueden cancelar con task.cancel().
+    async def blink_async(self, color, delay_ms=1000, cycles=5):
+        """
+        Intermitente con cualquier color (p.ej. leds.red).
+        cycles=0 repite hasta que se cancele la tarea.
+        """
+        i = 0
+        while cycles == 0 or i < cycles:
+            color()
+            await asyncio.sleep_ms(delay_ms)
+            self.off()
+            await asyncio.sleep_ms(delay_ms)
+            i += 1
+
+    async def purple_fade_async(self, mode="on", duration_ms=4000, steps=100):
+        """Igual que purple_fade sin bloquear a las demás tareas."""
+        delay = duration_ms // steps
+        values = range(steps + 1) if mode == "on" else range(steps, -1, -1)
+        for i in values:
+            value = self.MAX * i // steps
+            self.set_color(value, 0, value)
+            await asyncio.sleep_ms(delay)
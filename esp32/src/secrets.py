@@ -4,4 +4,6 @@ BROKER    = "192.168.183.47"   # IP del broker (Raspberry)
 
 CLIENT_ID = b"esp32"
 TOPIC_MIC = b"INMP441"
-TOPIC_LED = b"LED"
\ No newline at end of file
+TOPIC_LED = b"LED"
+TOPIC_CONTEXT = b"CONTEXT"  # contexto de clima para la inferencia local
+TOPIC_AUDIO = b"AUDIO"      # audio PCM16 en trozos (modo streaming)
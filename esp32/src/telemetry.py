@@ -0,0 +1,132 @@
+"""
+Tramas binarias de telemetría (ESP32 -> Raspberry)
+Agrupa varias lecturas por publicación MQTT. Formato v2, little-endian:
+
+  cabecera  2s magic "RM", u8 versión, u8 nº de lecturas, u32 nº de trama
+  lectura   u32 nº de secuencia, u32 ticks_ms del ESP32, u16 rms,
+            u16 pico (|muestra| máx.), u16 nº de picos, u16 overruns
+
+(v1 tenía solo seq, ticks_ms y rms; la Raspberry acepta ambas.)
+
+La Raspberry (mqtt_host.decode_frame) la decodifica con numpy.frombuffer y
+usa los números de secuencia para contar tramas y lecturas perdidas.
+
+Modo streaming (AudioStreamer): trozos de audio PCM16 en bruto, little-endian:
+
+  cabecera  2s magic "PC", u8 versión, u8 reservado, u32 nº de trozo,
+            u32 índice de la primera muestra, u16 nº de muestras, u16 frecuencia
+  datos     int16[nº de muestras]
+
+(raspberry_pi/src/audio_stream.py los reensambla por índice de muestra.)
+"""
+
+import struct
+
+MAGIC = b"RM"
+FORMAT_VERSION = 2
+HEADER_FORMAT = "<2sBBI"
+RECORD_FORMAT = "<IIHHHH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)   # 8
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)   # 16
+
+
+def _u16(value):
+    if value > 65535:
+        return 65535
+    if value < 0:
+        return 0
+    return value
+
+
+class TelemetryFrame:
+    """Trama reutilizable: un único bytearray reservado al crearla."""
+
+    def __init__(self, max_readings=5):
+        if not 1 <= max_readings <= 255:
+            raise ValueError("max_readings debe estar entre 1 y 255")
+        self.max_readings = max_readings
+        self.buf = bytearray(HEADER_SIZE + RECORD_SIZE * max_readings)
+        self._view = memoryview(self.buf)
+        self.count = 0
+        self.frame_seq = 0
+        self.seq = 0
+
+    def add(self, rms, ts_ms, peak=0, peak_count=0, overruns=0):
+        """Añade una lectura; devuelve True cuando la trama está llena."""
+        offset = HEADER_SIZE + RECORD_SIZE * self.count
+        struct.pack_into(RECORD_FORMAT, self.buf, offset, self.seq & 0xFFFFFFFF, ts_ms & 0xFFFFFFFF,
+                         _u16(rms), _u16(peak), _u16(peak_count), _u16(overruns))
+        self.seq += 1
+        self.count += 1
+        return self.count >= self.max_readings
+
+    def payload(self):
+        """Cabecera + lecturas como memoryview (sin copiar) para publicar."""
+        struct.pack_into(HEADER_FORMAT, self.buf, 0, MAGIC, FORMAT_VERSION, self.count,
+                         self.frame_seq & 0xFFFFFFFF)
+        return self._view[:HEADER_SIZE + RECORD_SIZE * self.count]
+
+    def reset(self):
+        """Empieza la siguiente trama (tras publicar la actual)."""
+        self.count = 0
+        self.frame_seq += 1
+
+
+AUDIO_MAGIC = b"PC"
+AUDIO_VERSION = 1
+AUDIO_HEADER_FORMAT = "<2sBBIIHH"
+AUDIO_HEADER_SIZE = struct.calcsize(AUDIO_HEADER_FORMAT)   # 16
+
+
+class AudioStreamer:
+    """
+    Pool de trozos PCM16 reservados al crearlo. La captura llama a push()
+    con cada buffer completo (se copia al siguiente trozo libre) y una tarea
+    aparte publica los trozos listos. Si no quedan trozos libres el buffer
+    se descarta, pero el índice de muestra avanza: la Raspberry ve el hueco.
+    """
+
+    def __init__(self, chunk_bytes, n_chunks=4, sample_rate=16000):
+        self.sample_rate = sample_rate
+        self._chunks = [bytearray(AUDIO_HEADER_SIZE + chunk_bytes) for _ in range(n_chunks)]
+        self._views = [memoryview(c) for c in self._chunks]
+        self._sizes = [0] * n_chunks
+        self._free = list(range(n_chunks))
+        self._ready = []
+        self.chunk_seq = 0
+        self.sample_index = 0
+        self.dropped = 0
+
+    def push(self, buf):
+        """Copia un buffer de captura (PCM16) en un trozo libre."""
+        n = len(buf) >> 1
+        if not self._free:
+            self.dropped += 1
+            self.sample_index += n
+            return
+        i = self._free.pop()
+        struct.pack_into(AUDIO_HEADER_FORMAT, self._chunks[i], 0, AUDIO_MAGIC, AUDIO_VERSION, 0,
+                         self.chunk_seq & 0xFFFFFFFF, self.sample_index & 0xFFFFFFFF, n, self.sample_rate)
+        size = AUDIO_HEADER_SIZE + 2 * n
+        self._views[i][AUDIO_HEADER_SIZE:size] = buf[:2 * n]
+        self._sizes[i] = size
+        self.chunk_seq += 1
+        self.sample_index += n
+        self._ready.append(i)
+
+    def skip(self, samples):
+        """Muestras perdidas en la captura (overruns): se reflejan como hueco."""
+        self.sample_index += samples
+
+    def next_ready(self):
+        """Índice del trozo más antiguo pendiente de publicar, o None."""
+        if not self._ready:
+            return None
+        return self._ready.pop(0)
+
+    def payload(self, i):
+        return self._views[i][:self._sizes[i]]
+
+    def release(self, i):
+        """Devuelve el trozo al pool tras publicarlo."""
+        self._free.append(i)
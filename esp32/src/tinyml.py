@@ -0,0 +1,158 @@
+"""
+Inferencia local en el ESP32 (MicroPython)
+Carga el MLP cuantizado a punto fijo por data/models/export_esp32.py
+(sound_classifier.mlpq) y calcula la media/desviación móviles del RMS en
+el propio nodo, para decidir el color del LED sin esperar a la Raspberry.
+El contexto de clima (is_day + columna de clima) llega de la Raspberry por
+un tópico MQTT retenido y solo cambia de vez en cuando.
+"""
+
+import math
+import struct
+from array import array
+import micropython
+
+MAGIC = b"MLPQ"
+FORMAT_VERSION = 1
+INT16_MAX = 32767
+ACC_PRE_LIMIT = 65535
+
+
+@micropython.viper
+def _dense(x, n_in: int, w, b, acc, n_out: int):
+    # acc[j] = b[j] + sum_i w[j][i] * x[i]   (x int16, w int8, acc int32)
+    px = ptr16(x)
+    pw = ptr8(w)
+    pb = ptr32(b)
+    pa = ptr32(acc)
+    k = 0
+    for j in range(n_out):
+        s = pb[j]
+        for i in range(n_in):
+            xv = px[i]
+            if xv > 32767:
+                xv -= 65536
+            wv = pw[k]
+            if wv > 127:
+                wv -= 256
+            s += xv * wv
+            k += 1
+        pa[j] = s
+
+
+@micropython.viper
+def _requant_relu(acc, out, n: int, pre: int, mult: int, post: int):
+    # out = min(((max(acc, 0) >> pre) * mult) >> post, 32767)
+    pa = ptr32(acc)
+    po = ptr16(out)
+    for j in range(n):
+        v = pa[j]
+        if v < 0:
+            v = 0
+        v = v >> pre
+        if v > 65535:
+            v = 65535
+        v = (v * mult) >> post
+        if v > 32767:
+            v = 32767
+        po[j] = v
+
+
+class QuantizedMLP:
+    """MLP entero (int8/int16/int32) con todos los buffers reservados al cargar."""
+
+    def __init__(self, path="sound_classifier.mlpq"):
+        with open(path, "rb") as f:
+            magic, version, n_features, n_layers, _ = struct.unpack("<4sBBBB", f.read(8))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError("Modelo ESP32 no reconocido: " + path)
+            self.n_features = n_features
+            self.mins = struct.unpack("<%df" % n_features, f.read(4 * n_features))
+            self.k = struct.unpack("<%df" % n_features, f.read(4 * n_features))
+            self.layers = []
+            for _ in range(n_layers):
+                n_in, n_out, relu, pre, post, _, mult = struct.unpack("<HHBBBBi", f.read(12))
+                weights = bytearray(f.read(n_in * n_out))
+                bias = array("i", f.read(4 * n_out))
+                acc = array("i", bytes(4 * n_out))
+                out = array("h", bytes(2 * n_out)) if relu else None
+                self.layers.append((n_in, n_out, relu, pre, mult, post, weights, bias, acc, out))
+        self.num_classes = self.layers[-1][1]
+        self._x = array("h", bytes(2 * n_features))
+
+    def set_input(self, i, value):
+        """Cuantiza la característica cruda i en el buffer de entrada."""
+        q = int((value - self.mins[i]) * self.k[i])
+        if q > INT16_MAX:
+            q = INT16_MAX
+        elif q < -INT16_MAX:
+            q = -INT16_MAX
+        self._x[i] = q
+
+    def set_context(self, is_day, column):
+        """is_day 0/1 y columna one-hot del clima (índice de la característica, -1 si no hay)."""
+        self.set_input(3, is_day)
+        for i in range(4, self.n_features):
+            self.set_input(i, 1 if i == column else 0)
+
+    def predict(self, rms_value, rms_avg, rms_std):
+        """Devuelve el índice de clase (mismo orden que el modelo de la Raspberry)."""
+        self.set_input(0, rms_value)
+        self.set_input(1, rms_avg)
+        self.set_input(2, rms_std)
+        x = self._x
+        for n_in, n_out, relu, pre, mult, post, weights, bias, acc, out in self.layers:
+            _dense(x, n_in, weights, bias, acc, n_out)
+            if relu:
+                _requant_relu(acc, out, n_out, pre, mult, post)
+                x = out
+        best = 0
+        for j in range(1, self.num_classes):
+            if acc[j] > acc[best]:
+                best = j
+        return best
+
+
+class RollingRMS:
+    """
+    Media y desviación estándar muestral (ddof=1) de las últimas `window`
+    lecturas RMS, como rolling(10, min_periods=1) del generador de datasets.
+    Sumas enteras: sin deriva de coma flotante.
+    """
+
+    def __init__(self, window=10):
+        self.window = window
+        self._values = array("i", bytes(4 * window))
+        self._pos = 0
+        self._n = 0
+        self._sum = 0
+        self._sumsq = 0
+
+    def update(self, value):
+        value = int(value)
+        if self._n == self.window:
+            old = self._values[self._pos]
+            self._sum -= old
+            self._sumsq -= old * old
+        else:
+            self._n += 1
+        self._values[self._pos] = value
+        self._pos = (self._pos + 1) % self.window
+        self._sum += value
+        self._sumsq += value * value
+
+        n = self._n
+        mean = self._sum / n
+        if n < 2:
+            return mean, 0.0
+        var = (n * self._sumsq - self._sum * self._sum) / (n * (n - 1))
+        return mean, math.sqrt(var) if var > 0 else 0.0
+
+
+def parse_context(payload):
+    """Mensaje "is_day,columna" de la Raspberry -> (is_day, columna) o None."""
+    try:
+        is_day, column = payload.split(",")
+        return int(is_day), int(column)
+    except ValueError:
+        return None
@@ -1,46 +1,234 @@
-import requests
 import datetime
+import json
+import os
+import threading
+import time
+import requests
+import metrics
 
 # Coordenadas de Armenia, Quindío (aprox)
 LAT = 4.3270
 LON = 75.4120
 
+API_URL = os.environ.get("WEATHER_API_URL", "https://api.open-meteo.com/v1/forecast")
+SNAPSHOT_PATH = os.environ.get(
+    "WEATHER_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "weather_snapshot.json"),
+)
+CURRENT_TTL = 600          # s que se considera fresco el clima actual
+BACKOFF_MIN = 5            # s de espera tras el primer fallo
+BACKOFF_MAX = 600          # s de espera máxima entre reintentos
+REQUEST_TIMEOUT = 10
+
+_refreshes = metrics.counter("sound_weather_refreshes_total", "Consultas correctas a la API de clima")
+_refresh_errors = metrics.counter("sound_weather_errors_total", "Consultas fallidas a la API de clima")
+
+
+class WeatherService:
+    """
+    Contexto de clima cacheado para el camino de inferencia.
+    - Una sola sesión HTTP persistente.
+    - Amanecer/atardecer se piden una vez por día; is_day se calcula en
+      local con el reloj en cada consulta.
+    - El clima actual tiene un TTL: al caducar se sigue sirviendo el valor
+      viejo mientras un hilo lo revalida (stale-while-revalidate), con
+      espera exponencial si la API falla.
+    - El último estado se guarda en disco para arrancar sin red.
+    Ninguna consulta bloquea: get_status() solo lee la caché.
+    """
+
+    def __init__(self, base_url=API_URL, lat=LAT, lon=LON, ttl=CURRENT_TTL,
+                 snapshot_path=SNAPSHOT_PATH, session=None):
+        self.base_url = base_url
+        self.lat = lat
+        self.lon = lon
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self._session = session or requests.Session()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._refreshing = False
+
+        self._weathercode = None
+        self._fetched_at = 0.0
+        self._utc_offset = None
+        self._days = {}            # fecha local ISO -> (amanecer, atardecer) en epoch UTC
+
+        self._failures = 0
+        self._next_attempt = 0.0
+        self.requests = 0
+        self.errors = 0
+
+        self._load_snapshot()
+
+    # --- API pública ---
+
+    def get_status(self):
+        """
+        Devuelve (día/noche, estado, weathercode) sin esperar a la red,
+        o None si todavía no hay ningún dato.
+        """
+        self._maybe_refresh()
+        code = self._weathercode
+        if code is None:
+            return None
+        moment = "día" if self.is_day() else "noche"
+        return moment, interpret_weathercode(code), code
+
+    def is_day(self, now=None):
+        """Compara el reloj local con el amanecer/atardecer cacheados."""
+        now = time.time() if now is None else now
+        sun = self._sun_times(now)
+        if sun is None:
+            return False
+        sunrise, sunset = sun
+        return sunrise <= now < sunset
+
+    def wait_ready(self, timeout=None):
+        """Espera al primer dato (snapshot o API); True si ya hay clima."""
+        self._maybe_refresh()
+        return self._ready.wait(timeout)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "failures_in_a_row": self._failures,
+            "age_s": time.time() - self._fetched_at if self._fetched_at else None,
+        }
+
+    # --- caché ---
+
+    def _local_date(self, now):
+        offset = self._utc_offset or 0
+        return datetime.datetime.fromtimestamp(now + offset, datetime.timezone.utc).date().isoformat()
+
+    def _sun_times(self, now):
+        if not self._days:
+            return None
+        today = self._local_date(now)
+        sun = self._days.get(today)
+        if sun is not None:
+            return sun
+        # Sin datos de hoy (p.ej. snapshot de ayer): se desplaza el día más
+        # reciente; amanecer y atardecer cambian pocos minutos entre días.
+        last = max(self._days)
+        shift = (datetime.date.fromisoformat(today) - datetime.date.fromisoformat(last)).days * 86400
+        sunrise, sunset = self._days[last]
+        return sunrise + shift, sunset + shift
+
+    def _maybe_refresh(self):
+        now = time.time()
+        with self._lock:
+            stale = now - self._fetched_at >= self.ttl
+            missing_day = self._utc_offset is None or self._local_date(now) not in self._days
+            if not (stale or missing_day) or self._refreshing or now < self._next_attempt:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, args=(missing_day,), daemon=True).start()
+
+    def _refresh(self, with_daily):
+        try:
+            data = self._fetch(with_daily)
+            now = time.time()
+            with self._lock:
+                self._weathercode = int(data["current_weather"]["weathercode"])
+                self._fetched_at = now
+                self._utc_offset = int(data["utc_offset_seconds"])
+                if "daily" in data:
+                    self._store_days(data["daily"], self._utc_offset)
+                self._failures = 0
+                self._next_attempt = 0.0
+            _refreshes.inc()
+            self._ready.set()
+            self._save_snapshot()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                self._failures += 1
+                backoff = min(BACKOFF_MAX, BACKOFF_MIN * 2 ** (self._failures - 1))
+                self._next_attempt = time.time() + backoff
+            _refresh_errors.inc()
+            metrics.log("weather_error", "[ERROR - Weather] {} (reintento en {:.0f} s)", e, backoff)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _fetch(self, with_daily):
+        params = {
+            "latitude": self.lat,
+            "longitude": self.lon,
+            "current_weather": "true",
+            "timezone": "America/Bogota",
+        }
+        if with_daily:
+            params["daily"] = "sunrise,sunset"
+        self.requests += 1
+        r = self._session.get(self.base_url, params=params, timeout=REQUEST_TIMEOUT)
+        r.raise_for_status()
+        return r.json()
+
+    def _store_days(self, daily, utc_offset):
+        # Las horas llegan en hora local sin zona: se pasan a epoch UTC
+        for date, sr, ss in zip(daily["time"], daily["sunrise"], daily["sunset"]):
+            self._days[date] = (_local_iso_to_epoch(sr, utc_offset), _local_iso_to_epoch(ss, utc_offset))
+        # Solo hacen falta los días recientes
+        for date in sorted(self._days)[:-7]:
+            del self._days[date]
+
+    # --- snapshot en disco ---
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snap = json.load(f)
+            self._weathercode = snap["weathercode"]
+            self._fetched_at = float(snap["fetched_at"])
+            self._utc_offset = snap["utc_offset"]
+            self._days = {d: tuple(v) for d, v in snap["days"].items()}
+            if self._weathercode is not None:
+                self._ready.set()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            metrics.log("snapshot_error", "[ERROR - Weather] Snapshot ilegible ({}): {}", self.snapshot_path, e)
+
+    def _save_snapshot(self):
+        with self._lock:
+            snap = {
+                "weathercode": self._weathercode,
+                "fetched_at": self._fetched_at,
+                "utc_offset": self._utc_offset,
+                "days": self._days,
+            }
+        tmp = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snap, f)
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            metrics.log("snapshot_error", "[ERROR - Weather] No se pudo guardar el snapshot: {}", e)
+
+
+def _local_iso_to_epoch(value, utc_offset):
+    local = datetime.datetime.fromisoformat(value)
+    return local.replace(tzinfo=datetime.timezone.utc).timestamp() - utc_offset
+
+
+weather = WeatherService()
+metrics.register_func("sound_weather_age_seconds", "Antigüedad del clima en caché",
+                      lambda: weather.stats()["age_s"])
+
+
 def get_weather_status():
     """
-    Consulta Open-Meteo y devuelve un resumen:
-    - Si es de día o noche
+    Resumen del clima desde la caché (sin bloquear):
+    - Si es de día o noche (calculado con el reloj local)
     - Estado general del clima
+    - Código numérico del clima (weathercode de Open-Meteo)
+    Devuelve None si aún no hay ningún dato.
     """
-    try:
-        url = (
-            "https://api.open-meteo.com/v1/forecast"
-            f"?latitude={LAT}"
-            f"&longitude={LON}"
-            "&current_weather=true"
-            "&daily=sunrise,sunset"
-            "&timezone=America/Bogota"
-        )
-        r = requests.get(url, timeout=10)
-        data = r.json()
-
-        current = data["current_weather"]
-        daily = data["daily"]
-
-        # Offset horario local (ej. -18000 seg = -5h)
-        offset = datetime.timedelta(seconds=data["utc_offset_seconds"])
-
-        # Convertir a datetime con zona local
-        now = datetime.datetime.fromisoformat(current["time"]) + offset
-        sr = datetime.datetime.fromisoformat(daily["sunrise"][0]) + offset
-        ss = datetime.datetime.fromisoformat(daily["sunset"][0]) + offset
-
-        moment = "día" if sr <= now < ss else "noche"
-        state = interpret_weathercode(current["weathercode"])
-
-        return moment, state
-
-    except Exception as e:
-        return f"Error al obtener clima: {e}"
+    return weather.get_status()
 
 def interpret_weathercode(code):
     """
@@ -0,0 +1,297 @@
+"""
+audio_stream.py
+Ingesta de audio PCM16 en bruto enviado por el ESP32 en trozos
+(esp32/src/telemetry.py, AudioStreamer) y características espectrales por
+ventana calculadas con FFT de NumPy.
+
+Formato de un trozo (little-endian):
+  cabecera  2s magic "PC", u8 versión, u8 reservado, u32 nº de trozo,
+            u32 índice de la primera muestra, u16 nº de muestras, u16 frecuencia
+  datos     int16[nº de muestras]
+
+Por dispositivo se reensamblan los trozos en un buffer circular usando el
+índice de muestra (los huecos se rellenan con silencio y se cuentan) y,
+cada vez que hay suficientes muestras, se procesan todas las ventanas
+pendientes de una sola vez (matriz de ventanas -> rfft por filas).
+
+Características por ventana (SPECTRAL_FEATURE_NAMES):
+  - energía relativa por banda de frecuencia (suman 1)
+  - centroide espectral (Hz)
+  - factor de cresta (pico / RMS)
+  - RMS de la ventana
+"""
+
+import os
+import threading
+import wave
+import numpy as np
+
+CHUNK_MAGIC = b"PC"
+CHUNK_VERSION = 1
+CHUNK_HEADER = np.dtype([
+    ("magic", "S2"), ("version", "u1"), ("reserved", "u1"), ("chunk_seq", "<u4"),
+    ("sample_index", "<u4"), ("count", "<u2"), ("sample_rate", "<u2"),
+])
+
+SAMPLE_RATE = 16000
+WINDOW_SIZE = 1024          # 64 ms a 16 kHz
+HOP_SIZE = 512              # 50 % de solape
+RING_SECONDS = 4            # audio que se conserva por dispositivo
+BAND_EDGES_HZ = (0, 250, 500, 1000, 2000, 4000, 8000)
+
+SPECTRAL_FEATURE_NAMES = (
+    [f"band_{lo}_{hi}" for lo, hi in zip(BAND_EDGES_HZ[:-1], BAND_EDGES_HZ[1:])]
+    + ["spectral_centroid", "crest_factor", "window_rms"]
+)
+
+# Si se define, el audio reensamblado de cada dispositivo se guarda en
+# <AUDIO_RECORD_DIR>/<dispositivo>.wav (reproducible con dataset_generator.py --wav)
+AUDIO_RECORD_DIR = os.environ.get("AUDIO_RECORD_DIR")
+
+
+def decode_chunk(payload):
+    """
+    Decodifica un trozo sin copiar: devuelve (cabecera, muestras int16).
+    Lanza ValueError si el trozo no es válido.
+    """
+    if len(payload) < CHUNK_HEADER.itemsize:
+        raise ValueError("Trozo de audio demasiado corto")
+    header = np.frombuffer(payload, dtype=CHUNK_HEADER, count=1)[0]
+    if header["magic"] != CHUNK_MAGIC or header["version"] != CHUNK_VERSION:
+        raise ValueError("Trozo de audio no reconocido")
+    count = int(header["count"])
+    if len(payload) != CHUNK_HEADER.itemsize + 2 * count:
+        raise ValueError("Longitud de trozo incorrecta")
+    samples = np.frombuffer(payload, dtype="<i2", count=count, offset=CHUNK_HEADER.itemsize)
+    return header, samples
+
+
+class SpectralAnalyzer:
+    """
+    Características de un bloque de ventanas. La ventana de Hann, las
+    frecuencias de cada bin y los límites de banda se calculan una vez.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, window_size=WINDOW_SIZE, hop_size=HOP_SIZE,
+                 band_edges=BAND_EDGES_HZ):
+        self.sample_rate = sample_rate
+        self.window_size = window_size
+        self.hop_size = hop_size
+        self.window = np.hanning(window_size).astype(np.float32)
+        self.freqs = np.fft.rfftfreq(window_size, 1.0 / sample_rate).astype(np.float32)
+        # Primer bin de cada banda: np.add.reduceat suma las potencias por tramos
+        edges = np.searchsorted(self.freqs, band_edges[:-1], side="left")
+        self._band_starts = edges.astype(np.intp)
+        self._band_stop = int(np.searchsorted(self.freqs, band_edges[-1], side="right"))
+        self.num_features = len(band_edges) - 1 + 3
+
+    def frames(self, samples):
+        """Vista (n_ventanas, window_size) sobre samples sin copiar."""
+        n = 1 + (len(samples) - self.window_size) // self.hop_size
+        if n <= 0:
+            return samples[:0].reshape(0, self.window_size)
+        stride = samples.strides[0]
+        return np.lib.stride_tricks.as_strided(
+            samples, shape=(n, self.window_size), strides=(self.hop_size * stride, stride), writeable=False)
+
+    def features(self, frames):
+        """Matriz (n_ventanas, num_features) en el orden de SPECTRAL_FEATURE_NAMES."""
+        n = len(frames)
+        out = np.zeros((n, self.num_features), dtype=np.float32)
+        if n == 0:
+            return out
+        x = frames.astype(np.float32)
+        power = np.abs(np.fft.rfft(x * self.window, axis=1)) ** 2
+        power = power[:, :self._band_stop]
+        total = power.sum(axis=1)
+        safe_total = np.where(total > 0, total, 1.0)
+
+        bands = np.add.reduceat(power, self._band_starts, axis=1)
+        n_bands = bands.shape[1]
+        out[:, :n_bands] = bands / safe_total[:, None]
+        out[:, n_bands] = (power @ self.freqs[:self._band_stop]) / safe_total
+
+        rms = np.sqrt(np.mean(x * x, axis=1))
+        peak = np.abs(x).max(axis=1)
+        out[:, n_bands + 1] = np.where(rms > 0, peak / np.where(rms > 0, rms, 1.0), 0.0)
+        out[:, n_bands + 2] = rms
+        return out
+
+
+class DeviceStream:
+    """Buffer circular de un dispositivo, reensamblado por índice de muestra."""
+
+    def __init__(self, device, analyzer, capacity=SAMPLE_RATE * RING_SECONDS, record_dir=AUDIO_RECORD_DIR):
+        self.device = device
+        self.analyzer = analyzer
+        self._buf = np.zeros(capacity, dtype=np.int16)
+        self._start = 0             # índice de muestra de _buf[0]
+        self._end = 0               # índice de muestra siguiente al último escrito
+        self._next_window = None    # índice de muestra de la próxima ventana
+        self.latest = None          # últimas características calculadas
+        self.stats = {"chunks": 0, "samples": 0, "lost_samples": 0, "late_chunks": 0,
+                      "windows": 0, "resets": 0}
+        self._wav = None
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+            self._wav = wave.open(os.path.join(record_dir, f"{device}.wav"), "wb")
+            self._wav.setnchannels(1)
+            self._wav.setsampwidth(2)
+            self._wav.setframerate(analyzer.sample_rate)
+
+    def _reset_at(self, sample_index):
+        self._start = self._end = self._next_window = sample_index
+
+    def _compact(self, needed):
+        # Conserva al principio del buffer solo lo que falta por analizar
+        keep_from = min(max(self._next_window, self._end + needed - len(self._buf)), self._end)
+        keep = self._end - keep_from
+        if keep:
+            offset = keep_from - self._start
+            self._buf[:keep] = self._buf[offset:offset + keep]
+        self._start = keep_from
+        self._next_window = max(self._next_window, keep_from)
+
+    def write(self, sample_index, samples):
+        """Añade muestras en su posición; devuelve las características nuevas (o None)."""
+        self.stats["chunks"] += 1
+        capacity = len(self._buf)
+        if self._next_window is None:
+            self._reset_at(sample_index)
+        elif sample_index < self._start:
+            # El contador volvió atrás: el ESP32 se reinició
+            self.stats["resets"] += 1
+            self._reset_at(sample_index)
+        elif sample_index < self._end:
+            # Trozo repetido o fuera de orden (su hueco ya se rellenó): solo lo nuevo
+            skip = self._end - sample_index
+            if skip >= len(samples):
+                self.stats["late_chunks"] += 1
+                return None
+            samples = samples[skip:]
+            sample_index = self._end
+
+        gap = sample_index - self._end
+        self.stats["lost_samples"] += gap
+        if self._wav is not None:
+            # La grabación sigue a sample_index: los huecos van como silencio
+            # (también los que reinician el buffer) y el trozo entero después
+            self._write_silence(gap)
+            self._wav.writeframes(samples.astype("<i2").tobytes())
+        if gap + len(samples) > capacity:
+            # Hueco mayor que el buffer: se empieza de nuevo tras el hueco
+            kept = samples[-capacity:]
+            sample_index += len(samples) - len(kept)
+            samples = kept
+            self._reset_at(sample_index)
+            gap = 0
+        elif self._end - self._start + gap + len(samples) > capacity:
+            self._compact(gap + len(samples))
+
+        pos = self._end - self._start
+        if gap:
+            self._buf[pos:pos + gap] = 0
+            pos += gap
+        self._buf[pos:pos + len(samples)] = samples
+        self._end = sample_index + len(samples)
+        self.stats["samples"] += len(samples)
+        return self._analyze()
+
+    def _write_silence(self, frames):
+        # Por bloques: un hueco de horas no debe reservar todo el silencio de golpe
+        block = self.analyzer.sample_rate
+        while frames > 0:
+            n = min(frames, block)
+            self._wav.writeframes(bytes(2 * n))
+            frames -= n
+
+    def _analyze(self):
+        analyzer = self.analyzer
+        offset = self._next_window - self._start
+        available = self._buf[offset:self._end - self._start]
+        frames = analyzer.frames(available)
+        if not len(frames):
+            return None
+        features = analyzer.features(frames)
+        self._next_window += len(frames) * analyzer.hop_size
+        self.stats["windows"] += len(frames)
+        self.latest = features[-1]
+        return features
+
+    def close(self):
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+
+
+class AudioStreamIngest:
+    """Reensamblado y análisis de los streams de todos los dispositivos."""
+
+    def __init__(self, analyzer=None, record_dir=AUDIO_RECORD_DIR):
+        self.analyzer = analyzer or SpectralAnalyzer()
+        self.record_dir = record_dir
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.errors = 0
+
+    def on_chunk(self, device, payload):
+        """
+        Procesa un trozo recibido por MQTT. Devuelve la matriz de
+        características de las ventanas completadas (o None).
+        """
+        try:
+            header, samples = decode_chunk(payload)
+        except ValueError:
+            with self._lock:
+                self.errors += 1
+            return None
+        with self._lock:
+            stream = self._streams.get(device)
+            if stream is None:
+                stream = DeviceStream(device, self.analyzer, record_dir=self.record_dir)
+                self._streams[device] = stream
+            return stream.write(int(header["sample_index"]), samples)
+
+    def latest_features(self, device):
+        """Últimas características espectrales del dispositivo (o None)."""
+        with self._lock:
+            stream = self._streams.get(device)
+            return None if stream is None or stream.latest is None else stream.latest.copy()
+
+    def stats(self):
+        with self._lock:
+            return {device: dict(stream.stats) for device, stream in self._streams.items()}
+
+    def close(self):
+        with self._lock:
+            for stream in self._streams.values():
+                stream.close()
+
+
+ingest = AudioStreamIngest()
+
+
+def interval_features(samples, sample_rate=SAMPLE_RATE, interval_ms=200, analyzer=None):
+    """
+    Para reproducir una grabación: divide samples en intervalos de
+    interval_ms y devuelve (rms por intervalo, media de las características
+    espectrales de las ventanas de cada intervalo).
+    """
+    analyzer = analyzer or SpectralAnalyzer(sample_rate=sample_rate)
+    step = int(sample_rate * interval_ms / 1000)
+    n = len(samples) // step
+    blocks = np.asarray(samples[:n * step], dtype=np.float64).reshape(n, step)
+    rms = np.sqrt(np.mean(blocks * blocks, axis=1))
+
+    spectral = np.zeros((n, analyzer.num_features), dtype=np.float32)
+    per_block = 1 + (step - analyzer.window_size) // analyzer.hop_size
+    if per_block > 0 and n:
+        # Ventanas que empiezan y terminan dentro de cada intervalo, contadas
+        # desde su inicio: el resultado no depende de dónde empiece `samples`
+        # (dataset_generator.py lee las grabaciones por bloques)
+        windows = np.lib.stride_tricks.sliding_window_view(
+            np.asarray(samples[:n * step]).reshape(n, step), analyzer.window_size, axis=1)
+        frames = windows[:, ::analyzer.hop_size][:, :per_block]
+        feats = analyzer.features(frames.reshape(n * per_block, analyzer.window_size))
+        spectral = feats.reshape(n, per_block, -1).mean(axis=1)
+    return rms, spectral
@@ -0,0 +1,477 @@
+"""
+bench_e2e.py
+Benchmark de extremo a extremo del pipeline de la Raspberry (main.py) bajo
+carga, todo en local:
+  - broker MQTT falso (broker_stub.py) en su propio proceso;
+  - Open-Meteo falso (weather_stub.py);
+  - main.py como subproceso, con SOUND_TRACE_COMMANDS=1 para que cada
+    comando LED lleve el nº de secuencia de la lectura que lo originó;
+  - N ESP32 simulados (asyncio, en este proceso) que reproducen los rms de
+    data/datasets/data.csv en tramas binarias v2 por "INMP441/<id>", cada
+    uno desfasado para no publicar todos a la vez.
+
+Por cada número de dispositivos se arranca un main.py nuevo, se espera a
+que responda (modelo y clima cargados), se mide durante --duration segundos
+y se espera --drain segundos a los comandos rezagados. Latencia = envío de
+la trama -> llegada de su comando LED (mismo reloj, mismo host). Las tramas
+sin comando al terminar cuentan como perdidas.
+
+--decision-mode elige la etapa de decisión de main.py (decision.py):
+  always  un comando por trama (por defecto): mide latencia y pérdidas de
+          cada trama;
+  change  la que se usa en producción (solo cambios de estado, con
+          histéresis): la latencia es la de los comandos que sí se envían,
+          las pérdidas no se pueden deducir de los comandos y se informa de
+          commands_per_reading y de las lecturas puntuadas según las
+          métricas de main.py.
+
+Al final de cada nivel se leen las métricas de main.py (metrics.py) para
+repartir la latencia por etapa (media de cada histograma) y sus contadores
+de descartes.
+
+El informe JSON (--output) lleva el commit y los parámetros para poder
+comparar ejecuciones. send_lag_ms indica si el generador llegó a tiempo:
+si crece, la carga real fue menor que la pedida.
+
+Uso:
+  python bench_e2e.py --devices 1 10 50 100 200 400 --duration 10
+  SOUND_ML_BACKEND=numpy python bench_e2e.py --interval-ms 100 --frame-readings 1
+  python bench_e2e.py --devices 10 100 --decision-mode change
+"""
+
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import numpy as np
+import broker_stub
+from weather_stub import WeatherStub
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(SRC_DIR))
+DATA_CSV = os.path.join(REPO_ROOT, "data", "datasets", "data.csv")
+
+# Mismo formato que esp32/src/telemetry.py (v2)
+FRAME_HEADER = struct.Struct("<2sBBI")
+FRAME_RECORD = struct.Struct("<IIHHHH")
+
+DEVICE_COUNTS = (1, 10, 50, 100, 200, 400)
+INTERVAL_MS = 200           # como esp32/src/main.py
+FRAME_READINGS = 5
+WARMUP_TIMEOUT_S = 60.0
+STOP_TIMEOUT_S = 10.0
+
+# Histogramas de metrics.py que se resumen por nivel (media en µs)
+STAGE_HISTOGRAMS = {
+    "receive": "sound_mqtt_receive_seconds",
+    "features": "sound_features_seconds",
+    "inference": "sound_inference_seconds",
+    "publish": "sound_mqtt_publish_seconds",
+    "reading_to_prediction": "sound_reading_to_prediction_seconds",
+}
+PIPELINE_COUNTERS = (
+    "sound_mqtt_readings_dropped_total", "sound_mqtt_decode_errors_total",
+    "sound_batcher_dropped_total", "sound_commands_dropped_total",
+    "sound_inference_errors_total", "sound_worker_errors_total", "sound_predictions_total",
+    "sound_decision_changes_total", "sound_decision_keepalives_total",
+)
+DECISION_MODES = ("always", "change")
+
+
+def load_rms(path=DATA_CSV):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [int(float(row["rms_value"])) for row in csv.DictReader(f)]
+
+
+def _run_broker(conn):
+    async def serve():
+        broker = await broker_stub.BrokerStub().start()
+        conn.send(broker.port)
+        await broker.serve_forever()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def start_broker():
+    """Broker en otro proceso (no compite por el GIL con los clientes); devuelve (proceso, puerto)."""
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=_run_broker, args=(child,), daemon=True)
+    proc.start()
+    return proc, parent.recv()
+
+
+def _proc_cpu_s(pid):
+    """Tiempo de CPU (usuario + sistema) de un proceso según /proc (None si no hay)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _proc_rss_mb(pid):
+    """RSS máxima (VmHWM) de un proceso según /proc (None si no hay)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def scrape_metrics(port):
+    """Resumen de las métricas de main.py: media por etapa (µs), lote medio y contadores."""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as r:
+            text = r.read().decode()
+    except OSError:
+        return None
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#") and "{" not in line:
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+
+    def mean(name, scale=1.0):
+        count = values.get(f"{name}_count")
+        return values[f"{name}_sum"] / count * scale if count else None
+
+    return {
+        "stage_mean_us": {stage: mean(name, 1e6) for stage, name in STAGE_HISTOGRAMS.items()},
+        "inference_batch_mean": mean("sound_inference_batch_size"),
+        "counters": {name: values.get(name) for name in PIPELINE_COUNTERS},
+    }
+
+
+class SimulatedESP32:
+    """Un ESP32: publica tramas de lecturas y recoge sus comandos LED."""
+
+    def __init__(self, device, rms, offset, frame_readings):
+        self.device = device
+        self.rms = rms
+        self.pos = offset % len(rms)
+        self.frame_readings = frame_readings
+        self.frame_seq = 0
+        self.seq = 0
+        self.sent = {}          # seq de la última lectura -> instante de envío
+        self.frames_sent = 0
+        self.latencies_ms = []
+        self.send_lag_ms = []
+        self.unexpected = 0
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._first_reply = None
+
+    async def connect(self, port):
+        self._reader, self._writer = await asyncio.open_connection("127.0.0.1", port)
+        self._writer.write(broker_stub.connect_packet(self.device))
+        self._writer.write(broker_stub.subscribe_packet(1, [f"LED/{self.device}"]))
+        await self._writer.drain()
+        self._first_reply = asyncio.get_running_loop().create_future()
+        self._receiver = asyncio.create_task(self._receive())
+
+    async def _receive(self):
+        try:
+            while True:
+                ptype, flags, body = await broker_stub.read_packet(self._reader)
+                if ptype != broker_stub.PUBLISH:
+                    continue
+                now = time.perf_counter()
+                _, _, _, _, payload = broker_stub.parse_publish(flags, body)
+                try:
+                    seq = int(payload.split(b"|", 1)[1])
+                except (IndexError, ValueError):
+                    self.unexpected += 1
+                    continue
+                sent_at = self.sent.pop(seq, None)
+                if sent_at is None:
+                    self.unexpected += 1
+                    continue
+                self.latencies_ms.append((now - sent_at) * 1000.0)
+                if not self._first_reply.done():
+                    self._first_reply.set_result(None)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+
+    def send_frame(self):
+        n = self.frame_readings
+        ts_ms = int(time.monotonic() * 1000) & 0xFFFFFFFF
+        parts = [FRAME_HEADER.pack(b"RM", 2, n, self.frame_seq & 0xFFFFFFFF)]
+        for _ in range(n):
+            rms = min(self.rms[self.pos], 65535)
+            self.pos = (self.pos + 1) % len(self.rms)
+            parts.append(FRAME_RECORD.pack(self.seq & 0xFFFFFFFF, ts_ms, rms, min(rms * 3, 65535), 0, 0))
+            self.seq += 1
+        payload = b"".join(parts)
+        self.sent[(self.seq - 1) & 0xFFFFFFFF] = time.perf_counter()
+        self._writer.write(broker_stub.publish_packet(f"INMP441/{self.device}", payload))
+        self.frame_seq += 1
+        self.frames_sent += 1
+
+    async def run(self, start, end, period):
+        """Publica una trama cada `period` s en [start, end) con horario absoluto (sin deriva)."""
+        loop = asyncio.get_running_loop()
+        k = 0
+        while True:
+            due = start + k * period
+            if due >= end:
+                return
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.send_lag_ms.append(max(0.0, loop.time() - due) * 1000.0)
+            self.send_frame()
+            await self._writer.drain()
+            k += 1
+
+    async def wait_first_reply(self, period, timeout):
+        """Envía tramas hasta recibir el primer comando (pipeline listo)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.send_frame()
+            await self._writer.drain()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._first_reply), period)
+                return True
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def close(self):
+        self._receiver.cancel()
+        try:
+            self._writer.write(broker_stub.packet(broker_stub.DISCONNECT))
+            self._writer.close()
+        except ConnectionError:
+            pass
+
+
+def _percentiles(values):
+    if not len(values):
+        return {"p50": None, "p95": None, "p99": None, "max": None, "mean": None}
+    v = np.asarray(values)
+    p50, p95, p99 = np.percentile(v, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99),
+            "max": float(v.max()), "mean": float(v.mean())}
+
+
+async def _drive(n_devices, port, rms, args, pipeline_pid, metrics_port):
+    period = args.interval_ms * args.frame_readings / 1000.0
+
+    probe = SimulatedESP32("bench-warmup", rms, 0, args.frame_readings)
+    await probe.connect(port)
+    ready = await probe.wait_first_reply(min(period, 0.5), args.warmup_timeout)
+    await probe.close()
+    if not ready:
+        raise RuntimeError(f"main.py no respondió en {args.warmup_timeout:.0f} s")
+    loop = asyncio.get_running_loop()
+    # Para descontar las predicciones del calentamiento
+    baseline = await loop.run_in_executor(None, scrape_metrics, metrics_port)
+
+    stride = max(1, len(rms) // max(1, n_devices))
+    clients = [SimulatedESP32(f"bench-{i:04d}", rms, i * stride, args.frame_readings)
+               for i in range(n_devices)]
+    await asyncio.gather(*(c.connect(port) for c in clients))
+
+    start = loop.time() + 0.5
+    end = start + args.duration
+    cpu_start = _proc_cpu_s(pipeline_pid)
+    # Cada dispositivo con su fase dentro del periodo, como nodos no sincronizados
+    await asyncio.gather(*(c.run(start + period * i / n_devices, end, period)
+                           for i, c in enumerate(clients)))
+    cpu_end = _proc_cpu_s(pipeline_pid)
+    await asyncio.sleep(args.drain)
+    pipeline_metrics = await loop.run_in_executor(None, scrape_metrics, metrics_port)
+    for c in clients:
+        await c.close()
+
+    frames = sum(c.frames_sent for c in clients)
+    latencies = [x for c in clients for x in c.latencies_ms]
+    lag = [x for c in clients for x in c.send_lag_ms]
+    answered = len(latencies)
+    readings = frames * args.frame_readings
+    cpu = None if cpu_start is None or cpu_end is None else cpu_end - cpu_start
+    predictions = _counter_delta(baseline, pipeline_metrics, "sound_predictions_total")
+    if args.decision_mode == "always":
+        lost = frames - answered
+        processed = answered * args.frame_readings
+    else:
+        # Sin un comando por trama solo las métricas dicen qué se puntuó
+        lost = None
+        processed = predictions
+    return {
+        "devices": n_devices,
+        "duration_s": args.duration,
+        "decision_mode": args.decision_mode,
+        "frames_sent": frames,
+        "readings_sent": readings,
+        "commands_received": answered,
+        "commands_per_reading": answered / readings if readings else None,
+        "frames_lost": lost,
+        "loss_ratio": None if lost is None else (lost / frames if frames else 0.0),
+        "unexpected_commands": sum(c.unexpected for c in clients),
+        "offered_readings_per_s": readings / args.duration,
+        "processed_readings_per_s": None if processed is None else processed / args.duration,
+        "predictions": predictions,
+        "commands_per_s": answered / args.duration,
+        "latency_ms": _percentiles(latencies),
+        "send_lag_ms": _percentiles(lag),
+        "pipeline_cpu_percent": None if cpu is None else 100.0 * cpu / args.duration,
+        "pipeline_max_rss_mb": _proc_rss_mb(pipeline_pid),
+        "pipeline_metrics": pipeline_metrics,
+    }
+
+
+def _counter_delta(before, after, name):
+    if before is None or after is None:
+        return None
+    a, b = after["counters"].get(name), before["counters"].get(name)
+    return None if a is None or b is None else a - b
+
+
+def _stop_pipeline(proc):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(STOP_TIMEOUT_S)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def run_level(n_devices, port, weather_url, rms, args, workdir):
+    metrics_port = _free_port()
+    env = dict(
+        os.environ,
+        MQTT_BROKER="127.0.0.1",
+        MQTT_PORT=str(port),
+        SOUND_TRACE_COMMANDS="1",
+        SOUND_DECISION_MODE=args.decision_mode,
+        SOUND_METRICS_PORT=str(metrics_port),
+        WEATHER_API_URL=weather_url,
+        WEATHER_SNAPSHOT_PATH=os.path.join(workdir, "weather_snapshot.json"),
+        SOUND_STORE_DIR=os.path.join(workdir, f"store_{n_devices}") if args.store else "",
+    )
+    log = open(args.pipeline_log, "a") if args.pipeline_log else subprocess.DEVNULL
+    try:
+        proc = subprocess.Popen([sys.executable, "main.py"], cwd=SRC_DIR, env=env,
+                                stdout=log, stderr=subprocess.STDOUT)
+        try:
+            return asyncio.run(_drive(n_devices, port, rms, args, proc.pid, metrics_port))
+        finally:
+            _stop_pipeline(proc)
+    finally:
+        if log is not subprocess.DEVNULL:
+            log.close()
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SRC_DIR,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _fmt(value, spec=".1f"):
+    return "-" if value is None else format(value, spec)
+
+
+def print_level(r):
+    lat = r["latency_ms"]
+    loss = None if r["loss_ratio"] is None else r["loss_ratio"] * 100
+    print(f"{r['devices']:>5} disp | {r['offered_readings_per_s']:8.0f} -> "
+          f"{_fmt(r['processed_readings_per_s'], '8.0f')} lect/s | perdidas {_fmt(loss, '5.1f')}% | "
+          f"cmd/lect {_fmt(r['commands_per_reading'], '.3f')} | "
+          f"latencia p50 {_fmt(lat['p50'])} p95 {_fmt(lat['p95'])} p99 {_fmt(lat['p99'])} ms | "
+          f"CPU {_fmt(r['pipeline_cpu_percent'], '.0f')}% | retraso envío p99 "
+          f"{_fmt(r['send_lag_ms']['p99'])} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo con ESP32 simulados")
+    parser.add_argument("--devices", type=int, nargs="+", default=list(DEVICE_COUNTS),
+                        help="Números de dispositivos a probar")
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos de medición por nivel")
+    parser.add_argument("--drain", type=float, default=3.0,
+                        help="Segundos de espera a comandos rezagados")
+    parser.add_argument("--interval-ms", type=float, default=INTERVAL_MS,
+                        help="Intervalo entre lecturas de cada dispositivo")
+    parser.add_argument("--frame-readings", type=int, default=FRAME_READINGS,
+                        help="Lecturas por trama (1-255)")
+    parser.add_argument("--warmup-timeout", type=float, default=WARMUP_TIMEOUT_S)
+    parser.add_argument("--code", type=int, default=0, help="weathercode del clima falso")
+    parser.add_argument("--decision-mode", choices=DECISION_MODES, default="always",
+                        help="Etapa de decisión de main.py: un comando por trama o solo cambios")
+    parser.add_argument("--store", action="store_true",
+                        help="Mantener activo el almacén de historial (en un directorio temporal)")
+    parser.add_argument("--pipeline-log", help="Archivo donde guardar la salida de main.py")
+    parser.add_argument("-o", "--output", default="bench_e2e_report.json")
+    args = parser.parse_args()
+    if not 1 <= args.frame_readings <= 255:
+        parser.error("--frame-readings debe estar entre 1 y 255")
+
+    rms = load_rms()
+    stub = WeatherStub(args.code).start()
+    broker, port = start_broker()
+    levels = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_e2e_") as workdir:
+            for n in args.devices:
+                result = run_level(n, port, stub.url, rms, args, workdir)
+                print_level(result)
+                levels.append(result)
+    finally:
+        broker.terminate()
+        stub.stop()
+
+    report = {
+        "commit": _git_commit(),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "ml_backend": os.environ.get("SOUND_ML_BACKEND", "tflite"),
+        "params": {
+            "interval_ms": args.interval_ms,
+            "frame_readings": args.frame_readings,
+            "duration_s": args.duration,
+            "drain_s": args.drain,
+            "weathercode": args.code,
+            "decision_mode": args.decision_mode,
+            "store": args.store,
+        },
+        "levels": levels,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Informe guardado en: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
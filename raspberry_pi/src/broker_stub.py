@@ -0,0 +1,232 @@
+"""
+broker_stub.py
+Broker MQTT 3.1.1 mínimo (asyncio) para pruebas locales y benchmarks, sin
+instalar mosquitto:
+
+  python broker_stub.py --port 1883
+  MQTT_BROKER=127.0.0.1 MQTT_PORT=1883 python main.py
+
+Soporta lo que usan main.py y el ESP32: CONNECT, SUBSCRIBE/UNSUBSCRIBE con
+comodines + y #, PUBLISH QoS 0/1 (con PUBACK), mensajes retenidos y PING.
+Las suscripciones se conceden con QoS 0, así que todo se reenvía con QoS 0.
+No hay sesiones persistentes, autenticación ni last will.
+
+Las funciones de codificación (read_packet, connect_packet, ...) las
+reutiliza bench_e2e.py para sus ESP32 simulados.
+"""
+
+import argparse
+import asyncio
+import struct
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def _remaining_length(n):
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+
+def _string(value):
+    data = value.encode() if isinstance(value, str) else bytes(value)
+    return struct.pack("!H", len(data)) + data
+
+
+def packet(ptype, body=b"", flags=0):
+    return bytes([(ptype << 4) | flags]) + _remaining_length(len(body)) + body
+
+
+async def read_packet(reader):
+    """Lee un paquete: devuelve (tipo, flags, cuerpo). IncompleteReadError al cerrar."""
+    first = (await reader.readexactly(1))[0]
+    length = 0
+    shift = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    body = await reader.readexactly(length) if length else b""
+    return first >> 4, first & 0x0F, body
+
+
+def connect_packet(client_id, keepalive=60):
+    body = _string("MQTT") + bytes([4, 0x02]) + struct.pack("!H", keepalive) + _string(client_id)
+    return packet(CONNECT, body)
+
+
+def subscribe_packet(packet_id, filters):
+    body = struct.pack("!H", packet_id) + b"".join(_string(f) + b"\x00" for f in filters)
+    return packet(SUBSCRIBE, body, 0x02)
+
+
+def publish_packet(topic, payload, qos=0, packet_id=0, retain=False):
+    body = _string(topic)
+    if qos:
+        body += struct.pack("!H", packet_id)
+    return packet(PUBLISH, body + bytes(payload), (qos << 1) | int(retain))
+
+
+def parse_publish(flags, body):
+    """Devuelve (tópico, qos, id de paquete, retenido, payload)."""
+    qos = (flags >> 1) & 0x03
+    (topic_len,) = struct.unpack_from("!H", body)
+    topic = body[2:2 + topic_len].decode()
+    offset = 2 + topic_len
+    packet_id = 0
+    if qos:
+        (packet_id,) = struct.unpack_from("!H", body, offset)
+        offset += 2
+    return topic, qos, packet_id, bool(flags & 0x01), body[offset:]
+
+
+def _parse_filters(body, with_qos):
+    (packet_id,) = struct.unpack_from("!H", body)
+    filters = []
+    offset = 2
+    while offset < len(body):
+        (n,) = struct.unpack_from("!H", body, offset)
+        filters.append(body[offset + 2:offset + 2 + n].decode())
+        offset += 2 + n + (1 if with_qos else 0)
+    return packet_id, filters
+
+
+def topic_matches(topic_filter, topic):
+    f_parts = topic_filter.split("/")
+    t_parts = topic.split("/")
+    for i, part in enumerate(f_parts):
+        if part == "#":
+            return True
+        if i >= len(t_parts) or (part != "+" and part != t_parts[i]):
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+class BrokerStub:
+    """
+    Estado del broker: suscripciones y mensajes retenidos. Los filtros sin
+    comodines se buscan en un dict (con cientos de dispositivos cada uno
+    suscrito a su LED/<id>, recorrer todos por mensaje sería lo más caro).
+    """
+
+    def __init__(self):
+        self._exact = {}        # tópico -> {writer}
+        self._wildcard = {}     # filtro con comodines -> {writer}
+        self._retained = {}
+        self._server = None
+        self.stats = {"connections": 0, "received": 0, "delivered": 0}
+
+    def _table(self, topic_filter):
+        return self._wildcard if "+" in topic_filter or "#" in topic_filter else self._exact
+
+    def _subscribe(self, writer, topic_filter):
+        self._table(topic_filter).setdefault(topic_filter, set()).add(writer)
+        for topic, payload in self._retained.items():
+            if topic_matches(topic_filter, topic):
+                writer.write(publish_packet(topic, payload, retain=True))
+
+    def _unsubscribe(self, writer, topic_filter):
+        table = self._table(topic_filter)
+        writers = table.get(topic_filter)
+        if writers is not None:
+            writers.discard(writer)
+            if not writers:
+                del table[topic_filter]
+
+    def _route(self, topic, payload):
+        targets = set(self._exact.get(topic, ()))
+        for topic_filter, writers in self._wildcard.items():
+            if topic_matches(topic_filter, topic):
+                targets |= writers
+        if targets:
+            data = publish_packet(topic, payload)
+            for writer in targets:
+                writer.write(data)
+            self.stats["delivered"] += len(targets)
+
+    async def _handle(self, reader, writer):
+        self.stats["connections"] += 1
+        subscribed = set()
+        try:
+            while True:
+                ptype, flags, body = await read_packet(reader)
+                if ptype == PUBLISH:
+                    topic, qos, packet_id, retain, payload = parse_publish(flags, body)
+                    self.stats["received"] += 1
+                    if qos:
+                        writer.write(packet(PUBACK, struct.pack("!H", packet_id)))
+                    if retain:
+                        if payload:
+                            self._retained[topic] = payload
+                        else:
+                            self._retained.pop(topic, None)
+                    self._route(topic, payload)
+                elif ptype == CONNECT:
+                    writer.write(packet(CONNACK, b"\x00\x00"))
+                elif ptype == SUBSCRIBE:
+                    packet_id, filters = _parse_filters(body, True)
+                    writer.write(packet(SUBACK, struct.pack("!H", packet_id) + bytes(len(filters))))
+                    for topic_filter in filters:
+                        self._subscribe(writer, topic_filter)
+                        subscribed.add(topic_filter)
+                elif ptype == UNSUBSCRIBE:
+                    packet_id, filters = _parse_filters(body, False)
+                    for topic_filter in filters:
+                        self._unsubscribe(writer, topic_filter)
+                        subscribed.discard(topic_filter)
+                    writer.write(packet(UNSUBACK, struct.pack("!H", packet_id)))
+                elif ptype == PINGREQ:
+                    writer.write(packet(PINGRESP))
+                elif ptype == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for topic_filter in subscribed:
+                self._unsubscribe(writer, topic_filter)
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+
+async def _serve(host, port):
+    broker = await BrokerStub().start(host, port)
+    print(f"Broker MQTT falso en {host}:{broker.port}")
+    await broker.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Broker MQTT mínimo para pruebas locales")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,122 @@
+"""
+decision.py
+Etapa de decisión entre la predicción y publish_to_esp32: el comando LED de
+un dispositivo solo se publica cuando cambia su estado, en lugar de una vez
+por trama.
+
+Para cambiar de la clase actual a la nueva (argmax del modelo) hace falta:
+  - que la actual lleve al menos su tiempo mínimo (MIN_DWELL_S, por clase), y
+  - que la probabilidad de la nueva supere a la de la actual en HYSTERESIS
+    (las lecturas en el límite entre dos clases no hacen parpadear los LEDs).
+Las clases de IMMEDIATE_CLASSES ("Pico inesperado") entran sin esperar ni
+exigir margen; salir de ellas sí respeta su tiempo mínimo.
+
+Con KEEPALIVE_S > 0 el estado se vuelve a publicar si lleva ese tiempo sin
+enviarse (p.ej. para un ESP32 que se reconectó y perdió el último comando).
+
+Configuración por entorno:
+  SOUND_DECISION_MODE   "change" (por defecto) o "always" (un comando por
+                        trama como antes; lo usa bench_e2e.py para medir cada
+                        trama)
+  SOUND_HYSTERESIS      margen de probabilidad para cambiar de clase
+  SOUND_MIN_DWELL_S     tiempo mínimo por defecto en una clase (s)
+  SOUND_CLASS_DWELL_S   por clase: "Ruido elevado=2,Pico inesperado=0.5"
+  SOUND_KEEPALIVE_S     reenvío periódico del estado (0 = desactivado)
+"""
+
+import os
+import metrics
+
+DECISION_MODE = os.environ.get("SOUND_DECISION_MODE", "change")
+HYSTERESIS = float(os.environ.get("SOUND_HYSTERESIS", "0.15"))
+MIN_DWELL_S = float(os.environ.get("SOUND_MIN_DWELL_S", "1.0"))
+KEEPALIVE_S = float(os.environ.get("SOUND_KEEPALIVE_S", "30"))
+IMMEDIATE_CLASSES = ("Pico inesperado",)
+
+
+def parse_class_dwell(text):
+    """"clase=segundos,clase=segundos" -> {clase: segundos}."""
+    dwell = {}
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        name, _, seconds = item.rpartition("=")
+        if not name:
+            raise ValueError(f"Tiempo mínimo por clase mal formado: {item!r}")
+        dwell[name.strip()] = float(seconds)
+    return dwell
+
+
+CLASS_DWELL_S = parse_class_dwell(os.environ.get("SOUND_CLASS_DWELL_S"))
+
+_changes = metrics.counter("sound_decision_changes_total", "Cambios de estado publicados")
+_keepalives = metrics.counter("sound_decision_keepalives_total", "Estados reenviados por keepalive")
+_suppressed = metrics.counter("sound_decision_suppressed_total", "Predicciones que no generaron comando")
+_held = metrics.counter("sound_decision_held_total",
+                        "Cambios de clase retenidos por tiempo mínimo o histéresis")
+
+
+class DecisionStage:
+    """
+    Estado LED por dispositivo. update() se llama con cada predicción (desde
+    un único hilo, el del MicroBatcher) y devuelve el índice de clase que hay
+    que publicar o None.
+    """
+
+    def __init__(self, class_names, mode=DECISION_MODE, hysteresis=HYSTERESIS,
+                 min_dwell_s=MIN_DWELL_S, class_dwell_s=None, keepalive_s=KEEPALIVE_S,
+                 immediate_classes=IMMEDIATE_CLASSES):
+        if mode not in ("change", "always"):
+            raise ValueError(f"Modo de decisión desconocido: {mode}")
+        class_dwell_s = CLASS_DWELL_S if class_dwell_s is None else class_dwell_s
+        unknown = set(class_dwell_s) - set(class_names)
+        if unknown:
+            raise ValueError(f"Clases desconocidas en el tiempo mínimo: {sorted(unknown)}")
+        self.mode = mode
+        self.hysteresis = hysteresis
+        self.keepalive_s = keepalive_s
+        self.class_names = list(class_names)
+        # Por índice de clase
+        self.dwell = [class_dwell_s.get(name, min_dwell_s) for name in self.class_names]
+        self.immediate = {i for i, name in enumerate(self.class_names) if name in immediate_classes}
+        self._states = {}          # dispositivo -> [clase, desde, último envío]
+
+    def update(self, device, pred, probs, now, last_in_frame=True):
+        """
+        pred/probs: salida del modelo para una lectura; now: time.monotonic().
+        last_in_frame: en modo "always" solo se publica la última lectura de
+        cada trama (como hasta ahora).
+        """
+        if self.mode == "always":
+            return pred if last_in_frame else None
+
+        state = self._states.get(device)
+        if state is None:
+            self._states[device] = [pred, now, now]
+            _changes.inc()
+            return pred
+
+        current, since, last_sent = state
+        if pred != current:
+            if pred in self.immediate or (
+                    now - since >= self.dwell[current]
+                    and probs[pred] - probs[current] >= self.hysteresis):
+                state[0], state[1], state[2] = pred, now, now
+                _changes.inc()
+                return pred
+            _held.inc()
+
+        if self.keepalive_s > 0 and now - last_sent >= self.keepalive_s:
+            state[2] = now
+            _keepalives.inc()
+            return current
+        _suppressed.inc()
+        return None
+
+    def state(self, device):
+        """Clase publicada actualmente para el dispositivo (o None)."""
+        state = self._states.get(device)
+        return None if state is None else state[0]
+
+    def forget(self, device):
+        self._states.pop(device, None)
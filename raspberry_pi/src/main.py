@@ -1,77 +1,148 @@
 """
 Aplicación principal Raspberry Pi - Sistema de Agente IA
 Maneja MQTT, consultas API, Machine Learning y toma de decisiones
+
+Pipeline dirigido por eventos:
+  on_message (mqtt_host, texto o tramas binarias) -> cola por dispositivo -> inference_worker
+  -> estadísticas móviles -> MicroBatcher (FeatureEncoder + predict_normalized)
+  -> DecisionStage (solo cambios de estado, con histéresis) -> publish_to_esp32
+El worker se despierta en cuanto llega una lectura y puntúa cada una
+exactamente una vez; las lecturas de varios dispositivos que llegan juntas
+se agrupan en una sola invocación del modelo (espera máx. MICRO_BATCH_WAIT_MS).
+La latencia de cada etapa y los contadores se exportan en formato Prometheus
+(metrics.py, SOUND_METRICS_PORT); los mensajes por lectura salen por el log
+muestreado en lugar de un print por mensaje.
 """
 
-import time
 import threading
+import time
 import mqtt_host
 import api
-from ml import predict_sound_category, build_feature_list
+import audio_stream
+import decision
+import ml
+import metrics
+import store
+from ml import MicroBatcher, update_rms_batch
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="tensorflow")
 
-latest_rms_value = None
-latest_weather = None
-
-def weather_loop():
-    global latest_weather
-    while True:
-        try:
-            latest_weather = api.get_weather_status()  # [is_day_str, weather_name]
-        except Exception as e:
-            print(f"[ERROR - Weather] {e}")
-        time.sleep(10)
-
-def mqtt_listener_loop():
-    global latest_rms_value
-    while True:
-        try:
-            msg = mqtt_host.get_latest_message()
-            if msg is not None:
-                latest_rms_value = msg
-                mqtt_host.latest_message = None
-        except Exception as e:
-            print(f"[ERROR - MQTT] {e}")
-        time.sleep(0.2)
+MICRO_BATCH_WAIT_MS = 2.0
+MICRO_BATCH_MAX_ITEMS = 64
+STORE_FLUSH_S = 30.0   # cada cuánto se lleva el almacén a disco
+
+batcher = MicroBatcher(MICRO_BATCH_WAIT_MS, MICRO_BATCH_MAX_ITEMS)
+decider = decision.DecisionStage(ml.CLASS_NAMES)
+stop_event = threading.Event()
+# Historial de lecturas y predicciones (desactivado salvo con SOUND_STORE_DIR)
+history = store.TimeSeriesStore(store.STORE_DIR, ml.FEATURE_NAMES, ml.CLASS_NAMES) if store.STORE_DIR else None
+_published_context = None
+
+_context_changes = metrics.counter("sound_weather_context_changes_total",
+                                   "Cambios del contexto de clima publicados a los ESP32")
+_prediction_delay = metrics.histogram(
+    "sound_reading_to_prediction_seconds", "Desde la recepción de un mensaje hasta su predicción (reloj de pared)")
+_worker_errors = metrics.counter("sound_worker_errors_total", "Errores procesando lecturas")
+metrics.register_func("sound_batcher_batches_total", "Lotes invocados por el MicroBatcher",
+                      lambda: batcher.batches, "counter")
+
+
+def refresh_weather_context():
+    """
+    Lee el clima de la caché de api (sin red; is_day se calcula con el reloj)
+    y actualiza el contexto del encoder, que solo se rehace si cambió.
+    Cada cambio se publica también en TOPIC_CONTEXT para los ESP32.
+    """
+    global _published_context
+    status = api.get_weather_status()  # (is_day_str, weather_name, weathercode)
+    if status is not None:
+        ml.encoder.set_context_from_status(status)
+        # Los ESP32 que clasifican en local reciben el mismo contexto (retenido)
+        context = ml.encoder.context
+        if context != _published_context:
+            mqtt_host.publish_context(*context)
+            _published_context = context
+            _context_changes.inc()
+
+
+def on_prediction(context, pred, probs):
+    """
+    Callback del MicroBatcher: guarda la fila en el historial y pasa la
+    predicción a la etapa de decisión, que dice si hay que publicar un
+    comando al dispositivo (cambio de estado o keepalive).
+    """
+    device, last_in_frame, received_at, seq, rms_value, rms_avg, rms_std = context
+    _prediction_delay.observe(time.time() - received_at)
+    metrics.log("pred", "Predicción [{}]: {}", device, pred)
+
+    if history is not None:
+        features = ml.encoder.raw_features(rms_value, rms_avg, rms_std)
+        history.append(device, received_at, rms_value, features, pred, probs)
+
+    command = decider.update(device, pred, probs, time.monotonic(), last_in_frame)
+    if command is not None:
+        mqtt_host.publish_to_esp32(str(command), device, seq=seq)
+
+
+def process_readings(device, rms_values, received_at, seq=None):
+    """
+    Actualiza las estadísticas móviles con las lecturas de un mensaje (una
+    o una trama completa) y las envía a inferencia. seq es el nº de
+    secuencia de la última lectura (None en mensajes de texto).
+    """
+    rms_avgs, rms_stds = update_rms_batch(rms_values, device)
+
+    last = len(rms_values) - 1
+    for i, (rms_value, rms_avg, rms_std) in enumerate(zip(rms_values, rms_avgs, rms_stds)):
+        metrics.log("data", "Datos [{}]: rms={} avg={:.1f} std={:.1f}", device, rms_value, rms_avg, rms_std)
+        context = (device, i == last, received_at, seq, rms_value, rms_avg, rms_std)
+        batcher.submit(rms_value, rms_avg, rms_std, on_prediction, context)
+
+
+def inference_worker():
+    # Sin clima no hay vector completo: esperar el snapshot o la primera consulta
+    while not api.weather.wait_ready(1.0):
+        if stop_event.is_set():
+            return
+
+    while not stop_event.is_set():
+        # Bloquea hasta que on_message notifica nuevas lecturas
+        readings = mqtt_host.get_readings(timeout=1.0)
+        if readings:
+            refresh_weather_context()
+        for device, received_at, rms_values, seq in readings:
+            try:
+                process_readings(device, rms_values, received_at, seq)
+            except Exception as e:
+                _worker_errors.inc()
+                metrics.log("worker_error", "[ERROR - Inferencia] {}", e)
 
 
 def main():
 
+    metrics.start_http_server()
     client = mqtt_host.start_mqtt()
+    batcher.start()
 
-    weather_thread = threading.Thread(target=weather_loop, daemon=True)
-    weather_thread.start()
-
-    mqtt_thread = threading.Thread(target=mqtt_listener_loop, daemon=True)
-    mqtt_thread.start()
-
-    global latest_rms_value, latest_weather
+    worker_thread = threading.Thread(target=inference_worker, daemon=True)
+    worker_thread.start()
 
     try:
-        # Bucle principal
-        while True:
-
-            if latest_rms_value is None or latest_weather is None:
-                # Aún no se han recibido datos
-                time.sleep(0.5)
-                continue
-
-            data = build_feature_list(latest_rms_value, latest_weather)
-
-            print(f"Datos: {data}")
-
-            pred = predict_sound_category(data)
-
-            print(f"Predicción: {pred}")
-
-            mqtt_host.publish_to_esp32(str(pred))
-
-            time.sleep(0.2)
-
+        last_flush = time.monotonic()
+        while worker_thread.is_alive():
+            worker_thread.join(1.0)
+            if history is not None and time.monotonic() - last_flush >= STORE_FLUSH_S:
+                history.flush()
+                last_flush = time.monotonic()
 
     except KeyboardInterrupt:
         print("\n🛑 Finalizando...")
+        stop_event.set()
+        batcher.stop()
+        if history is not None:
+            history.close()
+        # Cierra las grabaciones WAV de AUDIO_RECORD_DIR (cabecera con la longitud final)
+        audio_stream.ingest.close()
         client.loop_stop()
         client.disconnect()
 
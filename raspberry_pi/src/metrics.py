@@ -0,0 +1,302 @@
+"""
+metrics.py
+Instrumentación ligera del agente: histogramas de latencia por etapa,
+contadores, endpoint HTTP en formato de texto de Prometheus y log muestreado.
+
+  - Histogram: cubetas fijas (BUCKETS, en segundos). observe() solo hace
+    una búsqueda binaria y dos sumas sobre la fila del hilo que llama.
+  - Counter: igual, un valor por hilo.
+    Cada hilo escribe únicamente en su propia fila (dict por id de hilo), así
+    que el camino caliente no toma ningún lock; el endpoint suma las filas al
+    leer (puede ver una observación a medio contar, nada más).
+  - register_func: métricas que ya calcula otro módulo (estadísticas del
+    publicador, de los dispositivos, del clima...) y se leen al exportar.
+  - log(): mensajes con límite de frecuencia por clave (LOG_RATE por segundo,
+    ráfagas de LOG_BURST); el formateo y el print ocurren en un hilo aparte y
+    los mensajes omitidos se cuentan y se indican en el siguiente que sale.
+
+SOUND_METRICS_PORT elige el puerto del endpoint (vacío lo desactiva):
+
+  curl http://127.0.0.1:9109/metrics
+"""
+
+import bisect
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = os.environ.get("SOUND_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.environ.get("SOUND_METRICS_PORT", "9109")
+LOG_RATE = float(os.environ.get("SOUND_LOG_RATE", "1"))     # mensajes/s por clave
+LOG_BURST = 5
+LOG_QUEUE_SIZE = 1024
+
+# 10 µs .. 10 s en pasos 1-2.5-5
+BUCKETS = tuple(m * 10.0 ** e for e in range(-5, 1) for m in (1.0, 2.5, 5.0)) + (10.0,)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def _fmt(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Contador monotónico; inc() sin locks (una celda por hilo)."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._cells = {}
+
+    def inc(self, n=1):
+        cell = self._cells.get(threading.get_ident())
+        if cell is None:
+            cell = self._cells.setdefault(threading.get_ident(), [0])
+        cell[0] += n
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in list(self._cells.values()))
+
+    def render(self):
+        return [f"{self.name} {_fmt(self.value)}"]
+
+
+class Histogram:
+    """Histograma de cubetas fijas; observe() sin locks (una fila por hilo)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._rows = {}
+
+    def _row(self):
+        row = self._rows.get(threading.get_ident())
+        if row is None:
+            # cubetas + (+Inf) y, al final, la suma
+            row = self._rows.setdefault(threading.get_ident(), [0] * (len(self.buckets) + 1) + [0.0])
+        return row
+
+    def observe(self, seconds):
+        row = self._row()
+        row[bisect.bisect_left(self.buckets, seconds)] += 1
+        row[-1] += seconds
+
+    def time(self):
+        """Context manager que observa la duración del bloque."""
+        return _Timer(self)
+
+    def snapshot(self):
+        """(recuentos por cubeta, no acumulados, con +Inf al final; suma en segundos)."""
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for row in list(self._rows.values()):
+            for i in range(len(counts)):
+                counts[i] += row[i]
+            total += row[-1]
+        return counts, total
+
+    @property
+    def count(self):
+        return sum(self.snapshot()[0])
+
+    def render(self):
+        counts, total = self.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            lines.append(f'{self.name}_bucket{{le="{_fmt(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_fmt(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _FuncMetric:
+    """Valor leído al exportar: fn() devuelve un número o {etiqueta: número}."""
+
+    def __init__(self, name, help_text, fn, kind, label):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.kind = kind
+        self.label = label
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [f'{self.name}{{{self.label}="{_escape(key)}"}} {_fmt(v)}'
+                    for key, v in value.items() if v is not None]
+        return [] if value is None else [f"{self.name} {_fmt(value)}"]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def counter(name, help_text):
+    return _register(Counter(name, help_text))
+
+
+def histogram(name, help_text, buckets=BUCKETS):
+    return _register(Histogram(name, help_text, buckets))
+
+
+def register_func(name, help_text, fn, kind="gauge", label="device"):
+    """Métrica calculada por fn() en cada exportación (gauge o counter)."""
+    return _register(_FuncMetric(name, help_text, fn, kind, label))
+
+
+def render():
+    """Todas las métricas en formato de texto de Prometheus (versión 0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+_server = None
+
+
+def start_http_server(port=None, host=METRICS_HOST):
+    """Sirve /metrics en un hilo; devuelve el servidor (None si está desactivado)."""
+    global _server
+    port = METRICS_PORT if port is None else port
+    if port in ("", None):
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        _server = ThreadingHTTPServer((host, int(port)), Handler)
+    except OSError as e:
+        # Sin endpoint el agente sigue funcionando
+        log("metrics_error", "[ERROR - Métricas] No se pudo abrir {}:{}: {}", host, port, e)
+        return None
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+# Log muestreado
+
+class SampledLog:
+    """
+    Límite de frecuencia por clave (cubeta de fichas): en el camino caliente
+    solo se comprueba la cubeta y se encola el formato con sus argumentos;
+    el hilo de log formatea e imprime. Si la cola está llena el mensaje se
+    descarta y se cuenta.
+    """
+
+    def __init__(self, rate=LOG_RATE, burst=LOG_BURST, queue_size=LOG_QUEUE_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}          # clave -> [fichas, último instante, omitidos]
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.suppressed = Counter("sound_log_suppressed_total", "Mensajes de log omitidos por el límite")
+        self.dropped = Counter("sound_log_dropped_total", "Mensajes de log descartados con la cola llena")
+        _register(self.suppressed)
+        _register(self.dropped)
+
+    def __call__(self, key, fmt, *args):
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets.setdefault(key, [float(self.burst), now, 0])
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1.0:
+            bucket[0] = tokens
+            bucket[2] += 1
+            self.suppressed.inc()
+            return False
+        bucket[0] = tokens - 1.0
+        skipped, bucket[2] = bucket[2], 0
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait((fmt, args, skipped))
+        except queue.Full:
+            self.dropped.inc()
+            return False
+        return True
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            fmt, args, skipped = self._queue.get()
+            try:
+                line = fmt.format(*args)
+            except Exception as e:
+                line = f"{fmt} {args} ({e})"
+            if skipped:
+                line += f" (+{skipped} omitidos)"
+            print(line, flush=True)
+
+    def flush(self, timeout=1.0):
+        """Espera (hasta timeout s) a que se impriman los mensajes encolados."""
+        deadline = time.monotonic() + timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+log = SampledLog()
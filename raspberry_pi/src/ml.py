@@ -1,10 +1,29 @@
+import json
 import os
+import queue
+import threading
+import time
+from collections import OrderedDict
 import numpy as np
-import tensorflow as tf
+from rolling import KeyedRollingStats, rolling_mean_std
+import metrics
 
-tflite = tf.lite
-
-MODEL_PATH = "C:/Users/Miguel/Desktop/U/Semestre 2025-2/PROFU I/PROJECT_S/data/models/sound_classifier.tflite"
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MODEL_PATH = os.environ.get(
+    "SOUND_MODEL_PATH",
+    os.path.join(_REPO_ROOT, "data", "models", "sound_classifier.tflite"),
+)
+# Pesos Dense exportados por data/models/export_numpy.py
+NUMPY_MODEL_PATH = os.environ.get(
+    "SOUND_NUMPY_MODEL_PATH",
+    os.path.splitext(MODEL_PATH)[0] + ".npz",
+)
+# "tflite" (intérprete de TensorFlow Lite) o "numpy" (sin importar TensorFlow)
+ML_BACKEND = os.environ.get("SOUND_ML_BACKEND", "tflite")
+# Entradas de la caché LRU de predicciones (0 = desactivada)
+PREDICTION_CACHE_SIZE = int(os.environ.get("SOUND_PREDICTION_CACHE", "0"))
+# Cada cuánto (s) se mira si el archivo del modelo cambió para recargarlo (0 = nunca)
+MODEL_CHECK_S = float(os.environ.get("SOUND_MODEL_CHECK_S", "1.0"))
 
 # Orden de características (debe coincidir con el entrenamiento)
 FEATURE_NAMES = [
@@ -15,47 +34,514 @@ FEATURE_NAMES = [
 ]
 
 
-# Valores mínimos y máximos del entrenamiento (para normalización)
-FEATURE_MIN = {
-    'rms_value': 1.0, 'rms_avg': 1.7, 'rms_std': 0.0, 'is_day': 0.0,
-    'weather_con llovizna': 0.0, 'weather_con niebla': 0.0, 'weather_con tormentas': 0.0,
-    'weather_lloviendo': 0.0, 'weather_llovizna': 0.0,
-    'weather_parcialmente nublado': 0.0, 'weather_soleado': 0.0
-}
 
-FEATURE_MAX = {
-    'rms_value': 8572.0, 'rms_avg': 5529.1, 'rms_std': 2428.442090907025, 'is_day': 1.0,
-    'weather_con llovizna': 1.0, 'weather_con niebla': 1.0, 'weather_con tormentas': 1.0,
-    'weather_lloviendo': 1.0, 'weather_llovizna': 1.0,
-    'weather_parcialmente nublado': 1.0, 'weather_soleado': 1.0
-}
+def _read_metadata(model_path):
+    """
+    Metadatos del modelo (<modelo>.json, data/models/model_metadata.py):
+    orden de características, clases, min/max del entrenamiento y si el
+    escalado va dentro del grafo.
+    """
+    path = os.path.splitext(model_path)[0] + ".json"
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No se encontraron los metadatos del modelo en: {path} "
+            "(se generan al entrenar con data/models/model_trainer.py)"
+        )
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Tamaños de lote preasignados del backend TFLite: cada uno tiene su propio
+# intérprete ya redimensionado, así nunca se llama a allocate_tensors() en caliente.
+BATCH_SIZES = (1, 8, 32, 128)
+
+
+class TFLiteBackend:
+    """
+    Inferencia con tf.lite.Interpreter (importa TensorFlow al crearse).
+    Acepta también modelos cuantizados (data/models/export_tflite.py): si la
+    entrada o la salida son enteras se aplican su escala y zero-point, así que
+    predict_probs recibe y devuelve float32 igual que con el modelo float.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path=MODEL_PATH):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"No se encontró el modelo TFLite en: {model_path}")
+        import tensorflow as tf
+
+        self._tflite = tf.lite
+        self.model_path = model_path
+        self.metadata = _read_metadata(model_path)
+        interpreter = self._tflite.Interpreter(model_path=model_path)
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+        self.input_index = input_details['index']
+        self.output_index = output_details['index']
+        self.num_classes = int(output_details['shape'][-1])
+        self.input_dtype = input_details['dtype']
+        self.output_dtype = output_details['dtype']
+        self._input_quant = input_details['quantization']
+        self._output_quant = output_details['quantization']
+        self._interpreters = {1: interpreter}
+        self._inputs = {}
+        self._lock = threading.Lock()
+
+    def _get_interpreter(self, size):
+        it = self._interpreters.get(size)
+        if it is None:
+            it = self._tflite.Interpreter(model_path=self.model_path)
+            it.resize_tensor_input(self.input_index, [size, len(FEATURE_NAMES)])
+            it.allocate_tensors()
+            self._interpreters[size] = it
+            self._inputs[size] = np.zeros((size, len(FEATURE_NAMES)), dtype=self.input_dtype)
+        return it
+
+    def _quantize(self, x):
+        if not np.issubdtype(self.input_dtype, np.integer):
+            return x
+        scale, zero_point = self._input_quant
+        info = np.iinfo(self.input_dtype)
+        q = np.round(x / scale) + zero_point
+        return np.clip(q, info.min, info.max).astype(self.input_dtype)
+
+    def _dequantize(self, y):
+        if not np.issubdtype(self.output_dtype, np.integer):
+            return y
+        scale, zero_point = self._output_quant
+        return (y.astype(np.float32) - zero_point) * scale
+
+    def predict_probs(self, x):
+        """
+        Ejecuta el modelo sobre un lote (N, 11) preparado por FeatureEncoder.
+        Usa el tamaño preasignado más pequeño que cabe (rellenando con ceros)
+        y trocea los lotes mayores que el máximo.
+        """
+        n = x.shape[0]
+        probs = np.empty((n, self.num_classes), dtype=np.float32)
+        x = self._quantize(x)
+        start = 0
+        with self._lock:
+            while start < n:
+                remaining = n - start
+                size = next((b for b in BATCH_SIZES if b >= remaining), BATCH_SIZES[-1])
+                m = min(size, remaining)
+                it = self._get_interpreter(size)
+                if size == 1:
+                    buf = x[start:start + 1]
+                else:
+                    buf = self._inputs[size]
+                    buf[:m] = x[start:start + m]
+                    buf[m:] = 0
+                it.set_tensor(self.input_index, buf)
+                it.invoke()
+                probs[start:start + m] = self._dequantize(it.get_tensor(self.output_index)[:m])
+                start += m
+        return probs
+
+
+class NumpyBackend:
+    """
+    Forward pass del MLP con NumPy puro (relu, relu, softmax) a partir del
+    .npz exportado; no importa TensorFlow.
+    """
+
+    name = "numpy"
+
+    def __init__(self, model_path=NUMPY_MODEL_PATH):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"No se encontró el artefacto NumPy en: {model_path} "
+                "(genéralo con data/models/export_numpy.py)"
+            )
+        with np.load(model_path) as data:
+            activations = [str(a) for a in data['activations']]
+            self.layers = [
+                (np.ascontiguousarray(data[f"W{i}"], dtype=np.float32),
+                 np.ascontiguousarray(data[f"b{i}"], dtype=np.float32),
+                 activations[i])
+                for i in range(len(activations))
+            ]
+        self.model_path = model_path
+        self.metadata = _read_metadata(model_path)
+        self.num_classes = int(self.layers[-1][1].shape[0])
+
+    def predict_probs(self, x):
+        h = x
+        for kernel, bias, activation in self.layers:
+            h = h @ kernel
+            h += bias
+            if activation == 'relu':
+                np.maximum(h, 0.0, out=h)
+            elif activation == 'softmax':
+                h -= h.max(axis=1, keepdims=True)
+                np.exp(h, out=h)
+                h /= h.sum(axis=1, keepdims=True)
+        return h
+
+
+def load_backend(name=ML_BACKEND):
+    """Crea el backend de inferencia por nombre ('tflite' o 'numpy')."""
+    if name == "numpy":
+        return NumpyBackend()
+    if name == "tflite":
+        return TFLiteBackend()
+    raise ValueError(f"Backend de inferencia desconocido: {name}")
 
 
-if not os.path.exists(MODEL_PATH):
-    raise FileNotFoundError(f"No se encontró el modelo TFLite en: {MODEL_PATH}")
+_backend = load_backend()
+NUM_CLASSES = _backend.num_classes
 
+MODEL_METADATA = _backend.metadata
+if MODEL_METADATA['feature_names'] != FEATURE_NAMES:
+    raise ValueError(f"El modelo {_backend.model_path} espera otras características: "
+                     f"{MODEL_METADATA['feature_names']}")
+# Clases del modelo por índice de salida (LabelEncoder ordena alfabéticamente)
+CLASS_NAMES = list(MODEL_METADATA['class_names'])
+# Con el escalado dentro del grafo el modelo recibe las características crudas
+NORMALIZED_IN_GRAPH = bool(MODEL_METADATA['normalized_in_graph'])
 
-# Cargar modelo TFLite
-interpreter = tflite.Interpreter(model_path=MODEL_PATH)
-interpreter.allocate_tensors()
 
-INPUT_DETAILS = interpreter.get_input_details()
-OUTPUT_DETAILS = interpreter.get_output_details()
+# Columnas one-hot de clima en FEATURE_NAMES
+WEATHER_COLUMNS = [n for n in FEATURE_NAMES if n.startswith('weather_')]
 
-def _normalize_value(name, value):
-    """Normaliza escalar entre 0 y 1 usando min/max conocidos."""
-    mn = FEATURE_MIN[name]
-    mx = FEATURE_MAX[name]
-    denom = (mx - mn) if (mx - mn) != 0 else 1.0
-    return (value - mn) / denom
+# Código numérico de Open-Meteo -> columna one-hot (mismos grupos que
+# api.interpret_weathercode; los códigos desconocidos no activan ninguna)
+WEATHERCODE_COLUMNS = {}
+for _codes, _column in (
+    ((0,), 'weather_soleado'),
+    ((1, 2, 3), 'weather_parcialmente nublado'),
+    ((45, 48), 'weather_con niebla'),
+    ((51, 53, 55, 56, 57), 'weather_con llovizna'),
+    ((61, 63, 65, 80, 81, 82), 'weather_lloviendo'),
+    ((95, 96, 99), 'weather_con tormentas'),
+):
+    for _code in _codes:
+        WEATHERCODE_COLUMNS[_code] = FEATURE_NAMES.index(_column)
+
+
+class FeatureEncoder:
+    """
+    Codificador precompilado de características.
+    La normalización min/max es un par de arrays scale/offset
+    (x_norm = x * scale + offset) y la parte de contexto (is_day + clima)
+    se guarda como una plantilla ya normalizada que solo se reconstruye
+    cuando cambia el clima. encode()/encode_batch() escriben en buffers
+    float32 reutilizados, listos para invocar el modelo.
+    Sin feature_min/feature_max (modelo con el escalado dentro del grafo)
+    las características pasan crudas, sin ninguna operación.
+    """
+
+    def __init__(self, feature_min=None, feature_max=None):
+        self._lock = threading.Lock()
+        self._context = None
+        self.set_scaling(feature_min, feature_max)
+        self._row = np.zeros((1, len(FEATURE_NAMES)), dtype=np.float32)
+        self._batch = np.zeros((0, len(FEATURE_NAMES)), dtype=np.float32)
+
+    def set_scaling(self, feature_min=None, feature_max=None):
+        """
+        Cambia el escalado min/max (None: sin normalizar) y rehace las
+        plantillas conservando el contexto; lo usa reload_model().
+        """
+        normalizes = feature_min is not None
+        if normalizes:
+            mins = np.asarray(feature_min, dtype=np.float32)
+            ranges = np.asarray(feature_max, dtype=np.float32) - mins
+            ranges[ranges == 0] = 1.0
+            scale = (1.0 / ranges).astype(np.float32)
+            offset = (-mins / ranges).astype(np.float32)
+        else:
+            scale = np.ones(len(FEATURE_NAMES), dtype=np.float32)
+            offset = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+        with self._lock:
+            self.normalizes, self.scale, self.offset = normalizes, scale, offset
+            self._templates = {}
+            self.template = self._build_template(*(self._context or (0, None)))
+
+    def _build_template(self, is_day, column):
+        key = (is_day, column)
+        template = self._templates.get(key)
+        if template is None:
+            raw = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+            raw[3] = is_day
+            if column is not None:
+                raw[column] = 1.0
+            template = raw * self.scale + self.offset if self.normalizes else raw
+            self._templates[key] = template
+        return template
+
+    def set_context(self, is_day, weathercode=None, weather_name=None):
+        """
+        Fija is_day (0/1) y el clima (código de Open-Meteo o, si no se
+        tiene, el nombre en español) para las siguientes lecturas.
+        """
+        if weathercode is not None:
+            column = WEATHERCODE_COLUMNS.get(int(weathercode))
+        else:
+            flags = _weather_name_to_flags(weather_name)
+            column = next((FEATURE_NAMES.index(k) for k, v in flags.items() if v), None)
+        context = (1 if is_day else 0, column)
+        if context != self._context:
+            with self._lock:
+                # Se asigna de una vez: el hilo de inferencia ve la plantilla vieja o la nueva
+                self.template = self._build_template(*context)
+                self._context = context
+
+    @property
+    def context(self):
+        """(is_day, índice de la columna de clima o None) del contexto actual."""
+        return self._context
+
+    def raw_features(self, rms_value, rms_avg, rms_std):
+        """Vector crudo (sin normalizar) en el orden de FEATURE_NAMES con el contexto actual."""
+        is_day, column = self._context or (0, None)
+        raw = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+        raw[0], raw[1], raw[2], raw[3] = rms_value, rms_avg, rms_std, is_day
+        if column is not None:
+            raw[column] = 1.0
+        return raw
+
+    def set_context_from_status(self, status_weather):
+        """Igual que set_context a partir de (día/noche, nombre[, código])."""
+        try:
+            day_string, weather_string = status_weather[0], status_weather[1]
+        except Exception:
+            day_string, weather_string = '', ''
+        try:
+            weathercode = status_weather[2]
+        except Exception:
+            weathercode = None
+        self.set_context(_normalize_is_day(day_string), weathercode, weather_string)
+
+    def encode(self, rms_value, rms_avg, rms_std):
+        """Devuelve el buffer (1, 11) para el modelo; se sobrescribe en la siguiente llamada."""
+        row = self._row[0]
+        row[:] = self.template
+        if self.normalizes:
+            row[0] = rms_value * self.scale[0] + self.offset[0]
+            row[1] = rms_avg * self.scale[1] + self.offset[1]
+            row[2] = rms_std * self.scale[2] + self.offset[2]
+        else:
+            row[0], row[1], row[2] = rms_value, rms_avg, rms_std
+        return self._row
+
+    def encode_batch(self, rms_values, rms_avgs, rms_stds):
+        """Como encode() para N lecturas; devuelve una vista (N, 11) de un buffer reutilizado."""
+        n = len(rms_values)
+        if self._batch.shape[0] < n:
+            self._batch = np.zeros((max(n, 2 * self._batch.shape[0]), len(FEATURE_NAMES)), dtype=np.float32)
+        out = self._batch[:n]
+        out[:] = self.template
+        for col, values in enumerate((rms_values, rms_avgs, rms_stds)):
+            if self.normalizes:
+                np.multiply(values, self.scale[col], out=out[:, col], casting='unsafe')
+                out[:, col] += self.offset[col]
+            else:
+                out[:, col] = values
+        return out
+
+    def normalize(self, matrix):
+        """Prepara para el modelo una matriz (N, 11) de valores crudos."""
+        x = np.asarray(matrix, dtype=np.float32)
+        if x.ndim != 2 or x.shape[1] != len(FEATURE_NAMES):
+            raise ValueError(f"Se esperaba una matriz (N, {len(FEATURE_NAMES)}) (recibida {x.shape}).")
+        return x * self.scale + self.offset if self.normalizes else x
+
+
+encoder = (
+    FeatureEncoder() if NORMALIZED_IN_GRAPH
+    else FeatureEncoder(MODEL_METADATA['feature_min'], MODEL_METADATA['feature_max'])
+)
 
 
 def _list_to_vector(lst):
-    """Convierte lista en vector normalizado en el orden de FEATURE_NAMES."""
+    """Convierte lista en el vector de entrada del modelo en el orden de FEATURE_NAMES."""
     if len(lst) != len(FEATURE_NAMES):
         raise ValueError(f"La lista debe tener {len(FEATURE_NAMES)} elementos (recibidos {len(lst)}).")
-    normed = [_normalize_value(FEATURE_NAMES[i], float(lst[i])) for i in range(len(FEATURE_NAMES))]
-    return np.array(normed, dtype=np.float32)
+    return encoder.normalize(np.asarray(lst, dtype=np.float32)[None, :])[0]
+
+
+def _matrix_to_batch(matrix):
+    """Prepara una matriz (N, 11) de valores crudos de forma vectorizada."""
+    return encoder.normalize(matrix)
+
+
+class PredictionCache:
+    """
+    Caché LRU de predicciones indexada por el vector de 11 características
+    cuantizado (redondeado al múltiplo más cercano de su paso). `steps` da
+    el paso de cuantización de cada característica en unidades crudas
+    (p.ej. {'rms_avg': 5.0}); las que no aparecen usan 1.0, así rms_value
+    (entero del ESP32) y los flags 0/1 se comparan exactos.
+    Cuando cambia el archivo del modelo, check_model() recarga el backend y
+    el escalado y vacía la caché con reset().
+    """
+
+    def __init__(self, max_entries=4096, steps=None, feature_encoder=None):
+        self._raw_steps = np.array([(steps or {}).get(n, 1.0) for n in FEATURE_NAMES], dtype=np.float64)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._set_encoder(feature_encoder or encoder)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _set_encoder(self, enc):
+        scale = enc.scale.astype(np.float64)
+        # x_norm = x * scale + offset  ->  x = (x_norm - offset) / scale
+        self._inv_step = 1.0 / (self._raw_steps * scale)
+        # +0.5 para que el redondeo de float32 no parta valores exactos
+        self._shift = -enc.offset.astype(np.float64) / scale / self._raw_steps + 0.5
+
+    def reset(self, feature_encoder=None):
+        """Vacía la caché (modelo nuevo) y toma el escalado actual del encoder."""
+        with self._lock:
+            self._set_encoder(feature_encoder or encoder)
+            self._entries.clear()
+            self.invalidations += 1
+
+    def keys(self, x):
+        """Claves (bytes) de un lote normalizado (N, 11)."""
+        q = np.floor(x.astype(np.float64) * self._inv_step + self._shift).astype(np.int32)
+        return [row.tobytes() for row in q]
+
+    def lookup(self, keys):
+        """Devuelve una lista con (índice, probs) o None por cada clave."""
+        with self._lock:
+            found = []
+            for key in keys:
+                hit = self._entries.get(key)
+                if hit is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                found.append(hit)
+            return found
+
+    def store(self, key, idx, probs):
+        probs = np.array(probs, dtype=np.float32)
+        probs.flags.writeable = False
+        with self._lock:
+            self._entries[key] = (int(idx), probs)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE) if PREDICTION_CACHE_SIZE > 0 else None
+
+
+# Recarga del modelo
+# El .json de metadatos forma parte del modelo: se vigilan los dos archivos
+def _model_signature(model_path):
+    sig = []
+    for path in (model_path, os.path.splitext(model_path)[0] + ".json"):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        sig.append((st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+_model_lock = threading.Lock()
+_model_sig = _model_signature(_backend.model_path)
+_next_model_check = time.monotonic() + MODEL_CHECK_S
+
+
+def check_model():
+    """
+    Recarga el modelo si su archivo o sus metadatos cambiaron (como mucho
+    una comprobación cada MODEL_CHECK_S). Hay que llamarla antes de
+    codificar un lote, no entre codificar y predecir: el escalado del
+    encoder puede cambiar con el modelo. Devuelve True si se recargó.
+    """
+    global _next_model_check
+    if MODEL_CHECK_S <= 0:
+        return False
+    now = time.monotonic()
+    if now < _next_model_check:
+        return False
+    with _model_lock:
+        if now < _next_model_check:
+            return False
+        _next_model_check = now + MODEL_CHECK_S
+        sig = _model_signature(_backend.model_path)
+        if sig is None or sig == _model_sig:
+            return False
+        return _reload_model(sig)
+
+
+def _reload_model(sig):
+    """
+    Carga el backend de nuevo y, si es compatible (mismas características
+    y clases), cambia el escalado del encoder, el backend y vacía la caché.
+    Si falla (p.ej. archivo a medio escribir) se sigue con el modelo anterior
+    y se reintenta en la siguiente comprobación.
+    """
+    global _backend, _model_sig, MODEL_METADATA, NORMALIZED_IN_GRAPH
+    try:
+        backend = load_backend(_backend.name)
+        metadata = backend.metadata
+        if metadata['feature_names'] != FEATURE_NAMES:
+            raise ValueError(f"espera otras características: {metadata['feature_names']}")
+        if list(metadata['class_names']) != CLASS_NAMES or backend.num_classes != NUM_CLASSES:
+            raise ValueError(f"tiene otras clases: {metadata['class_names']} (hay que reiniciar)")
+    except Exception as e:
+        _model_reload_errors.inc()
+        metrics.log("model_reload_error", "[ERROR - Modelo] No se pudo recargar {}: {}", _backend.model_path, e)
+        return False
+    normalized = bool(metadata['normalized_in_graph'])
+    if normalized:
+        encoder.set_scaling()
+    else:
+        encoder.set_scaling(metadata['feature_min'], metadata['feature_max'])
+    _backend = backend
+    MODEL_METADATA = metadata
+    NORMALIZED_IN_GRAPH = normalized
+    _model_sig = sig
+    if prediction_cache is not None:
+        prediction_cache.reset(encoder)
+    _model_reloads.inc()
+    metrics.log("model_reload", "🔄 Modelo recargado: {}", backend.model_path)
+    return True
+
+
+# Métricas (metrics.py)
+_features_seconds = metrics.histogram(
+    "sound_features_seconds", "Estadísticas móviles de un mensaje (o una lectura en build_feature_list)")
+_inference_seconds = metrics.histogram("sound_inference_seconds", "Invocación del modelo por lote")
+_batch_size = metrics.histogram("sound_inference_batch_size", "Lecturas por invocación del modelo",
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+_predictions = metrics.counter("sound_predictions_total", "Lecturas puntuadas por el modelo")
+_inference_errors = metrics.counter("sound_inference_errors_total",
+                                    "Errores al puntuar un lote o en el callback de una lectura")
+_model_reloads = metrics.counter("sound_model_reloads_total", "Recargas del modelo al cambiar su archivo")
+_model_reload_errors = metrics.counter("sound_model_reload_errors_total", "Recargas del modelo fallidas")
+_batcher_dropped = metrics.counter("sound_batcher_dropped_total",
+                                   "Lecturas descartadas por cola del MicroBatcher llena")
 
 
 # Predicción
@@ -64,38 +550,184 @@ def predict_sound_category(values_list):
     Recibe una lista de valores en el mismo orden de FEATURE_NAMES.
     Devuelve el índice (int) de la categoría predicha.
     """
+    check_model()
     vec = _list_to_vector(values_list)
     x = np.expand_dims(vec, axis=0).astype(np.float32)
-    interpreter.set_tensor(INPUT_DETAILS[0]['index'], x)
-    interpreter.invoke()
-    out = interpreter.get_tensor(OUTPUT_DETAILS[0]['index'])
-    probs = np.squeeze(out)
-    pred_idx = int(np.argmax(probs))
-    return pred_idx
+    indices, _ = predict_normalized(x)
+    return int(indices[0])
+
+
+def predict_normalized(x):
+    """
+    Recibe un lote ya preparado para el modelo (N, 11), p.ej. la salida de
+    FeatureEncoder (normalizado, o crudo si el escalado va en el grafo).
+    Devuelve (índices (N,), probabilidades (N, clases)).
+    Con prediction_cache activa solo se invoca el modelo para las filas
+    que no están en caché.
+    """
+    if x.shape[0] == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, NUM_CLASSES), dtype=np.float32)
+    start = time.perf_counter()
+    indices, probs = _predict_normalized(x)
+    _inference_seconds.observe(time.perf_counter() - start)
+    _batch_size.observe(x.shape[0])
+    _predictions.inc(x.shape[0])
+    return indices, probs
+
+
+def _predict_normalized(x):
+    cache = prediction_cache
+    if cache is None:
+        probs = _backend.predict_probs(x)
+        return np.argmax(probs, axis=1), probs
+
+    keys = cache.keys(x)
+    found = cache.lookup(keys)
+    indices = np.empty(x.shape[0], dtype=np.int64)
+    probs = np.empty((x.shape[0], NUM_CLASSES), dtype=np.float32)
+    missing = [i for i, hit in enumerate(found) if hit is None]
+    for i, hit in enumerate(found):
+        if hit is not None:
+            indices[i], probs[i] = hit
+    if missing:
+        miss_probs = _backend.predict_probs(np.ascontiguousarray(x[missing]))
+        for j, i in enumerate(missing):
+            probs[i] = miss_probs[j]
+            indices[i] = int(np.argmax(miss_probs[j]))
+            cache.store(keys[i], indices[i], miss_probs[j])
+    return indices, probs
+
+
+def predict_batch(matrix):
+    """
+    Recibe una matriz (N, 11) de valores crudos en el orden de FEATURE_NAMES.
+    Devuelve (índices (N,), probabilidades (N, clases)).
+    """
+    check_model()
+    return predict_normalized(_matrix_to_batch(matrix))
+
+
+class MicroBatcher:
+    """
+    Agrupa lecturas de varios dispositivos y las puntúa con una sola invocación.
+    Cada lectura se envía como (rms_value, rms_avg, rms_std); el contexto de
+    clima lo pone el FeatureEncoder. Se invoca el modelo cuando hay
+    `max_items` lecturas o cuando la primera lleva `max_wait_ms` esperando.
+    Para cada lectura se llama callback(context, índice, probabilidades)
+    desde el hilo del batcher; si un callback falla se cuenta y se sigue con
+    el resto (una excepción no debe parar la inferencia).
+    La cola está acotada a `max_queue` lecturas: si el modelo no da abasto,
+    submit() descarta la lectura en lugar de acumular memoria sin límite.
+    """
+
+    def __init__(self, max_wait_ms=5.0, max_items=64, feature_encoder=None, max_queue=4096):
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_items = max_items
+        self.encoder = feature_encoder or encoder
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stats = np.zeros((3, max_items), dtype=np.float32)
+        self.batches = 0
+        self.items = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, rms_value, rms_avg, rms_std, callback, context=None):
+        """Encola una lectura; devuelve False si se descartó por cola llena."""
+        try:
+            self._queue.put_nowait((rms_value, rms_avg, rms_std, callback, context))
+        except queue.Full:
+            self.dropped += 1
+            _batcher_dropped.inc()
+            return False
+        return True
+
+    def _collect(self, first):
+        pending = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(pending) < self.max_items:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            pending.append(item)
+        return pending
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            pending = self._collect(first)
+            n = len(pending)
+            stats = self._stats[:, :n]
+            for i, item in enumerate(pending):
+                stats[0, i], stats[1, i], stats[2, i] = item[0], item[1], item[2]
+            try:
+                check_model()
+                x = self.encoder.encode_batch(stats[0], stats[1], stats[2])
+                indices, probs = predict_normalized(x)
+            except Exception as e:
+                _inference_errors.inc()
+                metrics.log("batcher_error", "[ERROR - MicroBatcher] {}", e)
+                continue
+            self.batches += 1
+            self.items += n
+            for item, idx, p in zip(pending, indices, probs):
+                try:
+                    item[3](item[4], int(idx), p)
+                except Exception as e:
+                    _inference_errors.inc()
+                    metrics.log("batcher_error", "[ERROR - MicroBatcher] callback: {}", e)
+
+    def stats(self):
+        """Lotes invocados, lecturas puntuadas, descartadas y tamaño medio de lote."""
+        avg = self.items / self.batches if self.batches else 0.0
+        return {"batches": self.batches, "items": self.items, "dropped": self.dropped,
+                "avg_batch_size": avg}
 
 
 # RMS Values
-from collections import deque
+# Misma ventana y semántica que dataset_generator.rolling_features
+# (pandas rolling, desviación muestral ddof=1), una ventana por dispositivo.
 RMS_WINDOW_SIZE = 10
-_rms_buffer = deque(maxlen=RMS_WINDOW_SIZE)
+_rms_stats = KeyedRollingStats(RMS_WINDOW_SIZE)
 
-def update_rms_and_get_stats(rms_value):
+def update_rms_and_get_stats(rms_value, device=None):
     """
-    Añade rms_value al buffer interno y devuelve (rms_avg, rms_std).
+    Añade rms_value a la ventana del dispositivo y devuelve (rms_avg, rms_std).
     """
     try:
         v = float(rms_value)
     except Exception:
         v = 0.0
-    _rms_buffer.append(v)
-    arr = list(_rms_buffer)
-    if not arr:
-        return float(v), 0.0
-    avg = sum(arr) / len(arr)
-    mean = avg
-    var = sum((x - mean) ** 2 for x in arr) / len(arr)
-    std = var ** 0.5
-    return float(avg), float(std)
+    return _rms_stats.update(device, v)
+
+
+def update_rms_batch(rms_values, device=None):
+    """
+    Igual que update_rms_and_get_stats para varias lecturas seguidas del
+    mismo dispositivo (p.ej. una trama binaria); devuelve (medias, desviaciones).
+    """
+    start = time.perf_counter()
+    result = rolling_mean_std(rms_values, RMS_WINDOW_SIZE, stats=_rms_stats.get(device))
+    _features_seconds.observe(time.perf_counter() - start)
+    return result
 
 
 # Mapeo de weather (status_weather es [day_string, weather_string])
@@ -142,12 +774,14 @@ def _weather_name_to_flags(name_string):
 
     return flags
 
-def build_feature_list(rms_value, status_weather):
+def build_feature_list(rms_value, status_weather, device=None):
     """
     Devuelve la lista de 11 floats en el orden de FEATURE_NAMES.
+    Las estadísticas móviles se llevan por dispositivo.
     """
+    start = time.perf_counter()
     # 1) stats a partir de RMS
-    rms_avg, rms_std = update_rms_and_get_stats(rms_value)
+    rms_avg, rms_std = update_rms_and_get_stats(rms_value, device)
 
     # 2) status_weather -> is_day + weather name
     try:
@@ -174,4 +808,5 @@ def build_feature_list(rms_value, status_weather):
         float(weather_flags['weather_parcialmente nublado']),
         float(weather_flags['weather_soleado'])
     ]
+    _features_seconds.observe(time.perf_counter() - start)
     return values
\ No newline at end of file
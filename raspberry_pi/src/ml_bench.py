@@ -0,0 +1,136 @@
+"""
+ml_bench.py
+Mide el rendimiento de inferencia de ml.py:
+  - la ruta de una fila (predict_sound_category) frente a predict_batch
+    con distintos tamaños de lote;
+  - el backend TFLite frente al backend NumPy: arranque en frío, memoria
+    (RSS máxima), latencia por predicción y concordancia de probabilidades.
+
+Uso:
+  python ml_bench.py --rows 5000
+  python ml_bench.py --backends
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import numpy as np
+import ml
+
+# Se ejecuta en un proceso nuevo para medir el coste real de importar ml
+_COLD_START_SCRIPT = """
+import json, resource, time
+t0 = time.perf_counter()
+import ml
+t1 = time.perf_counter()
+ml.predict_sound_category([3000, 1000, 500, 1, 0, 0, 0, 0, 0, 0, 1])
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_s": t1 - t0,
+    "first_prediction_ms": (t2 - t1) * 1000,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def random_features(n, seed=0):
+    """Genera N vectores crudos plausibles en el orden de ml.FEATURE_NAMES."""
+    # random de la stdlib: el secrets.py local tapa al módulo que usa numpy.random
+    rng = random.Random(seed)
+    x = np.zeros((n, len(ml.FEATURE_NAMES)), dtype=np.float32)
+    for row in x:
+        row[0] = rng.randint(1, 8572)
+        row[1] = rng.uniform(1.7, 5529.1)
+        row[2] = rng.uniform(0.0, 2428.4)
+        row[3] = rng.randint(0, 1)
+        row[4 + rng.randrange(7)] = 1.0
+    return x
+
+
+def bench_single(x):
+    t0 = time.perf_counter()
+    preds = [ml.predict_sound_category(row) for row in x.tolist()]
+    return time.perf_counter() - t0, np.array(preds)
+
+
+def bench_batch(x, batch_size):
+    t0 = time.perf_counter()
+    preds = []
+    for start in range(0, len(x), batch_size):
+        idx, _ = ml.predict_batch(x[start:start + batch_size])
+        preds.append(idx)
+    return time.perf_counter() - t0, np.concatenate(preds)
+
+
+def run_batch_report(rows):
+    x = random_features(rows)
+
+    # Calentamiento (asigna los intérpretes de cada tamaño de lote)
+    ml.predict_sound_category(x[0].tolist())
+    for b in ml.BATCH_SIZES:
+        ml.predict_batch(x[:b])
+
+    single_t, single_pred = bench_single(x)
+    single_rate = rows / single_t
+    print(f"Backend: {ml.ML_BACKEND}")
+    print(f"Fila a fila : {single_rate:10.0f} pred/s  ({single_t * 1e6 / rows:7.1f} µs/pred)")
+
+    for b in ml.BATCH_SIZES + (ml.BATCH_SIZES[-1] * 4,):
+        t, pred = bench_batch(x, b)
+        rate = rows / t
+        same = np.mean(pred == single_pred) * 100
+        print(f"Lote {b:5d}  : {rate:10.0f} pred/s  ({t * 1e6 / rows:7.1f} µs/pred)  "
+              f"x{rate / single_rate:5.1f}  coincidencia {same:.1f}%")
+
+
+def cold_start(backend):
+    env = dict(os.environ, SOUND_ML_BACKEND=backend)
+    out = subprocess.run(
+        [sys.executable, "-c", _COLD_START_SCRIPT],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run_backend_report(rows):
+    x = ml._matrix_to_batch(random_features(rows))
+    backends = [ml.TFLiteBackend(), ml.NumpyBackend()]
+
+    reference = backends[0].predict_probs(x)
+    for backend in backends:
+        start = cold_start(backend.name)
+        t0 = time.perf_counter()
+        for i in range(rows):
+            backend.predict_probs(x[i:i + 1])
+        single_us = (time.perf_counter() - t0) * 1e6 / rows
+        t0 = time.perf_counter()
+        probs = backend.predict_probs(x)
+        batch_us = (time.perf_counter() - t0) * 1e6 / rows
+        max_diff = float(np.max(np.abs(probs - reference)))
+        agree = float(np.mean(probs.argmax(axis=1) == reference.argmax(axis=1)) * 100)
+        print(f"[{backend.name:6s}] import {start['import_s']:6.2f} s | "
+              f"1ª pred {start['first_prediction_ms']:7.2f} ms | RSS {start['max_rss_mb']:7.1f} MB | "
+              f"{single_us:6.1f} µs/pred (fila) | {batch_us:6.2f} µs/pred (lote {rows}) | "
+              f"máx |Δp| {max_diff:.2e} | argmax igual {agree:.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de inferencia")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--backends", action="store_true",
+                        help="Comparar backend TFLite y NumPy")
+    args = parser.parse_args()
+
+    if args.backends:
+        run_backend_report(args.rows)
+    else:
+        run_batch_report(args.rows)
+
+
+if __name__ == "__main__":
+    main()
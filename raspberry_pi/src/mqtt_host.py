@@ -1,32 +1,381 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
 import paho.mqtt.client as mqtt
 import secrets
+import audio_stream
+import metrics
 
+# Broker al que conectarse (por defecto el de secrets.py); bench_e2e.py lo
+# apunta a su broker local
+BROKER = os.environ.get("MQTT_BROKER", secrets.BROKER)
+PORT = int(os.environ.get("MQTT_PORT", secrets.PORT))
+# Con SOUND_TRACE_COMMANDS=1 cada comando lleva el nº de secuencia de la
+# lectura que lo originó ("<comando>|<seq>") para medir la latencia de
+# extremo a extremo; el ESP32 no entiende este formato, solo es para pruebas
+TRACE_COMMANDS = os.environ.get("SOUND_TRACE_COMMANDS", "") == "1"
+
+# Ingesta multi-dispositivo
+# Cada ESP32 publica en "INMP441/<id_dispositivo>"; el tópico base "INMP441"
+# (sin sufijo) se trata como el dispositivo DEFAULT_DEVICE.
+DEFAULT_DEVICE = "default"
+DEVICE_BUFFER_SIZE = 256   # mensajes máximos en espera por dispositivo
+
+_ingest_cond = threading.Condition()
+_device_buffers = {}       # dispositivo -> deque[(recibido_en, array de rms, último seq)]
+_pending_devices = {}      # dispositivos con lecturas pendientes (orden de llegada)
+_device_stats = {}         # dispositivo -> contadores (ver _stats_for)
+_device_seq = {}           # dispositivo -> (última trama, última lectura) vistas
+
+# Tramas binarias (esp32/src/telemetry.py), little-endian:
+#   cabecera "RM", versión, nº de lecturas, nº de trama
+#   lectura  nº de secuencia, ticks_ms del ESP32, rms
+#            (+ v2: pico, nº de picos y overruns del intervalo)
+FRAME_MAGIC = b"RM"
+FRAME_HEADER = np.dtype([("magic", "S2"), ("version", "u1"), ("count", "u1"), ("frame_seq", "<u4")])
+FRAME_RECORDS = {
+    1: np.dtype([("seq", "<u4"), ("ts_ms", "<u4"), ("rms", "<u2")]),
+    2: np.dtype([("seq", "<u4"), ("ts_ms", "<u4"), ("rms", "<u2"),
+                 ("peak", "<u2"), ("peak_count", "<u2"), ("overruns", "<u2")]),
+}
+
+# Audio en bruto (audio_stream): el reensamblado y la FFT no se hacen en el
+# hilo de red de paho, que seguiría recibiendo tramas y confirmaciones
+# detrás de ese trabajo; on_message solo encola el trozo y un hilo lo procesa
+AUDIO_QUEUE_SIZE = 256     # trozos en espera (entre todos los dispositivos)
+_audio_queue = queue.Queue(maxsize=AUDIO_QUEUE_SIZE)
+
+# Publicación persistente
+# Se reutiliza el cliente de start_mqtt; los comandos se encolan y un hilo
+# los publica sin bloquear el bucle de inferencia.
+PUBLISH_QOS = 0
+PUBLISH_QUEUE_SIZE = 1024
+
+_client = None
+_publish_queue = queue.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+_publish_lock = threading.Lock()
+_in_flight = {}            # mid -> instante en que se encoló el comando
+_early_acks = set()        # mids confirmados antes de registrarse
+_publish_stats = {
+    "queued": 0, "published": 0, "acked": 0, "dropped": 0, "errors": 0,
+    "latency_total_ms": 0.0, "latency_max_ms": 0.0, "latency_last_ms": 0.0,
+}
+
+# Métricas (metrics.py)
+_receive_seconds = metrics.histogram(
+    "sound_mqtt_receive_seconds", "Decodificación y encolado de un mensaje de lecturas")
+_publish_seconds = metrics.histogram(
+    "sound_mqtt_publish_seconds", "Llamada a publish() de paho por comando")
+_messages = metrics.counter("sound_mqtt_messages_total", "Mensajes de lecturas recibidos")
+_readings = metrics.counter("sound_mqtt_readings_total", "Lecturas recibidas")
+_decode_errors = metrics.counter("sound_mqtt_decode_errors_total", "Mensajes que no se pudieron decodificar")
+_readings_dropped = metrics.counter(
+    "sound_mqtt_readings_dropped_total", "Lecturas descartadas por buffer de dispositivo lleno")
+_audio_chunks = metrics.counter("sound_mqtt_audio_chunks_total", "Trozos de audio recibidos")
+_audio_dropped = metrics.counter(
+    "sound_mqtt_audio_chunks_dropped_total", "Trozos de audio descartados con la cola llena")
+
+
+def device_from_topic(topic, base=None):
+    """Extrae el id del dispositivo del sufijo del tópico."""
+    base = base or secrets.TOPIC_MIC
+    if topic == base:
+        return DEFAULT_DEVICE
+    if topic.startswith(base + "/"):
+        return topic[len(base) + 1:] or DEFAULT_DEVICE
+    return topic
+
+
+def device_topic(base, device):
+    """Tópico de un dispositivo concreto (el dispositivo por defecto usa el tópico base)."""
+    if device is None or device == DEFAULT_DEVICE:
+        return base
+    return f"{base}/{device}"
+
+
+def _stats_for(device):
+    stats = _device_stats.get(device)
+    if stats is None:
+        stats = {
+            "received": 0, "dropped": 0, "errors": 0,
+            "frames": 0, "frames_lost": 0, "readings_lost": 0, "resets": 0,
+            "peak_max": 0, "peak_count": 0, "overruns": 0,
+        }
+        _device_stats[device] = stats
+    return stats
+
+
+def decode_frame(payload):
+    """
+    Decodifica una trama binaria sin copiar: devuelve (nº de trama, lecturas),
+    donde lecturas es un array estructurado (FRAME_RECORDS según la versión)
+    que apunta al propio payload. Lanza ValueError si la trama no es válida.
+    """
+    if len(payload) < FRAME_HEADER.itemsize:
+        raise ValueError("Trama demasiado corta")
+    header = np.frombuffer(payload, dtype=FRAME_HEADER, count=1)[0]
+    record = FRAME_RECORDS.get(int(header["version"]))
+    if record is None:
+        raise ValueError(f"Versión de trama no soportada: {header['version']}")
+    count = int(header["count"])
+    if len(payload) != FRAME_HEADER.itemsize + count * record.itemsize:
+        raise ValueError("Longitud de trama incorrecta")
+    records = np.frombuffer(payload, dtype=record, count=count, offset=FRAME_HEADER.itemsize)
+    return int(header["frame_seq"]), records
+
+
+def _track_sequence(device, stats, frame_seq, records):
+    """Cuenta tramas y lecturas perdidas a partir de los huecos de secuencia."""
+    last = _device_seq.get(device)
+    first_seq = int(records["seq"][0]) if len(records) else None
+    if last is not None:
+        last_frame, last_seq = last
+        if frame_seq <= last_frame:
+            # El contador volvió atrás: el ESP32 se reinició
+            stats["resets"] += 1
+        else:
+            stats["frames_lost"] += frame_seq - last_frame - 1
+            if first_seq is not None and last_seq is not None and first_seq > last_seq:
+                stats["readings_lost"] += first_seq - last_seq - 1
+    last_seq = int(records["seq"][-1]) if len(records) else (last[1] if last else None)
+    _device_seq[device] = (frame_seq, last_seq)
+    stats["frames"] += 1
+    if "peak" in records.dtype.names and len(records):
+        # Agregados de la captura continua del ESP32
+        stats["peak_max"] = max(stats["peak_max"], int(records["peak"].max()))
+        stats["peak_count"] += int(records["peak_count"].sum())
+        stats["overruns"] += int(records["overruns"].sum())
 
-latest_message = None
 
 def on_message(client, userdata, msg):
-    global latest_message
-    message = msg.payload.decode()
-    print(f"Mensaje recibido en {msg.topic}: {message}")
-    latest_message = message
+    start = time.perf_counter()
+    if msg.topic == secrets.TOPIC_AUDIO or msg.topic.startswith(secrets.TOPIC_AUDIO + "/"):
+        # Audio en bruto: se procesa en _audio_loop (audio_stream)
+        _audio_chunks.inc()
+        try:
+            _audio_queue.put_nowait((device_from_topic(msg.topic, secrets.TOPIC_AUDIO), msg.payload))
+        except queue.Full:
+            _audio_dropped.inc()
+        return
+
+    device = device_from_topic(msg.topic)
+    payload = msg.payload
+
+    with _ingest_cond:
+        stats = _stats_for(device)
+        try:
+            if payload[:2] == FRAME_MAGIC:
+                frame_seq, records = decode_frame(payload)
+                _track_sequence(device, stats, frame_seq, records)
+                values = records["rms"].astype(np.float64)
+                last_seq = int(records["seq"][-1]) if len(records) else None
+            else:
+                # Formato de texto original: un rms por mensaje
+                values = np.array([float(payload.decode())])
+                last_seq = None
+        except (ValueError, UnicodeDecodeError):
+            stats["errors"] += 1
+            _decode_errors.inc()
+            return
+        if not len(values):
+            return
+
+        buf = _device_buffers.get(device)
+        if buf is None:
+            buf = deque(maxlen=DEVICE_BUFFER_SIZE)
+            _device_buffers[device] = buf
+        if len(buf) == buf.maxlen:
+            # El deque descarta el mensaje más antiguo
+            stats["dropped"] += len(buf[0][1])
+            _readings_dropped.inc(len(buf[0][1]))
+        buf.append((time.time(), values, last_seq))
+        stats["received"] += len(values)
+        _pending_devices[device] = None
+        _ingest_cond.notify()
+
+    _messages.inc()
+    _readings.inc(len(values))
+    _receive_seconds.observe(time.perf_counter() - start)
+    metrics.log("rx", "Mensaje recibido en {}: {} lectura(s)", msg.topic, len(values))
+
+
+def get_readings(timeout=None):
+    """
+    Devuelve todos los mensajes pendientes como lista de
+    (dispositivo, recibido_en, array de rms, seq de la última lectura),
+    vaciando los buffers; cada trama binaria llega como un único array con
+    todas sus lecturas (los mensajes de texto no tienen seq: None).
+    Espera hasta `timeout` segundos si no hay ninguna (None = sin límite).
+    """
+    with _ingest_cond:
+        if not _pending_devices:
+            _ingest_cond.wait(timeout)
+        readings = []
+        for device in _pending_devices:
+            buf = _device_buffers[device]
+            readings.extend((device, ts, values, seq) for ts, values, seq in buf)
+            buf.clear()
+        _pending_devices.clear()
+    return readings
+
+
+def get_device_stats():
+    """
+    Copia de los contadores por dispositivo: lecturas recibidas/descartadas,
+    errores de decodificación, tramas, tramas y lecturas perdidas, reinicios
+    y, con tramas v2, pico máximo, muestras sobre el umbral y overruns del ESP32.
+    """
+    with _ingest_cond:
+        return {device: dict(stats) for device, stats in _device_stats.items()}
+
+
+def _record_ack(enqueued_at):
+    latency_ms = (time.monotonic() - enqueued_at) * 1000.0
+    _publish_stats["acked"] += 1
+    _publish_stats["latency_total_ms"] += latency_ms
+    _publish_stats["latency_last_ms"] = latency_ms
+    if latency_ms > _publish_stats["latency_max_ms"]:
+        _publish_stats["latency_max_ms"] = latency_ms
+
+
+def on_publish(client, userdata, mid):
+    with _publish_lock:
+        enqueued_at = _in_flight.pop(mid, None)
+        if enqueued_at is None:
+            # paho puede confirmar antes de que publish() devuelva el mid
+            _early_acks.add(mid)
+            return
+        _record_ack(enqueued_at)
+
+
+def _audio_loop():
+    """Reensamblado y características espectrales de los trozos de audio encolados."""
+    while True:
+        device, payload = _audio_queue.get()
+        try:
+            audio_stream.ingest.on_chunk(device, payload)
+        except Exception as e:
+            metrics.log("audio_error", "[ERROR - Audio] {}: {}", device, e)
+
+
+def _publisher_loop():
+    while True:
+        topic, message, qos, enqueued_at = _publish_queue.get()
+        try:
+            # publish() no debe llamarse con _publish_lock tomado: el hilo de
+            # red de paho invoca on_publish con sus propios mutex adquiridos.
+            start = time.perf_counter()
+            info = _client.publish(topic, message, qos=qos)
+            _publish_seconds.observe(time.perf_counter() - start)
+            with _publish_lock:
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    _publish_stats["errors"] += 1
+                    continue
+                _publish_stats["published"] += 1
+                if info.mid in _early_acks:
+                    _early_acks.discard(info.mid)
+                    _record_ack(enqueued_at)
+                else:
+                    _in_flight[info.mid] = enqueued_at
+            metrics.log("tx", "Publicado en {}: {}", topic, message)
+        except Exception as e:
+            _publish_stats["errors"] += 1
+            metrics.log("tx_error", "[ERROR - MQTT publish] {}", e)
+
 
 def start_mqtt():
+    global _client
     client = mqtt.Client()
     client.on_message = on_message
-    client.connect(secrets.BROKER, secrets.PORT, 60)
-    client.subscribe(secrets.TOPIC_MIC)
+    client.on_publish = on_publish
+    client.connect(BROKER, PORT, 60)
+    client.subscribe([
+        (secrets.TOPIC_MIC, 0), (secrets.TOPIC_MIC + "/+", 0),
+        (secrets.TOPIC_AUDIO, 0), (secrets.TOPIC_AUDIO + "/+", 0),
+    ])
 
     client.loop_start()
+
+    _client = client
+    threading.Thread(target=_publisher_loop, daemon=True).start()
+    threading.Thread(target=_audio_loop, daemon=True).start()
     return client
 
-def get_latest_message():
-    global latest_message
-    return latest_message
 
+def publish_to_esp32(message, device=None, qos=None, seq=None):
+    """
+    Encola un comando para el ESP32 y retorna de inmediato.
+    Devuelve False si la cola está llena y el comando se descartó.
+    seq (lectura que originó el comando) solo se envía con TRACE_COMMANDS.
+    """
+    if _client is None:
+        raise RuntimeError("MQTT no iniciado: llama a start_mqtt() antes de publicar.")
+    topic = device_topic(secrets.TOPIC_LED, device)
+    if qos is None:
+        qos = PUBLISH_QOS
+    if TRACE_COMMANDS and seq is not None:
+        message = f"{message}|{seq}"
+    try:
+        _publish_queue.put_nowait((topic, message, qos, time.monotonic()))
+    except queue.Full:
+        with _publish_lock:
+            _publish_stats["dropped"] += 1
+        return False
+    with _publish_lock:
+        _publish_stats["queued"] += 1
+    return True
 
-def publish_to_esp32(message):
-    client = mqtt.Client()
-    client.connect(secrets.BROKER, secrets.PORT, 60)
-    client.publish(secrets.TOPIC_LED, message)
-    client.disconnect()
-    print(f"Publicado en {secrets.TOPIC_LED}: {message}")
+
+def publish_context(is_day, column):
+    """
+    Publica el contexto de clima para la inferencia local del ESP32
+    (esp32/src/tinyml.py) como mensaje retenido "is_day,columna", donde
+    columna es el índice de la característica de clima o -1 si no hay.
+    Al ser retenido, un nodo que se reconecta lo recibe de inmediato.
+    """
+    if _client is None:
+        raise RuntimeError("MQTT no iniciado: llama a start_mqtt() antes de publicar.")
+    payload = f"{1 if is_day else 0},{-1 if column is None else column}"
+    _client.publish(secrets.TOPIC_CONTEXT, payload, qos=1, retain=True)
+
+
+def get_publish_stats():
+    """
+    Estadísticas del publicador: comandos encolados, publicados, confirmados,
+    en vuelo, descartados y latencia encolado -> confirmación (ms).
+    """
+    with _publish_lock:
+        stats = dict(_publish_stats)
+        stats["in_flight"] = len(_in_flight)
+    stats["queue_depth"] = _publish_queue.qsize()
+    acked = stats["acked"]
+    stats["latency_avg_ms"] = stats.pop("latency_total_ms") / acked if acked else 0.0
+    return stats
+
+
+def _device_stat(key):
+    return lambda: {device: stats[key] for device, stats in get_device_stats().items()}
+
+
+def _publish_stat(key):
+    return lambda: get_publish_stats()[key]
+
+
+for _key, _help in (("queued", "Comandos encolados"), ("published", "Comandos publicados"),
+                    ("acked", "Comandos confirmados por el broker"),
+                    ("dropped", "Comandos descartados con la cola llena"),
+                    ("errors", "Errores al publicar comandos")):
+    metrics.register_func(f"sound_commands_{_key}_total", _help, _publish_stat(_key), "counter")
+metrics.register_func("sound_commands_queue_depth", "Comandos esperando en la cola de publicación",
+                      _publish_stat("queue_depth"))
+metrics.register_func("sound_commands_in_flight", "Comandos publicados sin confirmar",
+                      _publish_stat("in_flight"))
+metrics.register_func("sound_mqtt_audio_queue_depth", "Trozos de audio esperando a procesarse",
+                      _audio_queue.qsize)
+for _key, _help in (("received", "Lecturas recibidas"), ("frames_lost", "Tramas perdidas"),
+                    ("readings_lost", "Lecturas perdidas (huecos de secuencia)"),
+                    ("resets", "Reinicios detectados del ESP32"), ("overruns", "Overruns de captura del ESP32")):
+    metrics.register_func(f"sound_device_{_key}_total", f"{_help} por dispositivo", _device_stat(_key), "counter")
@@ -0,0 +1,259 @@
+"""
+rolling.py
+Estadísticas móviles en streaming (media y desviación estándar) con coste
+O(1) por muestra, compartidas por el generador de datasets
+(data/datasets/dataset_generator.py) y el runtime de la Raspberry (ml.py).
+
+Reproduce exactamente la semántica de pandas (roll_mean / roll_var)
+    serie.rolling(window, min_periods=1).mean()
+    serie.rolling(window, min_periods=1).std().fillna(0.0)
+(desviación muestral, ddof=1), usando las mismas fórmulas incrementales
+(suma compensada de Kahan para la media, Welford con altas y bajas para la
+varianza y recálculo de la ventana si hay cancelación catastrófica), así que
+el dataset de entrenamiento y las características en línea coinciden valor
+a valor.
+
+window_mean_std es la variante vectorizada (NumPy) para puntuar grabaciones
+enteras offline (data/models/batch_score.py).
+"""
+
+import math
+from collections import deque
+import numpy as np
+
+
+# Tolerancia de pandas para detectar cancelación catastrófica en la varianza
+_EPS_F64 = 2.220446049250313e-16
+_INV_COND_TOL = _EPS_F64 * 1e3
+
+
+class RollingStats:
+    """Ventana móvil de tamaño fijo para un único flujo de valores."""
+
+    __slots__ = (
+        "window", "ddof", "_values",
+        "_nobs", "_sum", "_sum_comp_add", "_sum_comp_remove", "_neg_ct",
+        "_same_count", "_prev_value",
+        "_var_nobs", "_mean", "_ssqdm", "_var_comp_add", "_var_comp_remove",
+        "_unstable",
+    )
+
+    def __init__(self, window, ddof=1):
+        if window < 1:
+            raise ValueError("La ventana debe tener al menos 1 elemento.")
+        self.window = window
+        self.ddof = ddof
+        self._values = deque()
+        self.reset()
+
+    def reset(self):
+        self._values.clear()
+        # Media (roll_mean de pandas)
+        self._nobs = 0
+        self._sum = 0.0
+        self._sum_comp_add = 0.0
+        self._sum_comp_remove = 0.0
+        self._neg_ct = 0
+        self._same_count = 0
+        self._prev_value = math.nan
+        # Varianza (roll_var de pandas)
+        self._reset_var()
+
+    def _reset_var(self):
+        self._var_nobs = 0.0
+        self._mean = 0.0
+        self._ssqdm = 0.0
+        self._var_comp_add = 0.0
+        self._var_comp_remove = 0.0
+        self._unstable = False
+
+    # --- media: suma compensada (Kahan), como add_mean/remove_mean ---
+
+    def _add_mean(self, val):
+        self._nobs += 1
+        y = val - self._sum_comp_add
+        t = self._sum + y
+        self._sum_comp_add = t - self._sum - y
+        self._sum = t
+        if math.copysign(1.0, val) < 0:
+            self._neg_ct += 1
+        # Racha de valores iguales: pandas devuelve el valor exacto
+        if val == self._prev_value:
+            self._same_count += 1
+        else:
+            self._same_count = 1
+        self._prev_value = val
+
+    def _remove_mean(self, val):
+        self._nobs -= 1
+        y = -val - self._sum_comp_remove
+        t = self._sum + y
+        self._sum_comp_remove = t - self._sum - y
+        self._sum = t
+        if math.copysign(1.0, val) < 0:
+            self._neg_ct -= 1
+
+    # --- varianza: Welford con Kahan, como add_var/remove_var ---
+
+    def _add_var(self, val):
+        prev_m2 = self._ssqdm
+        self._var_nobs += 1
+        prev_mean = self._mean - self._var_comp_add
+        y = val - self._var_comp_add
+        t = y - self._mean
+        self._var_comp_add = t + self._mean - y
+        self._mean += t / self._var_nobs
+        self._ssqdm += (val - prev_mean) * (val - self._mean)
+        if prev_m2 * _INV_COND_TOL > self._ssqdm:
+            self._unstable = True
+
+    def _remove_var(self, val):
+        prev_m2 = self._ssqdm
+        self._var_nobs -= 1
+        if self._var_nobs:
+            prev_mean = self._mean - self._var_comp_remove
+            y = val - self._var_comp_remove
+            t = y - self._mean
+            self._var_comp_remove = t + self._mean - y
+            self._mean -= t / self._var_nobs
+            self._ssqdm -= (val - prev_mean) * (val - self._mean)
+            if prev_m2 * _INV_COND_TOL > self._ssqdm:
+                self._unstable = True
+        else:
+            self._mean = 0.0
+            self._ssqdm = 0.0
+            self._unstable = False
+
+    def push(self, value):
+        """Añade un valor (y expulsa el más antiguo si la ventana está llena)."""
+        val = float(value)
+        # Los NaN ocupan posición en la ventana pero no cuentan (como en pandas)
+        self._values.append(val)
+        if len(self._values) > self.window:
+            old = self._values.popleft()
+            if old == old:
+                self._remove_mean(old)
+                self._remove_var(old)
+        if val == val:
+            self._add_mean(val)
+            self._add_var(val)
+        if self._unstable:
+            # Posible cancelación catastrófica: pandas recalcula la ventana entera
+            self._reset_var()
+            for v in self._values:
+                if v == v:
+                    self._add_var(v)
+            self._unstable = False
+
+    def mean(self):
+        nobs = self._nobs
+        if nobs == 0:
+            return math.nan
+        if self._same_count >= nobs:
+            return self._prev_value
+        result = self._sum / nobs
+        if self._neg_ct == 0 and result < 0:
+            return 0.0
+        if self._neg_ct == nobs and result > 0:
+            return 0.0
+        return result
+
+    def var(self):
+        """Varianza (ddof); 0.0 donde pandas daría NaN por falta de muestras."""
+        nobs = self._var_nobs
+        if nobs < 1 or nobs <= self.ddof:
+            return 0.0
+        return self._ssqdm / (nobs - self.ddof)
+
+    def std(self):
+        var = self.var()
+        return math.sqrt(var) if var > 0 else 0.0
+
+    def update(self, value):
+        """push() + (media, desviación) en una sola llamada."""
+        self.push(value)
+        return self.mean(), self.std()
+
+    def __len__(self):
+        return len(self._values)
+
+
+class KeyedRollingStats:
+    """Una RollingStats por clave (p.ej. una por dispositivo)."""
+
+    def __init__(self, window, ddof=1):
+        self.window = window
+        self.ddof = ddof
+        self._windows = {}
+
+    def get(self, key):
+        stats = self._windows.get(key)
+        if stats is None:
+            stats = RollingStats(self.window, self.ddof)
+            self._windows[key] = stats
+        return stats
+
+    def update(self, key, value):
+        """Añade value a la ventana de key y devuelve (media, desviación)."""
+        return self.get(key).update(value)
+
+    def discard(self, key):
+        self._windows.pop(key, None)
+
+    def keys(self):
+        return self._windows.keys()
+
+    def __len__(self):
+        return len(self._windows)
+
+
+def rolling_mean_std(values, window, ddof=1, stats=None):
+    """
+    Aplica la ventana móvil a una secuencia y devuelve dos listas (media, std).
+    Si se pasa `stats`, continúa desde su estado (útil para procesar por trozos).
+    """
+    if stats is None:
+        stats = RollingStats(window, ddof)
+    means = []
+    stds = []
+    for v in values:
+        m, s = stats.update(v)
+        means.append(m)
+        stds.append(s)
+    return means, stds
+
+
+def window_mean_std(values, window, ddof=1, history=None):
+    """
+    Igual que rolling_mean_std pero vectorizado: calcula cada ventana
+    directamente (suma y desviaciones respecto a su media) sobre una vista
+    (N, window) sin copiar los datos. history son los últimos valores del
+    flujo (hasta window - 1) del trozo anterior; devuelve arrays
+    (media, std, history para el siguiente trozo).
+
+    No admite NaN. Con rms enteros la media es idéntica a la de pandas; la
+    desviación difiere solo por el redondeo que acumula el cálculo
+    incremental (~1e-6 relativo en flujos largos).
+    """
+    x = np.asarray(values, dtype=np.float64)
+    prev = np.zeros(0) if history is None or window == 1 else np.asarray(history, dtype=np.float64)
+    prev = prev[len(prev) - min(len(prev), window - 1):]
+    pad = window - 1 - len(prev)
+    y = np.concatenate([np.zeros(pad), prev, x])
+    n = len(x)
+    counts = np.minimum(np.arange(len(prev) + 1, len(prev) + n + 1), window)
+
+    windows = np.lib.stride_tricks.sliding_window_view(y, window)
+    means = windows.sum(axis=1) / counts
+    dev = windows - means[:, None]
+    partial = min(n, pad)
+    if partial > 0:
+        # Al principio del flujo las ventanas están incompletas: el relleno no cuenta
+        dev[:partial] *= np.arange(window) >= (window - counts[:partial, None])
+    ssq = np.einsum("ij,ij->i", dev, dev)
+    var = np.where(counts > ddof, ssq / np.maximum(counts - ddof, 1), 0.0)
+    stds = np.sqrt(np.maximum(var, 0.0))
+
+    real = y[pad:]
+    history = real[len(real) - min(len(real), window - 1):] if window > 1 else real[:0]
+    return means, stds, history.copy()
@@ -5,4 +5,6 @@ BROKER    = "192.168.183.47"   # IP del broker (Raspberry)
 CLIENT_ID = b"esp32"
 TOPIC_MIC = "INMP441"
 TOPIC_LED = "LED"
+TOPIC_CONTEXT = "CONTEXT"  # contexto de clima retenido para el ESP32
+TOPIC_AUDIO = "AUDIO"      # audio PCM16 en trozos (audio_stream.py)
 PORT = 1883 # Puerto MQTT estándar
\ No newline at end of file
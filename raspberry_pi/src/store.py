@@ -0,0 +1,381 @@
+"""
+store.py
+Almacén columnar de solo-añadir para lecturas y predicciones de la Raspberry.
+
+Cada fila es (dispositivo, instante, rms, vector de características crudo,
+clase predicha, probabilidades). Los datos se guardan en segmentos de
+SEGMENT_ROWS filas; cada columna de un segmento es un .npy preasignado y
+abierto con memmap, así que añadir filas es escribir en memoria (el sistema
+operativo se encarga de llevarlo a disco) y no hay texto en el camino caliente.
+
+  <dir>/index.json            esquema, dispositivos (nombre -> id) y, por
+                              segmento, filas, rango de tiempo y dispositivos
+  <dir>/seg_000000/<col>.npy  una columna por archivo
+
+index.json se reescribe al abrir y al cerrar un segmento, al dar de alta un
+dispositivo y en flush(); al reabrir, las filas escritas después del último
+flush se recuperan buscando la última fila con instante distinto de cero.
+
+El almacén está desactivado por defecto: SOUND_STORE_DIR=<dir> lo activa.
+Con SOUND_STORE_MAX_MB (por defecto 512) se borran los segmentos más
+antiguos cuando el total supera ese tamaño (0 = sin límite), para no llenar
+la tarjeta SD de la Raspberry.
+
+Consultas: query() por dispositivo y rango de tiempo (los segmentos fuera del
+rango ni se abren), aggregate() para agregados por cubetas de tiempo y
+export_data_csv() para generar un data.csv (con columna device) que consume
+dataset_generator.py.
+"""
+
+import csv
+import json
+import os
+import shutil
+import threading
+import numpy as np
+
+SEGMENT_ROWS = 65536
+INDEX_FILE = "index.json"
+MAX_DEVICES = np.iinfo(np.uint16).max + 1     # ids de dispositivo en uint16
+# Vacío = sin historial; p.ej. SOUND_STORE_DIR=../store
+STORE_DIR = os.environ.get("SOUND_STORE_DIR", "")
+STORE_MAX_MB = float(os.environ.get("SOUND_STORE_MAX_MB", "512"))
+
+
+def _columns(num_features, num_classes):
+    """Columna -> (dtype, forma por fila)."""
+    return {
+        "device": (np.uint16, ()),
+        "ts": (np.float64, ()),
+        "rms": (np.float32, ()),
+        "features": (np.float32, (num_features,)),
+        "pred": (np.int8, ()),
+        "probs": (np.float32, (num_classes,)),
+    }
+
+
+class _Segment:
+    def __init__(self, path, columns, rows, mode):
+        self.path = path
+        self.rows = rows
+        self.data = {}
+        for name, (dtype, shape) in columns.items():
+            file = os.path.join(path, f"{name}.npy")
+            if mode == "w+":
+                self.data[name] = np.lib.format.open_memmap(
+                    file, mode="w+", dtype=dtype, shape=(SEGMENT_ROWS,) + shape)
+            else:
+                self.data[name] = np.load(file, mmap_mode=mode)
+
+    def flush(self):
+        for arr in self.data.values():
+            if isinstance(arr, np.memmap):
+                arr.flush()
+
+
+class TimeSeriesStore:
+    def __init__(self, path=STORE_DIR, feature_names=None, class_names=None,
+                 max_bytes=STORE_MAX_MB * 1024 * 1024):
+        if not path:
+            raise ValueError("El almacén necesita un directorio (SOUND_STORE_DIR)")
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                self._index = json.load(f)
+        else:
+            if feature_names is None or class_names is None:
+                raise ValueError("Un almacén nuevo necesita feature_names y class_names")
+            self._index = {
+                "version": 1,
+                "segment_rows": SEGMENT_ROWS,
+                "feature_names": list(feature_names),
+                "class_names": list(class_names),
+                "devices": {},
+                "segments": [],
+            }
+        self.feature_names = self._index["feature_names"]
+        self.class_names = self._index["class_names"]
+        self.columns = _columns(len(self.feature_names), len(self.class_names))
+        # Todas las columnas se preasignan: el tamaño de un segmento es fijo
+        self.segment_bytes = SEGMENT_ROWS * sum(
+            np.dtype(dtype).itemsize * int(np.prod(shape)) for dtype, shape in self.columns.values())
+        self._device_ids = dict(self._index["devices"])
+        self._device_names = {v: k for k, v in self._device_ids.items()}
+        self._active = None
+        self._readers = {}
+        self._open_last_segment()
+
+    # --- escritura ---
+
+    def _segment_path(self, seg_id):
+        return os.path.join(self.path, f"seg_{seg_id:06d}")
+
+    def _open_last_segment(self):
+        segments = self._index["segments"]
+        if not segments or segments[-1]["rows"] >= SEGMENT_ROWS:
+            return
+        meta = segments[-1]
+        seg = _Segment(self._segment_path(meta["id"]), self.columns, meta["rows"], "r+")
+        # Filas añadidas después del último flush del índice
+        ts = seg.data["ts"]
+        written = np.flatnonzero(ts[meta["rows"]:] != 0)
+        if len(written):
+            seg.rows = meta["rows"] + int(written[-1]) + 1
+            self._update_meta(meta, seg, meta["rows"], seg.rows)
+        self._active = (meta, seg)
+
+    def _new_segment(self):
+        seg_id = self._index["segments"][-1]["id"] + 1 if self._index["segments"] else 0
+        path = self._segment_path(seg_id)
+        os.makedirs(path, exist_ok=True)
+        seg = _Segment(path, self.columns, 0, "w+")
+        meta = {"id": seg_id, "rows": 0, "t_min": None, "t_max": None, "devices": []}
+        self._index["segments"].append(meta)
+        self._active = (meta, seg)
+        self._enforce_retention()
+        # Sin esto, tras una caída el siguiente arranque no vería el segmento
+        # y lo volvería a crear encima
+        self._write_index()
+        return meta, seg
+
+    def _enforce_retention(self):
+        """Borra los segmentos más antiguos mientras el total supere max_bytes."""
+        if not self.max_bytes:
+            return
+        segments = self._index["segments"]
+        while len(segments) > 1 and len(segments) * self.segment_bytes > self.max_bytes:
+            meta = segments.pop(0)
+            self._readers.pop(meta["id"], None)
+            shutil.rmtree(self._segment_path(meta["id"]), ignore_errors=True)
+
+    def _device_id(self, device):
+        device_id = self._device_ids.get(device)
+        if device_id is None:
+            device_id = len(self._device_ids)
+            if device_id >= MAX_DEVICES:
+                raise ValueError(f"El almacén admite como máximo {MAX_DEVICES} dispositivos")
+            self._device_ids[device] = device_id
+            self._device_names[device_id] = device
+            self._index["devices"][device] = device_id
+            # Un id no guardado se volvería a asignar a otro dispositivo tras una caída
+            self._write_index()
+        return device_id
+
+    def _update_meta(self, meta, seg, start, stop):
+        ts = seg.data["ts"][start:stop]
+        t_min, t_max = float(ts.min()), float(ts.max())
+        meta["t_min"] = t_min if meta["t_min"] is None else min(meta["t_min"], t_min)
+        meta["t_max"] = t_max if meta["t_max"] is None else max(meta["t_max"], t_max)
+        devices = set(meta["devices"])
+        devices.update(int(d) for d in np.unique(seg.data["device"][start:stop]))
+        meta["devices"] = sorted(devices)
+        meta["rows"] = stop
+
+    def append_batch(self, devices, ts, rms, features, preds, probs):
+        """
+        Añade N filas. devices puede ser un nombre (todas las filas del mismo
+        dispositivo) o una secuencia de nombres.
+        """
+        ts = np.asarray(ts, dtype=np.float64).reshape(-1)
+        n = len(ts)
+        if n == 0:
+            return
+        with self._lock:
+            if isinstance(devices, str):
+                device_ids = np.full(n, self._device_id(devices), dtype=np.uint16)
+            else:
+                device_ids = np.array([self._device_id(d) for d in devices], dtype=np.uint16)
+            values = {
+                "device": device_ids,
+                "ts": ts,
+                "rms": np.asarray(rms, dtype=np.float32).reshape(n),
+                "features": np.asarray(features, dtype=np.float32).reshape(n, -1),
+                "pred": np.asarray(preds, dtype=np.int8).reshape(n),
+                "probs": np.asarray(probs, dtype=np.float32).reshape(n, -1),
+            }
+            done = 0
+            while done < n:
+                meta, seg = self._writable_segment()
+                start = seg.rows
+                take = min(n - done, SEGMENT_ROWS - start)
+                for name, arr in values.items():
+                    seg.data[name][start:start + take] = arr[done:done + take]
+                seg.rows = start + take
+                self._update_meta(meta, seg, start, seg.rows)
+                done += take
+
+    def append(self, device, ts, rms, features, pred, probs):
+        """Añade una fila (camino rápido de append_batch para una sola lectura)."""
+        ts = float(ts)
+        with self._lock:
+            device_id = self._device_id(device)
+            meta, seg = self._writable_segment()
+            i = seg.rows
+            data = seg.data
+            data["device"][i] = device_id
+            data["ts"][i] = ts
+            data["rms"][i] = rms
+            data["features"][i] = features
+            data["pred"][i] = pred
+            data["probs"][i] = probs
+            seg.rows = meta["rows"] = i + 1
+            if meta["t_min"] is None or ts < meta["t_min"]:
+                meta["t_min"] = ts
+            if meta["t_max"] is None or ts > meta["t_max"]:
+                meta["t_max"] = ts
+            if device_id not in meta["devices"]:
+                meta["devices"] = sorted(meta["devices"] + [device_id])
+
+    def _writable_segment(self):
+        if self._active is None or self._active[1].rows >= SEGMENT_ROWS:
+            self._seal()
+            self._new_segment()
+        return self._active
+
+    def _seal(self):
+        if self._active is not None:
+            self._active[1].flush()
+            self._active = None
+            self._write_index()
+
+    def _write_index(self):
+        tmp = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+    def flush(self):
+        """Lleva el segmento activo a disco y guarda el índice."""
+        with self._lock:
+            if self._active is not None:
+                self._active[1].flush()
+            self._write_index()
+
+    def close(self):
+        self.flush()
+
+    # --- lectura ---
+
+    def devices(self):
+        return list(self._device_ids)
+
+    def _segment_data(self, meta):
+        if self._active is not None and self._active[0] is meta:
+            return self._active[1].data
+        reader = self._readers.get(meta["id"])
+        if reader is None:
+            reader = _Segment(self._segment_path(meta["id"]), self.columns, meta["rows"], "r")
+            if meta["rows"] >= SEGMENT_ROWS:
+                # Solo los segmentos cerrados no cambian
+                self._readers[meta["id"]] = reader
+        return reader.data
+
+    def query(self, device=None, start=None, end=None, columns=None):
+        """
+        Filas de un dispositivo (None = todos) con start <= ts < end, como
+        dict columna -> array (copias, en orden de inserción).
+        """
+        columns = list(columns or self.columns)
+        parts = {name: [] for name in columns}
+        with self._lock:
+            device_id = None
+            if device is not None:
+                device_id = self._device_ids.get(device)
+                if device_id is None:
+                    return self._empty(columns)
+            for meta in self._index["segments"]:
+                rows = meta["rows"]
+                if not rows:
+                    continue
+                if start is not None and meta["t_max"] < start:
+                    continue
+                if end is not None and meta["t_min"] >= end:
+                    continue
+                if device_id is not None and device_id not in meta["devices"]:
+                    continue
+                data = self._segment_data(meta)
+                mask = np.ones(rows, dtype=bool)
+                ts = data["ts"][:rows]
+                if start is not None:
+                    mask &= ts >= start
+                if end is not None:
+                    mask &= ts < end
+                if device_id is not None:
+                    mask &= data["device"][:rows] == device_id
+                for name in columns:
+                    parts[name].append(np.asarray(data[name][:rows][mask]))
+        if not parts[columns[0]]:
+            return self._empty(columns)
+        return {name: np.concatenate(chunks) for name, chunks in parts.items()}
+
+    def _empty(self, columns):
+        return {name: np.empty((0,) + self.columns[name][1], dtype=self.columns[name][0])
+                for name in columns}
+
+    def device_names(self, device_ids):
+        return [self._device_names[int(d)] for d in device_ids]
+
+    def aggregate(self, device=None, start=None, end=None, bucket_s=60.0):
+        """
+        Agregados por cubetas de bucket_s segundos: inicio de la cubeta, nº de
+        filas, rms medio y máximo, y nº de predicciones de cada clase.
+        """
+        rows = self.query(device, start, end, columns=["ts", "rms", "pred"])
+        ts = rows["ts"]
+        if not len(ts):
+            return {"bucket_start": np.empty(0), "count": np.empty(0, dtype=np.int64),
+                    "rms_mean": np.empty(0), "rms_max": np.empty(0),
+                    "class_counts": np.empty((0, len(self.class_names)), dtype=np.int64)}
+        origin = np.floor((ts.min() if start is None else start) / bucket_s) * bucket_s
+        bucket = ((ts - origin) // bucket_s).astype(np.int64)
+        used, inverse = np.unique(bucket, return_inverse=True)
+        n = len(used)
+        count = np.bincount(inverse, minlength=n)
+        rms = rows["rms"].astype(np.float64)
+        rms_mean = np.bincount(inverse, weights=rms, minlength=n) / count
+        rms_max = np.full(n, -np.inf)
+        np.maximum.at(rms_max, inverse, rms)
+        num_classes = len(self.class_names)
+        class_counts = np.bincount(inverse * num_classes + rows["pred"].astype(np.int64),
+                                   minlength=n * num_classes).reshape(n, num_classes)
+        return {"bucket_start": origin + used * bucket_s, "count": count,
+                "rms_mean": rms_mean, "rms_max": rms_max, "class_counts": class_counts}
+
+    def export_data_csv(self, out_path, device=None, start=None, end=None, labels=None):
+        """
+        Escribe las filas en el esquema de data/datasets/data.csv con la
+        columna device delante (device, rms_value, is_day, weather_type,
+        sound_category), para que dataset_generator.py calcule la ventana
+        móvil de cada dispositivo por separado. sound_category es la clase
+        predicha salvo que se pase `labels` (una por fila de la consulta).
+        Las filas sin ningún flag de clima se omiten: un weather_type fuera
+        del vocabulario del modelo añadiría una columna al entrenar.
+        Devuelve (filas escritas, filas omitidas).
+        """
+        rows = self.query(device, start, end, columns=["device", "rms", "features", "pred"])
+        features = rows["features"]
+        names = self.feature_names
+        weather_cols = [i for i, name in enumerate(names) if name.startswith("weather_")]
+        weather_names = np.array([names[i][len("weather_"):] for i in weather_cols])
+        onehot = features[:, weather_cols]
+        keep = onehot.max(axis=1, initial=0.0) > 0.5
+        if labels is None:
+            labels = np.array(self.class_names)[rows["pred"].astype(np.int64)]
+        labels = np.asarray(labels)[keep]
+        weather = weather_names[onehot[keep].argmax(axis=1)]
+        is_day = np.where(features[keep, names.index("is_day")] >= 0.5, "día", "noche")
+        devices = self.device_names(rows["device"][keep])
+        rms = rows["rms"][keep]
+        with open(out_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["device", "rms_value", "is_day", "weather_type", "sound_category"])
+            writer.writerows(zip(
+                devices,
+                (int(v) if float(v).is_integer() else float(v) for v in rms),
+                is_day, weather, labels,
+            ))
+        return int(keep.sum()), int((~keep).sum())
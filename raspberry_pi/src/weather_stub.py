@@ -0,0 +1,114 @@
+"""
+weather_stub.py
+Servidor HTTP local que imita la respuesta de Open-Meteo usada por api.py.
+Sirve para probar WeatherService (y los benchmarks) sin salir a Internet:
+
+  python weather_stub.py --port 8081 --code 3
+  WEATHER_API_URL=http://127.0.0.1:8081/v1/forecast python main.py
+
+Cuenta las peticiones recibidas y puede simular fallos (--fail) y una API
+lenta (--delay). raspberry_pi/tests/test_weather_service.py lo usa para
+probar WeatherService.
+"""
+
+import argparse
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+UTC_OFFSET = -5 * 3600     # America/Bogota
+
+
+class WeatherStub:
+    """Estado del servidor falso: código de clima, fallos y peticiones."""
+
+    def __init__(self, weathercode=0, sunrise="05:45", sunset="17:55"):
+        self.weathercode = weathercode
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.fail = False
+        self.delay = 0.0           # s de espera antes de responder
+        self.requests = 0
+        self.daily_requests = 0
+        self._server = None
+
+    def payload(self, with_daily):
+        now = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=UTC_OFFSET)
+        data = {
+            "utc_offset_seconds": UTC_OFFSET,
+            "current_weather": {
+                "time": now.strftime("%Y-%m-%dT%H:%M"),
+                "weathercode": self.weathercode,
+            },
+        }
+        if with_daily:
+            days = [(now + datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range(2)]
+            data["daily"] = {
+                "time": days,
+                "sunrise": [f"{d}T{self.sunrise}" for d in days],
+                "sunset": [f"{d}T{self.sunset}" for d in days],
+            }
+        return data
+
+    def start(self, host="127.0.0.1", port=0):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                query = parse_qs(urlparse(self.path).query)
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if stub.fail:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                with_daily = "daily" in query
+                if with_daily:
+                    stub.daily_requests += 1
+                body = json.dumps(stub.payload(with_daily)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/forecast"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open-Meteo falso para pruebas locales")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--code", type=int, default=0, help="weathercode a devolver")
+    parser.add_argument("--fail", action="store_true", help="responder siempre 503")
+    parser.add_argument("--delay", type=float, default=0.0, help="segundos de espera por respuesta")
+    args = parser.parse_args()
+
+    stub = WeatherStub(args.code)
+    stub.fail = args.fail
+    stub.delay = args.delay
+    stub.start(port=args.port)
+    print(f"Open-Meteo falso en {stub.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,41 @@
+"""
+Pruebas de audio_stream.DeviceStream: la grabación WAV sigue al índice de
+muestra del ESP32 aunque haya huecos.
+
+  python -m pytest -q raspberry_pi/tests
+"""
+
+import os
+import sys
+import wave
+
+import numpy as np
+
+# Al final del path: src/secrets.py no debe tapar el módulo secrets de la stdlib
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import audio_stream  # noqa: E402
+
+
+def read_wav(path):
+    with wave.open(path, "rb") as w:
+        return np.frombuffer(w.readframes(w.getnframes()), dtype="<i2")
+
+
+def test_wav_stays_aligned_across_gaps(tmp_path):
+    stream = audio_stream.DeviceStream("esp-a", audio_stream.SpectralAnalyzer(), capacity=4096,
+                                       record_dir=str(tmp_path))
+    chunk = np.arange(1, 1001, dtype=np.int16)
+    stream.write(0, chunk)
+    stream.write(1500, chunk)               # hueco pequeño: cabe en el buffer
+    stream.write(12500, chunk)              # hueco mayor que el buffer: se reinicia
+    stream.write(13500, chunk)
+    stream.close()
+
+    recorded = read_wav(str(tmp_path / "esp-a.wav"))
+    assert len(recorded) == 14500
+    for start in (0, 1500, 12500, 13500):
+        np.testing.assert_array_equal(recorded[start:start + 1000], chunk)
+    assert not recorded[1000:1500].any()
+    assert not recorded[2500:12500].any()
+    assert stream.stats["lost_samples"] == 10500
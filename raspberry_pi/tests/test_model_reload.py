@@ -0,0 +1,109 @@
+"""
+Pruebas de la recarga del modelo en ml.py (check_model): al cambiar el
+archivo del modelo o sus metadatos se cargan los pesos y el escalado nuevos
+y se vacía la caché de predicciones.
+
+ml.py se configura por entorno al importarse, así que cada prueba corre en
+un proceso aparte con su propia copia del modelo (backend NumPy).
+
+  python -m pytest -q raspberry_pi/tests
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import textwrap
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SRC_DIR = os.path.join(REPO_ROOT, "raspberry_pi", "src")
+MODELS_DIR = os.path.join(REPO_ROOT, "data", "models")
+
+PRELUDE = """
+import json, sys, time
+import numpy as np
+sys.path.append({src!r})
+import ml
+
+MODEL = {model!r}
+RESULT = {result!r}
+ROW = [500, 480, 30, 1, 0, 0, 0, 0, 0, 0, 1]
+
+
+def predict():
+    indices, probs = ml.predict_batch([ROW])
+    return int(indices[0])
+
+
+def rewrite(bias=None, feature_max0=None, class_names=None):
+    weights = dict(np.load(MODEL))
+    if bias is not None:
+        last = max(int(k[1:]) for k in weights if k.startswith("b"))
+        weights[f"b{{last}}"] = weights[f"b{{last}}"] + np.asarray(bias, dtype=np.float32)
+    np.savez(MODEL, **weights)
+    meta_path = MODEL[:-len(".npz")] + ".json"
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if feature_max0 is not None:
+        meta["feature_max"][0] = feature_max0
+    if class_names is not None:
+        meta["class_names"] = class_names
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    time.sleep(0.05)    # más que SOUND_MODEL_CHECK_S
+
+
+def report(**values):
+    # A un archivo: el log muestreado escribe en stdout desde otro hilo
+    with open(RESULT, "w", encoding="utf-8") as f:
+        json.dump(values, f)
+"""
+
+
+def run(tmp_path, body):
+    for name in ("sound_classifier.npz", "sound_classifier.json"):
+        shutil.copy(os.path.join(MODELS_DIR, name), tmp_path / name)
+    model = str(tmp_path / "sound_classifier.npz")
+    env = dict(os.environ, SOUND_ML_BACKEND="numpy", SOUND_NUMPY_MODEL_PATH=model,
+               SOUND_PREDICTION_CACHE="64", SOUND_MODEL_CHECK_S="0.01", SOUND_METRICS_PORT="")
+    result_path = str(tmp_path / "result.json")
+    script = PRELUDE.format(src=SRC_DIR, model=model, result=result_path) + textwrap.dedent(body)
+    # cwd fuera de src/: src/secrets.py no debe tapar el módulo secrets de la stdlib
+    result = subprocess.run([sys.executable, "-c", script], cwd=str(tmp_path), env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    with open(result_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_model_change_reloads_weights_scaling_and_clears_cache(tmp_path):
+    out = run(tmp_path, """
+        before = predict()
+        predict()
+        hits = ml.prediction_cache.stats()["hits"]
+        # Modelo nuevo: la última capa favorece la clase 2 y cambia el máximo de rms_value
+        rewrite(bias=[0, 0, 100, 0], feature_max0=20000.0)
+        after = predict()
+        report(before=before, after=after, hits=hits, stats=ml.prediction_cache.stats(),
+               scale0=float(ml.encoder.scale[0]), reloads=ml._model_reloads.value)
+    """)
+    assert out["before"] != 2 and out["hits"] == 1
+    assert out["after"] == 2
+    assert out["stats"]["invalidations"] == 1
+    assert out["stats"]["entries"] == 1
+    assert abs(out["scale0"] - 1.0 / (20000.0 - 1.0)) < 1e-9
+    assert out["reloads"] == 1
+
+
+def test_incompatible_model_keeps_previous_one(tmp_path):
+    out = run(tmp_path, """
+        before = predict()
+        rewrite(bias=[0, 0, 100, 0], class_names=["a", "b", "c", "d"])
+        after = predict()
+        report(before=before, after=after, stats=ml.prediction_cache.stats(),
+               errors=ml._model_reload_errors.value)
+    """)
+    assert out["after"] == out["before"]
+    assert out["stats"]["invalidations"] == 0
+    assert out["errors"] >= 1
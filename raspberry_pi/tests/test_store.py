@@ -0,0 +1,188 @@
+"""
+Pruebas de store.TimeSeriesStore: añadir, reabrir y consultar por rango,
+recuperación tras una caída, retención por tamaño, agregados y exportación
+a data.csv (y su paso por data/datasets/dataset_generator.py).
+
+  python -m pytest -q raspberry_pi/tests
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Al final del path: src/secrets.py no debe tapar el módulo secrets de la stdlib
+sys.path.append(os.path.join(REPO_ROOT, "raspberry_pi", "src"))
+sys.path.append(os.path.join(REPO_ROOT, "data", "datasets"))
+
+import dataset_generator  # noqa: E402
+import store  # noqa: E402
+from rolling import rolling_mean_std  # noqa: E402
+
+with open(os.path.join(REPO_ROOT, "data", "models", "sound_classifier.json"), encoding="utf-8") as _f:
+    METADATA = json.load(_f)
+FEATURE_NAMES = METADATA["feature_names"]
+CLASS_NAMES = METADATA["class_names"]
+WEATHERS = [name[len("weather_"):] for name in FEATURE_NAMES if name.startswith("weather_")]
+
+
+def features(rms, weather="soleado", is_day=1):
+    """Vector crudo como el de FeatureEncoder.raw_features (weather=None: sin flag)."""
+    x = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+    x[0] = rms
+    x[FEATURE_NAMES.index("is_day")] = is_day
+    if weather is not None:
+        x[FEATURE_NAMES.index(f"weather_{weather}")] = 1.0
+    return x
+
+
+def probs(pred):
+    p = np.zeros(len(CLASS_NAMES), dtype=np.float32)
+    p[pred] = 1.0
+    return p
+
+
+@pytest.fixture
+def new_store(tmp_path):
+    return store.TimeSeriesStore(str(tmp_path / "store"), FEATURE_NAMES, CLASS_NAMES, max_bytes=0)
+
+
+def test_export_interleaved_devices_through_generator(new_store, tmp_path):
+    # Dos ESP32 intercalados con niveles muy distintos: una ventana mezclada
+    # daría medias intermedias
+    rms = {"esp-a": [100, 110, 90, 120, 105, 95, 115, 100, 98, 102, 111, 99],
+           "esp-b": [3000, 3200, 2800, 3100, 2900, 3050, 2950, 3150, 3010, 2990, 3020, 2980]}
+    ts = 1.0
+    for i in range(len(rms["esp-a"])):
+        for device in ("esp-a", "esp-b"):
+            pred = 1 if device == "esp-a" else 3
+            new_store.append(device, ts, rms[device][i], features(rms[device][i], "lloviendo", 0),
+                             pred, probs(pred))
+            ts += 1.0
+
+    data_csv = tmp_path / "data.csv"
+    written, skipped = new_store.export_data_csv(str(data_csv))
+    assert (written, skipped) == (24, 0)
+    exported = pd.read_csv(data_csv)
+    assert list(exported.columns) == ["device", "rms_value", "is_day", "weather_type", "sound_category"]
+    assert list(exported["device"][:4]) == ["esp-a", "esp-b", "esp-a", "esp-b"]
+
+    dataset_csv = tmp_path / "dataset.csv"
+    _, rows = dataset_generator.generate(data_csv, dataset_csv, chunk_rows=5)
+    assert rows == 24
+    dataset = pd.read_csv(dataset_csv)
+    for device, values in rms.items():
+        out = dataset[dataset["device"] == device]
+        means, stds = rolling_mean_std(np.array(values, dtype=float), dataset_generator.WINDOW)
+        np.testing.assert_allclose(out["rms_avg"], means, rtol=1e-9)
+        np.testing.assert_allclose(out["rms_std"], stds, rtol=1e-9, atol=1e-9)
+    assert set(dataset["weather_type"]) == {"lloviendo"}
+    assert set(dataset["is_day"]) == {"noche"}
+    assert list(dataset.loc[dataset["device"] == "esp-b", "sound_category"].unique()) == [CLASS_NAMES[3]]
+
+
+def test_export_skips_rows_without_weather(new_store, tmp_path):
+    new_store.append("esp-a", 1.0, 100, features(100, "soleado"), 0, probs(0))
+    new_store.append("esp-a", 2.0, 200, features(200, None), 0, probs(0))
+    new_store.append("esp-a", 3.0, 300, features(300, "con niebla"), 2, probs(2))
+
+    out = tmp_path / "data.csv"
+    assert new_store.export_data_csv(str(out), labels=["x", "y", "z"]) == (2, 1)
+    exported = pd.read_csv(out)
+    # Solo climas del vocabulario del modelo: get_dummies no añade columnas
+    assert set(exported["weather_type"]) <= set(WEATHERS)
+    assert list(exported["rms_value"]) == [100, 300]
+    assert list(exported["sound_category"]) == ["x", "z"]
+
+
+def fill(target, device, start_ts, n, rms0=100):
+    for i in range(n):
+        pred = i % len(CLASS_NAMES)
+        target.append(device, start_ts + i, rms0 + i, features(rms0 + i), pred, probs(pred))
+
+
+def test_append_flush_reopen_range_query(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "SEGMENT_ROWS", 8)
+    path = str(tmp_path / "store")
+    s = store.TimeSeriesStore(path, FEATURE_NAMES, CLASS_NAMES, max_bytes=0)
+    fill(s, "esp-a", 0.0, 20)
+    s.append_batch("esp-b", np.arange(100.0, 105.0), np.full(5, 7.0),
+                   np.stack([features(7.0)] * 5), np.zeros(5), np.stack([probs(0)] * 5))
+    s.close()
+
+    reopened = store.TimeSeriesStore(path)
+    assert reopened.devices() == ["esp-a", "esp-b"]
+    assert [m["rows"] for m in reopened._index["segments"]] == [8, 8, 8, 1]
+
+    rows = reopened.query("esp-a", start=5.0, end=15.0)
+    np.testing.assert_array_equal(rows["ts"], np.arange(5.0, 15.0))
+    np.testing.assert_array_equal(rows["rms"], np.arange(105.0, 115.0))
+    np.testing.assert_array_equal(rows["pred"], np.arange(5, 15) % len(CLASS_NAMES))
+    np.testing.assert_allclose(rows["features"][:, 0], rows["rms"])
+    assert len(reopened.query("esp-b")["ts"]) == 5
+    assert len(reopened.query("esp-b", end=100.0)["ts"]) == 0
+    assert len(reopened.query("nadie")["ts"]) == 0
+    assert len(reopened.query()["ts"]) == 25
+
+    # Se sigue escribiendo en el último segmento abierto
+    fill(reopened, "esp-b", 200.0, 3)
+    assert [m["rows"] for m in reopened._index["segments"]] == [8, 8, 8, 4]
+    assert len(reopened.query("esp-b")["ts"]) == 8
+
+
+def test_recovers_rows_and_devices_written_after_last_flush(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "SEGMENT_ROWS", 10)
+    path = str(tmp_path / "store")
+    s = store.TimeSeriesStore(path, FEATURE_NAMES, CLASS_NAMES, max_bytes=0)
+    fill(s, "esp-a", 1.0, 15)           # abre seg_000001 sin flush
+    fill(s, "esp-b", 100.0, 2)          # dispositivo nuevo sin flush
+    s._active[1].flush()                # lo que el sistema operativo lleve a disco
+    del s                               # "caída": sin close()
+
+    recovered = store.TimeSeriesStore(path)
+    assert len(recovered.query("esp-a")["ts"]) == 15
+    np.testing.assert_array_equal(recovered.query("esp-b")["ts"], [100.0, 101.0])
+    fill(recovered, "esp-c", 200.0, 1)
+    assert recovered.devices() == ["esp-a", "esp-b", "esp-c"]
+    np.testing.assert_array_equal(recovered.query("esp-c")["ts"], [200.0])
+    np.testing.assert_array_equal(recovered.query("esp-b")["ts"], [100.0, 101.0])
+
+
+def test_retention_drops_oldest_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "SEGMENT_ROWS", 4)
+    path = str(tmp_path / "store")
+    s = store.TimeSeriesStore(path, FEATURE_NAMES, CLASS_NAMES, max_bytes=0)
+    s.max_bytes = 2 * s.segment_bytes
+    fill(s, "esp-a", 0.0, 18)           # 5 segmentos: se conservan los 2 últimos
+
+    segments = sorted(d for d in os.listdir(path) if d.startswith("seg_"))
+    assert segments == ["seg_000003", "seg_000004"]
+    np.testing.assert_array_equal(s.query("esp-a")["ts"], np.arange(12.0, 18.0))
+    s.close()
+    reopened = store.TimeSeriesStore(path)
+    assert [m["id"] for m in reopened._index["segments"]] == [3, 4]
+    np.testing.assert_array_equal(reopened.query("esp-a")["ts"], np.arange(12.0, 18.0))
+
+
+def test_aggregate_buckets(new_store):
+    fill(new_store, "esp-a", 0.0, 120)
+    agg = new_store.aggregate("esp-a", bucket_s=60.0)
+    np.testing.assert_array_equal(agg["bucket_start"], [0.0, 60.0])
+    np.testing.assert_array_equal(agg["count"], [60, 60])
+    np.testing.assert_allclose(agg["rms_mean"], [129.5, 189.5])
+    np.testing.assert_array_equal(agg["rms_max"], [159.0, 219.0])
+    assert agg["class_counts"].sum() == 120
+    assert agg["class_counts"].shape == (2, len(CLASS_NAMES))
+
+
+def test_device_id_limit(new_store, monkeypatch):
+    monkeypatch.setattr(store, "MAX_DEVICES", 2)
+    fill(new_store, "esp-a", 0.0, 1)
+    fill(new_store, "esp-b", 1.0, 1)
+    with pytest.raises(ValueError):
+        fill(new_store, "esp-c", 2.0, 1)
+    assert new_store.devices() == ["esp-a", "esp-b"]
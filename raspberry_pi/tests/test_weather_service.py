@@ -0,0 +1,183 @@
+"""
+Pruebas de api.WeatherService contra el Open-Meteo falso (weather_stub.py),
+sin salir a Internet. El reloj de api se sustituye por uno manual para
+avanzar el TTL y las esperas sin dormir; las peticiones sí son HTTP reales.
+
+  python -m pytest -q raspberry_pi/tests
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+# Al final del path: src/secrets.py no debe tapar el módulo secrets de la stdlib
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import api  # noqa: E402
+from weather_stub import WeatherStub  # noqa: E402
+
+WAIT_S = 5.0
+
+
+class ManualClock:
+    """Sustituye al módulo time dentro de api: solo avanza con advance()."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def wait_for(predicate, timeout=WAIT_S):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+def settle(service):
+    """Espera a que termine la revalidación en curso (si la hay)."""
+    assert wait_for(lambda: not service._refreshing)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = ManualClock()
+    monkeypatch.setattr(api, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def stub():
+    stub = WeatherStub(weathercode=3).start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return str(tmp_path / "weather_snapshot.json")
+
+
+def make_service(stub, snapshot_path):
+    return api.WeatherService(base_url=stub.url, snapshot_path=snapshot_path)
+
+
+def test_one_request_per_ttl(clock, stub, snapshot_path):
+    service = make_service(stub, snapshot_path)
+    assert service.get_status() is None
+    assert service.wait_ready(WAIT_S)
+    settle(service)
+    assert stub.requests == 1
+    assert stub.daily_requests == 1
+
+    for _ in range(100):
+        assert service.get_status()[2] == 3
+    clock.advance(api.CURRENT_TTL - 1)
+    service.get_status()
+    settle(service)
+    assert stub.requests == 1
+
+    clock.advance(1)
+    service.get_status()
+    assert wait_for(lambda: stub.requests == 2)
+    settle(service)
+    # Amanecer/atardecer ya están en caché: solo se pide el clima actual
+    assert stub.daily_requests == 1
+    for _ in range(100):
+        service.get_status()
+    assert stub.requests == 2
+
+
+def test_stale_while_revalidate(clock, stub, snapshot_path):
+    service = make_service(stub, snapshot_path)
+    assert service.wait_ready(WAIT_S)
+    settle(service)
+
+    stub.weathercode = 61
+    stub.delay = 0.5
+    clock.advance(api.CURRENT_TTL)
+    start = time.monotonic()
+    status = service.get_status()
+    # No espera a la API: devuelve el valor caducado mientras se revalida
+    assert time.monotonic() - start < stub.delay
+    assert status[2] == 3
+    assert service._refreshing
+    assert service.get_status()[2] == 3
+
+    assert wait_for(lambda: service.get_status()[2] == 61)
+    assert service.get_status()[1] == "lloviendo"
+    assert stub.requests == 2
+
+
+def test_backoff_on_503(clock, stub, snapshot_path):
+    service = make_service(stub, snapshot_path)
+    assert service.wait_ready(WAIT_S)
+    settle(service)
+
+    stub.fail = True
+    clock.advance(api.CURRENT_TTL)
+    service.get_status()
+    assert wait_for(lambda: service.errors == 1)
+    settle(service)
+
+    expected = api.BACKOFF_MIN
+    waits = []
+    while len(waits) < 10:
+        requests = stub.requests
+        clock.advance(expected - 1)
+        # Durante la espera se sirve la caché y no se consulta la API
+        assert service.get_status()[2] == 3
+        settle(service)
+        assert stub.requests == requests
+
+        clock.advance(1)
+        service.get_status()
+        assert wait_for(lambda: service.errors == len(waits) + 2)
+        settle(service)
+        assert stub.requests == requests + 1
+        waits.append(expected)
+        expected = min(api.BACKOFF_MAX, expected * 2)
+
+    assert waits == [5, 10, 20, 40, 80, 160, 320, 600, 600, 600]
+
+    # Al recuperarse la API se reinicia la espera
+    stub.fail = False
+    clock.advance(api.BACKOFF_MAX)
+    service.get_status()
+    assert wait_for(lambda: service.stats()["failures_in_a_row"] == 0)
+    settle(service)
+    assert service._next_attempt == 0.0
+
+
+def test_snapshot_reload_on_restart(clock, stub, snapshot_path):
+    service = make_service(stub, snapshot_path)
+    assert service.wait_ready(WAIT_S)
+    settle(service)
+    assert os.path.exists(snapshot_path)
+    status = service.get_status()
+
+    # "Reinicio" con la API caída: el clima sale del snapshot sin pedir nada
+    stub.fail = True
+    requests = stub.requests
+    restarted = make_service(stub, snapshot_path)
+    assert restarted.wait_ready(0)
+    assert restarted.get_status() == status
+    assert restarted.is_day() == service.is_day()
+    settle(restarted)
+    assert stub.requests == requests
+
+    # Al caducar el snapshot se sigue sirviendo mientras la API falla
+    clock.advance(api.CURRENT_TTL)
+    assert restarted.get_status() == status
+    assert wait_for(lambda: restarted.errors == 1)
+    settle(restarted)
+    assert restarted.get_status() == status